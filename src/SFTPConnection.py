@@ -2,112 +2,442 @@ import paramiko
 import socket
 import os
 import stat
+import time
+import atexit
+import logging
+import threading
+from concurrent.futures import ThreadPoolExecutor
 
-class SFTPConnection:
-    def __init__(self, host, username, password, port=22):
-        self.host = host
-        self.username = username
+# Connexion
+CONNECT_TIMEOUT = 3.0  # Timeout de la connexion TCP et de la négociation SSH, en secondes
+CONNECT_RETRIES = 2  # Nouvelles tentatives après un échec de connexion
+RETRY_BACKOFF = 0.5  # Attente avant la première nouvelle tentative, doublée à chaque fois
+
+# Pool
+KEEPALIVE_INTERVAL = 30  # Intervalle des keep-alive SSH, en secondes
+HEALTH_CHECK_IDLE = 10.0  # Une session inutilisée depuis plus longtemps est vérifiée avant d'être prêtée
+IDLE_TIMEOUT = 300.0  # Une session inutilisée depuis plus longtemps est fermée
+MAX_IDLE_SESSIONS = 2  # Nombre maximal de sessions inactives gardées par serveur et utilisateur
+
+# Transferts
+WINDOW_SIZE = 16 * 1024 * 1024  # Fenêtre SSH, la fenêtre par défaut (2 Mo) limite le débit sur les liens à forte latence
+TRANSFER_WORKERS = 4  # Fichiers transférés en parallèle, chacun sur sa propre connexion
+PROGRESS_INTERVAL = 0.5  # Intervalle minimal entre deux rapports de progression, en secondes
+READ_SIZE = 1024 * 1024  # Taille des lectures des téléchargements
+DOWNLOAD_RETRIES = 5  # Reprises d'un téléchargement interrompu, avant d'abandonner
+PART_SUFFIX = ".part"  # Fichier partiel d'un téléchargement en cours
+PART_INFO_SUFFIX = ".part.info"  # Taille et date du fichier distant du téléchargement en cours
+
+paramiko.util.logging.getLogger().setLevel(paramiko.util.logging.WARNING)
+
+
+class SFTPError(Exception):
+    """Erreur de connexion au serveur SFTP, après les nouvelles tentatives."""
+
+
+class SFTPSession:
+    """Connexion SSH et client SFTP gardés ouverts par le pool."""
+
+    def __init__(self, key, password):
+        self.key = key
         self.password = password
-        self.port = port
         self.transport = None
         self.sftp = None
+        self.last_used = time.monotonic()
 
-    def connect(self):
-        """Établit une connexion SFTP si elle n'est pas déjà active."""
-        if self.sftp is None:
+    def open(self):
+        """Ouvre la connexion, lève une exception en cas d'échec."""
+        host, port, username = self.key
+        sock = socket.create_connection((host, port), timeout=CONNECT_TIMEOUT)
+        try:
+            self.transport = paramiko.Transport(sock, default_window_size=WINDOW_SIZE)
+            self.transport.banner_timeout = CONNECT_TIMEOUT
+            self.transport.connect(username=username, password=self.password)
+            self.transport.set_keepalive(KEEPALIVE_INTERVAL)
+            self.sftp = paramiko.SFTPClient.from_transport(self.transport)
+        except Exception:
+            self.close()
+            sock.close()
+            raise
+
+    def is_active(self):
+        """Indique si la connexion est toujours ouverte."""
+        return self.transport is not None and self.transport.is_active()
+
+    def check(self):
+        """Vérifie la session par un aller-retour avec le serveur si elle n'a pas servi récemment."""
+        if not self.is_active():
+            return False
+        if time.monotonic() - self.last_used < HEALTH_CHECK_IDLE:
+            return True
+        try:
+            self.sftp.normalize(".")
+            return True
+        except Exception:
+            return False
+
+    def close(self):
+        """Ferme la session."""
+        for handle in (self.sftp, self.transport):
+            if handle is not None:
+                try:
+                    handle.close()
+                except Exception:
+                    pass
+        self.sftp = None
+        self.transport = None
+
+
+class SFTPPool:
+    """Pool des sessions SFTP du processus, par serveur et utilisateur.
+
+    Chaque opération emprunte une session et la rend ensuite : les opérations de plusieurs threads utilisent des
+    sessions différentes, et la négociation SSH n'est faite qu'une fois tant que la connexion reste active.
+    """
+
+    def __init__(self):
+        self.m_idle = {}
+        """Sessions inactives, par clé (hôte, port, utilisateur)"""
+        self.m_lock = threading.Lock()
+        self.m_logger = logging.getLogger("website")
+
+    def acquire(self, host, username, password, port=22):
+        """Emprunte une session, ouverte si nécessaire.
+
+        :raises SFTPError: si la connexion échoue après CONNECT_RETRIES nouvelles tentatives
+        :return: la session, à rendre avec release
+        :rtype: SFTPSession
+        """
+        key = (host, int(port), username)
+        while True:
+            with self.m_lock:
+                self._close_expired()
+                sessions = self.m_idle.get(key, [])
+                session = sessions.pop() if sessions else None
+            if session is None:
+                break
+            if session.password == password and session.check():
+                return session
+            session.close()
+
+        session = SFTPSession(key, password)
+        delay = RETRY_BACKOFF
+        for attempt in range(CONNECT_RETRIES + 1):
             try:
-                # Étape 1 : Créer un socket avec un timeout
-                sock = socket.create_connection((self.host, self.port), timeout=0.5)  # timeout en secondes
+                session.open()
+                return session
+            except Exception as e:
+                error = e
+                self.m_logger.warning(
+                    f"SFTP connection to {username}@{host}:{port} failed (attempt {attempt + 1}): {e}"
+                )
+            if attempt < CONNECT_RETRIES:
+                time.sleep(delay)
+                delay *= 2
+        raise SFTPError(f"SFTP connection to {username}@{host}:{port} failed: {error}")
+
+    def release(self, session):
+        """Rend une session au pool, elle est fermée si elle n'est plus utilisable."""
+        session.last_used = time.monotonic()
+        if not session.is_active():
+            session.close()
+            return
+        with self.m_lock:
+            sessions = self.m_idle.setdefault(session.key, [])
+            if len(sessions) < MAX_IDLE_SESSIONS:
+                sessions.append(session)
+                return
+        session.close()
+
+    def _close_expired(self):
+        """Ferme les sessions inactives depuis plus de IDLE_TIMEOUT (appelé avec le verrou)."""
+        limit = time.monotonic() - IDLE_TIMEOUT
+        for key, sessions in list(self.m_idle.items()):
+            for session in [s for s in sessions if s.last_used < limit]:
+                sessions.remove(session)
+                session.close()
+            if not sessions:
+                del self.m_idle[key]
+
+    def close_all(self):
+        """Ferme toutes les sessions inactives."""
+        with self.m_lock:
+            sessions = [s for key_sessions in self.m_idle.values() for s in key_sessions]
+            self.m_idle = {}
+        for session in sessions:
+            session.close()
+
+
+sftp_pool = SFTPPool()
+atexit.register(sftp_pool.close_all)
+
+
+class TransferProgress:
+    """Progression d'un ensemble de transferts, éventuellement parallèles.
+
+    La fonction de rapport est appelée avec les octets transférés, le total et le débit en octets par seconde,
+    au plus toutes les PROGRESS_INTERVAL secondes, et à la fin.
+    """
+
+    def __init__(self, total, report=None):
+        self.total = total
+        self.report = report
+        self.done = 0
+        self.initial = 0  # Octets déjà présents au début (téléchargement repris), exclus du débit
+        self.start = time.monotonic()
+        self.last_report = 0.0
+        self.lock = threading.Lock()
+
+    def rate(self):
+        """Débit moyen depuis le début, en octets par seconde."""
+        elapsed = time.monotonic() - self.start
+        return (self.done - self.initial) / elapsed if elapsed > 0 else 0.0
+
+    def add(self, count):
+        """Ajoute des octets transférés, et publie la progression si nécessaire."""
+        with self.lock:
+            self.done += count
+            now = time.monotonic()
+            if self.report is None or now - self.last_report < PROGRESS_INTERVAL:
+                return
+            self.last_report = now
+        self.report(self.done, self.total, self.rate())
+
+    def file_callback(self):
+        """Retourne un callback paramiko (octets transférés, taille) pour un fichier."""
+        transferred = [0]
+
+        def callback(count, size):
+            self.add(count - transferred[0])
+            transferred[0] = count
+
+        return callback
 
-                # Étape 2 : Créer le transport avec le socket
-                self.transport = paramiko.Transport(sock)
-                paramiko.util.logging.getLogger().setLevel(paramiko.util.logging.WARNING)
+    def finish(self):
+        """Rapport final."""
+        if self.report is not None:
+            self.report(self.done, self.total, self.rate())
 
-                # Étape 3 : Connexion
-                self.transport.connect(username=self.username, password=self.password)
 
-                # Étape 4 : Créer le client SFTP
-                self.sftp = paramiko.SFTPClient.from_transport(self.transport)
+def format_rate(rate):
+    """Formate un débit en octets par seconde."""
+    for unit in ("B/s", "kB/s", "MB/s"):
+        if rate < 1000:
+            return f"{rate:.1f} {unit}"
+        rate /= 1000
+    return f"{rate:.1f} GB/s"
+
+
+def status_progress(scheduler, category, text):
+    """Retourne une fonction de progression qui publie l'avancement et le débit d'un transfert.
+
+    :param scheduler: le scheduler qui publie le statut (emit_status)
+    :param category: la catégorie du statut, le nom du module
+    :param text: le texte du statut
+    """
+    def progress(done, total, rate):
+        percent = min(99, done * 100 // total) if total else 0
+        scheduler.emit_status(category, text, percent, format_rate(rate))
+    return progress
+
+
+class SFTPConnection:
+    """Accès à un serveur SFTP, par les sessions du pool.
+
+    Les erreurs ne sont plus ignorées : une connexion impossible lève SFTPError, un chemin absent FileNotFoundError.
+    """
+
+    def __init__(self, host, username, password, port=22):
+        self.host = host
+        self.username = username
+        self.password = password
+        self.port = port
+
+    def _run(self, operation):
+        """Exécute une opération avec une session du pool.
+
+        Si la connexion a été perdue pendant l'opération (session du pool coupée par le serveur),
+        elle est refaite une fois avec une nouvelle connexion.
+        """
+        for attempt in range(2):
+            session = sftp_pool.acquire(self.host, self.username, self.password, self.port)
+            try:
+                return operation(session.sftp)
             except Exception:
-                # print(f"Erreur de connexion SFTP: {e}")
-                self.sftp = None
+                if attempt == 0 and not session.is_active():
+                    continue
+                raise
+            finally:
+                sftp_pool.release(session)
+
+    def connect(self):
+        """Vérifie que le serveur est accessible, la session est gardée dans le pool."""
+        self._run(lambda sftp: None)
 
     def listdir(self, remote_path):
         """Retourne la liste des fichiers d'un répertoire."""
-        self.connect()
-        if self.sftp:
+        return self._run(lambda sftp: sftp.listdir(remote_path))
+
+    def download_file(self, remote_path, local_path, progress=None):
+        """Télécharge un fichier depuis le serveur SFTP, en reprenant là où un téléchargement précédent s'est arrêté.
+
+        Les données sont écrites dans local_path + PART_SUFFIX, renommé à la fin. Après une erreur, le téléchargement
+        reprend à la fin du fichier partiel (DOWNLOAD_RETRIES fois), y compris lors d'un appel ultérieur, tant que le
+        fichier distant n'a pas changé. Les blocs sont demandés à l'avance (prefetch) : le débit n'est pas limité par
+        la latence.
+
+        :param progress: fonction appelée avec (octets transférés, total, octets par seconde)
+        """
+        part_path = local_path + PART_SUFFIX
+        info_path = local_path + PART_INFO_SUFFIX
+        trackers = []
+
+        def operation(sftp):
+            attrs = sftp.stat(remote_path)
+            remote_id = f"{attrs.st_size} {attrs.st_mtime}"
+            offset = 0
             try:
-                return self.sftp.listdir(remote_path)
+                with open(info_path, "r") as file:
+                    if file.read() == remote_id and os.path.isfile(part_path):
+                        offset = min(os.path.getsize(part_path), attrs.st_size)
             except FileNotFoundError:
-                return []
-        return []
+                pass
+            if offset == 0:
+                # Nouveau téléchargement, ou fichier distant modifié depuis le téléchargement partiel
+                with open(info_path, "w") as file:
+                    file.write(remote_id)
+                open(part_path, "wb").close()
 
-    def download_file(self, remote_path, local_path):
-        """Télécharge un fichier depuis le serveur SFTP."""
-        self.connect()
-        if self.sftp:
-            try:
-                self.sftp.get(remote_path, local_path)
-            except Exception as e:
-                print(f"Erreur lors du téléchargement: {e}")
+            if not trackers:
+                trackers.append(TransferProgress(attrs.st_size, progress))
+                trackers[0].initial = offset
+            tracker = trackers[0]
+            tracker.done = offset
+
+            with sftp.open(remote_path, "rb") as remote, open(part_path, "r+b") as local:
+                local.truncate(offset)
+                local.seek(offset)
+                remote.seek(offset)
+                remote.prefetch(attrs.st_size)
+                while True:
+                    data = remote.read(READ_SIZE)
+                    if not data:
+                        break
+                    local.write(data)
+                    tracker.add(len(data))
 
-    def upload_file(self, local_path, remote_path):
-        """Envoie un fichier vers le serveur SFTP."""
-        self.connect()
-        if self.sftp:
+            if os.path.getsize(part_path) != attrs.st_size:
+                raise EOFError(f"Incomplete download of {remote_path}")
+            os.replace(part_path, local_path)
+            os.remove(info_path)
+            tracker.finish()
+
+        delay = RETRY_BACKOFF
+        for attempt in range(DOWNLOAD_RETRIES + 1):
             try:
-                self.sftp.put(local_path, remote_path)
+                self._run(operation)
+                return
+            except (FileNotFoundError, PermissionError):
+                raise
             except Exception as e:
-                print(f"Erreur lors de l'envoi du fichier: {e}")
+                if attempt == DOWNLOAD_RETRIES:
+                    raise
+                logging.getLogger("website").warning(f"Download of {remote_path} interrupted, resuming: {e}")
+                time.sleep(delay)
+                delay *= 2
+
+    def upload_file(self, local_path, remote_path, progress=None):
+        """Envoie un fichier vers le serveur SFTP.
+
+        Les écritures sont envoyées sans attendre leur acquittement (mode pipeline de paramiko).
+
+        :param progress: fonction appelée avec (octets transférés, total, octets par seconde)
+        """
+        tracker = TransferProgress(os.path.getsize(local_path), progress)
+        self._run(lambda sftp: sftp.put(local_path, remote_path, callback=tracker.file_callback()))
+        tracker.finish()
+
+    def _transfer_files(self, transfers, total, progress):
+        """Exécute des transferts en parallèle, chacun sur une session du pool.
+
+        :param transfers: liste de fonctions (sftp, callback) -> None
+        :param total: nombre total d'octets
+        :param progress: fonction appelée avec (octets transférés, total, octets par seconde)
+        """
+        tracker = TransferProgress(total, progress)
+        if not transfers:
+            tracker.finish()
+            return
+
+        def run(transfer):
+            callback = tracker.file_callback()
+            self._run(lambda sftp: transfer(sftp, callback))
+
+        with ThreadPoolExecutor(max_workers=min(TRANSFER_WORKERS, len(transfers))) as executor:
+            # La première erreur est levée une fois tous les transferts terminés
+            for future in [executor.submit(run, transfer) for transfer in transfers]:
+                future.result()
+        tracker.finish()
+
+    def upload_files(self, files, progress=None):
+        """Envoie plusieurs fichiers en parallèle.
+
+        :param files: liste de couples (chemin local, chemin distant)
+        :param progress: fonction appelée avec (octets transférés, total, octets par seconde)
+        """
+        transfers = [
+            lambda sftp, callback, local=local, remote=remote: sftp.put(local, remote, callback=callback)
+            for local, remote in files
+        ]
+        self._transfer_files(transfers, sum(os.path.getsize(local) for local, _ in files), progress)
 
     def mkdir(self, remote_path):
         """Crée un répertoire distant s'il n'existe pas."""
-        self.connect()
-        if self.sftp:
+        def operation(sftp):
             try:
-                self.sftp.mkdir(remote_path)
+                sftp.mkdir(remote_path)
             except OSError:
-                pass  # Le répertoire existe déjà
+                if not stat.S_ISDIR(sftp.stat(remote_path).st_mode):
+                    raise
+        self._run(operation)
 
     def close(self):
-        """Ferme proprement la connexion SFTP."""
-        if self.sftp:
-            self.sftp.close()
-            self.sftp = None
-        if self.transport:
-            self.transport.close()
-            self.transport = None
-            
+        """Les sessions restent dans le pool, voir sftp_pool.close_all pour les fermer."""
+        pass
+
     def exists(self, remote_path):
         """Vérifie si un fichier ou dossier existe sur le serveur distant."""
-        self.connect()
-        if self.sftp:
+        def operation(sftp):
             try:
-                self.sftp.stat(remote_path)
+                sftp.stat(remote_path)
                 return True
             except FileNotFoundError:
                 return False
-            except Exception as e:
-                print(f"Erreur lors du test d'existence de {remote_path}: {e}")
-                return False
-        return False
+        return self._run(operation)
 
-    def download_dir(self, remote_dir, local_dir):
-        """Télécharge récursivement un dossier depuis le SFTP."""
-        self.connect()
-        if self.sftp is None:
-            return
+    def download_dir(self, remote_dir, local_dir, progress=None):
+        """Télécharge récursivement un dossier depuis le SFTP.
 
-        os.makedirs(local_dir, exist_ok=True)
+        L'arborescence est d'abord listée, puis les fichiers sont téléchargés en parallèle.
 
-        for item in self.sftp.listdir_attr(remote_dir):
-            remote_path = f"{remote_dir}/{item.filename}"
-            local_path = os.path.join(local_dir, item.filename)
+        :param progress: fonction appelée avec (octets transférés, total, octets par seconde)
+        """
+        files = []
 
-            if stat.S_ISDIR(item.st_mode):
-                self.download_dir(remote_path, local_path)
-            else:
-                try:
-                    self.sftp.get(remote_path, local_path)
-                except Exception as e:
-                    print(f"Erreur lors du téléchargement de {remote_path}: {e}")
\ No newline at end of file
+        def walk(sftp, remote, local):
+            os.makedirs(local, exist_ok=True)
+            for item in sftp.listdir_attr(remote):
+                remote_path = f"{remote}/{item.filename}"
+                local_path = os.path.join(local, item.filename)
+                if stat.S_ISDIR(item.st_mode):
+                    walk(sftp, remote_path, local_path)
+                else:
+                    files.append((remote_path, local_path, item.st_size))
+
+        self._run(lambda sftp: walk(sftp, remote_dir, local_dir))
+
+        transfers = [
+            lambda sftp, callback, remote=remote, local=local: sftp.get(remote, local, callback=callback)
+            for remote, local, _ in files
+        ]
+        self._transfer_files(transfers, sum(size for _, _, size in files), progress)
@@ -1,15 +1,21 @@
 from submodules.framework.src import utilities
-from submodules.framework.src.security_utils import failed_login_manager, ATTEMPTS_BEFORE_LOCKOUT, LOCKOUT_DURATION
+from submodules.framework.src.security_utils import failed_login_manager, password_hasher, ATTEMPTS_BEFORE_LOCKOUT, LOCKOUT_DURATION
 from flask import session, current_app
-import bcrypt
 import logging
 import os
 import pickle
 import struct
+import hashlib
+import stat
+import threading
+import time
 
 logger = logging.getLogger("website")
 auth_object = None
 
+SESSION_CLEANUP_PERIOD = 3600
+"""Time, in seconds, between two deletions of the expired session files"""
+
 
 class Access_manager:
     """Class that handle user management. It provide easy method to get the
@@ -28,31 +34,60 @@ class Access_manager:
 
         self.m_users_groups = {}
 
+        self.m_index = {"users": {}, "modules": frozenset()}
+        """Permission index: for each user, the frozensets of its groups and of its authorized modules, and the modules that are configured"""
+        self.m_version = None
+        """Version of the configuration the index was built from"""
+
+        self.m_user_sessions = {}
+        """Session files of each user"""
+        self.m_session_users = {}
+        """User of each indexed session file"""
+        self.m_session_files = {}
+        """Modification time and expiration time of each session file read, to only read again the modified ones"""
+        self.m_sessions_cleanup = 0
+        self.m_sessions_lock = threading.Lock()
+
     def load_authorizations(self):
-        """Load the authorization file into the manager"""
+        """Load the authorization file into the manager, and build the permission index of the users"""
+        # Read before the configuration: if it changes in between, the index is built again on the next check
+        version = utilities.util_get_parameters_version()
         config = utilities.util_read_parameters()
 
         if "access" in config:
             self.m_users = config["access"]["users"]["value"]
-            self.m_users_groups = config["access"]["users_groups"]["value"]
+            self.m_users_groups = dict(config["access"]["users_groups"]["value"])
             self.m_groups = config["access"]["groups"]["value"]
             self.m_modules = config["access"]["modules"]["value"]
 
             if "username" not in session:
                 if ("default_user" in config["access"] and config["access"]["default_user"]["value"] in self.m_users):
                     session['username'] = config["access"]["default_user"]["value"]
+                    self._index_session(session['username'])
                 else:
                     session['username'] = "GUEST"
 
             # When creating a user, the user name is not in the authorization
             # file. Let's add it here, otherwise it will be too much a pain
-            # to do elsewhere
-            for user in config["access"]["users"]["value"]:
-                if user not in config["access"]["users_password"]["value"]:
-                    config["access"]["users_password"]["value"][user] = [""]
-
-                if user not in config["access"]["users_groups"]["value"]:
-                    config["access"]["users_groups"]["value"][user] = ["admin"]
+            # to do elsewhere. The configuration is read-only: only the manager
+            # copy is completed, a user without password is handled by the login
+            for user in self.m_users:
+                if user not in self.m_users_groups:
+                    self.m_users_groups[user] = ["admin"]
+
+            users = {}
+            for user, groups in self.m_users_groups.items():
+                groups = frozenset(groups)
+                modules = frozenset(module for module, allowed in self.m_modules.items() if not groups.isdisjoint(allowed))
+                users[user] = (groups, modules)
+            self.m_index = {"users": users, "modules": frozenset(self.m_modules)}
+
+        self.m_version = version
+
+    def _update_index(self):
+        """Build the permission index again if the configuration changed since the last time"""
+        if self.m_version != utilities.util_get_parameters_version():
+            self.load_authorizations()
 
     def get_login(self) -> bool:
         """Return the information as to if a user is logged
@@ -100,30 +135,146 @@ class Access_manager:
 
         if username and username != "GUEST":
             self._invalidate_all_sessions_for_user(username)
+            self._index_session("GUEST")
+
+    def _session_dir(self) -> str:
+        """Return the folder of the filesystem sessions
+
+        :return: The folder
+        :rtype: str
+        """
+        return current_app.config.get("SESSION_FILE_DIR", "flask_session")
+
+    def _session_file(self, sid: str) -> str:
+        """Return the path of the file of a filesystem session
+
+        :param sid: The id of the session
+        :type sid: str
+        :return: The path of the file
+        :rtype: str
+        """
+        cache = getattr(current_app.session_interface, "cache", None)
+        key = current_app.config.get("SESSION_KEY_PREFIX", "session:") + sid
+        if hasattr(cache, "_get_filename"):
+            return cache._get_filename(key)
+        # Name used by the FileSystemCache of cachelib
+        return os.path.join(self._session_dir(), hashlib.md5(key.encode("utf-8")).hexdigest())
+
+    def _index_session(self, username: str):
+        """Record that the current session belongs to a user, so that it can be found when the user logs out
+
+        :param username: The user of the current session
+        :type username: str
+        """
+        sid = getattr(session, "sid", None)
+        if not sid:
+            return
+        filepath = self._session_file(sid)
+        with self.m_sessions_lock:
+            previous = self.m_session_users.pop(filepath, None)
+            if previous in self.m_user_sessions:
+                self.m_user_sessions[previous].discard(filepath)
+            if username and username != "GUEST":
+                self.m_user_sessions.setdefault(username, set()).add(filepath)
+                self.m_session_users[filepath] = username
+
+    def _scan_sessions(self, session_dir: str, cleanup: bool):
+        """Update the index of the sessions of each user from the session files. Only the files that are new or
+        modified since the last scan are read: the sessions created before the start of the application, or written
+        by another process (auth_server.py has its own manager) are found too
+
+        :param session_dir: The folder of the sessions
+        :type session_dir: str
+        :param cleanup: Delete the expired session files
+        :type cleanup: bool
+        """
+        now = time.time()
+        max_age = current_app.config.get("PERMANENT_SESSION_LIFETIME")
+        max_age = max_age.total_seconds() if hasattr(max_age, "total_seconds") else max_age
+        deleted = 0
+        found = set()
+
+        for filename in os.listdir(session_dir):
+            filepath = os.path.join(session_dir, filename)
+            try:
+                st = os.stat(filepath)
+                if not stat.S_ISREG(st.st_mode):
+                    continue
+                found.add(filepath)
+
+                known = self.m_session_files.get(filepath)
+                if known is None or known[0] != st.st_mtime:
+                    with open(filepath, 'rb') as f:
+                        # Flask-Session filesystem format: 4-byte header (expiration time) + pickle payload
+                        header = f.read(4)
+                        if len(header) < 4:
+                            continue
+                        data = pickle.loads(f.read())
+
+                    self._unindex_session_file(filepath)
+                    username = data.get('username') if isinstance(data, dict) else None
+                    if username and username != "GUEST":
+                        self.m_user_sessions.setdefault(username, set()).add(filepath)
+                        self.m_session_users[filepath] = username
+                    known = self.m_session_files[filepath] = (st.st_mtime, struct.unpack("I", header)[0])
+
+                expires = known[1]
+                if cleanup and ((expires and expires < now) or (max_age and now - st.st_mtime > max_age)):
+                    os.remove(filepath)
+                    self._unindex_session_file(filepath)
+                    deleted += 1
+            except Exception:
+                # Skip corrupt, locked or partially written session files silently, they are read at the next scan
+                continue
+
+        # Session files deleted by another process
+        for filepath in set(self.m_session_files) - found:
+            self._unindex_session_file(filepath)
+
+        if cleanup:
+            self.m_sessions_cleanup = now
+        if deleted > 0:
+            logger.info(f"Deleted {deleted} expired session file(s)")
+
+    def _unindex_session_file(self, filepath: str):
+        """Remove a session file from the index
+
+        :param filepath: The path of the session file
+        :type filepath: str
+        """
+        self.m_session_files.pop(filepath, None)
+        username = self.m_session_users.pop(filepath, None)
+        if username in self.m_user_sessions:
+            self.m_user_sessions[username].discard(filepath)
 
     def _invalidate_all_sessions_for_user(self, username: str):
-        """Scan all filesystem session files and set username to GUEST
-        for every session that belongs to the given user.
+        """Set username to GUEST in every filesystem session that belongs to the given user.
+        Only the sessions of the user are read, thanks to the index of the sessions.
 
         :param username: The username whose sessions should be invalidated
         :type username: str
         """
         try:
-            session_dir = current_app.config.get("SESSION_FILE_DIR", "flask_session")
+            session_dir = self._session_dir()
             if not os.path.isdir(session_dir):
                 logger.warning(f"Session directory not found: {session_dir}")
                 return
 
-            invalidated = 0
-            current_sid = session.sid if hasattr(session, 'sid') else None
+            with self.m_sessions_lock:
+                self._scan_sessions(session_dir, time.time() - self.m_sessions_cleanup > SESSION_CLEANUP_PERIOD)
+                filepaths = self.m_user_sessions.pop(username, set())
+                for filepath in filepaths:
+                    # Read again at the next scan, whatever happens to them below
+                    self.m_session_users.pop(filepath, None)
+                    self.m_session_files.pop(filepath, None)
 
-            for filename in os.listdir(session_dir):
-                filepath = os.path.join(session_dir, filename)
-                if not os.path.isfile(filepath):
-                    continue
+            invalidated = 0
+            sid = getattr(session, "sid", None)
+            current_file = self._session_file(sid) if sid else None
 
+            for filepath in filepaths:
                 # Skip the current session (already handled above)
-                if current_sid and filename == current_sid:
+                if filepath == current_file:
                     continue
 
                 try:
@@ -144,7 +295,7 @@ class Access_manager:
                         invalidated += 1
 
                 except Exception:
-                    # Skip corrupt or locked session files silently
+                    # Skip deleted, corrupt or locked session files silently
                     continue
 
             if invalidated > 0:
@@ -196,6 +347,7 @@ class Access_manager:
         # Si l'utilisateur est déjà connecté ou si le mot de passe a été vérifié, mettez à jour la session
         if self.m_login or password_verified:
             session['username'] = user
+            self._index_session(user)
             return True
         else:
             session['username'] = "GUEST"
@@ -214,6 +366,8 @@ class Access_manager:
         config = utilities.util_read_parameters()
         users = config["access"]["users"]["value"]
         users_password = config["access"]["users_password"]["value"]
+        if "bcrypt_rounds" in config["access"]:
+            password_hasher.set_rounds(config["access"]["bcrypt_rounds"]["value"])
         
         # Vérifier si le compte est verrouillé
         is_locked, locked_until = failed_login_manager.is_locked(username)
@@ -237,16 +391,16 @@ class Access_manager:
             logger.info(f"Successful login for user '{username}' (no password required)")
             return True, None
         
-        # Vérifier le mot de passe avec bcrypt
+        # Vérifier le mot de passe avec bcrypt, hors du thread de la requête
         try:
             stored_password = users_password[username][0]
-            stored_hash = stored_password.encode('utf-8')
-            password_bytes = password.encode('utf-8')
-            
-            if bcrypt.checkpw(password_bytes, stored_hash):
+
+            if password_hasher.check(password, stored_password):
                 # Connexion réussie
                 failed_login_manager.reset_attempts(username)
                 logger.info(f"Successful login for user '{username}'")
+                if password_hasher.needs_rehash(stored_password):
+                    self._rehash_password(username, password, stored_password)
                 return True, None
             else:
                 # Mot de passe incorrect
@@ -268,6 +422,31 @@ class Access_manager:
             error_message = "Authentication error. Please contact administrator."
             return False, error_message
 
+    def _rehash_password(self, username: str, password: str, stored_password: str):
+        """Compute in the background the hash of a password at the current bcrypt cost, and store it in the configuration
+
+        :param username: The user
+        :type username: str
+        :param password: The password that was just verified
+        :type password: str
+        :param stored_password: The hash that was verified, it is not replaced if it changed meanwhile
+        :type stored_password: str
+        """
+        def store(future):
+            try:
+                new_hash = future.result().decode('utf-8')
+                config = utilities.util_copy_parameters()
+                users_password = config["access"]["users_password"]["value"]
+                if users_password.get(username, [""])[0] != stored_password:
+                    return
+                users_password[username][0] = new_hash
+                utilities.util_write_parameters(config)
+                logger.info(f"Password of user '{username}' rehashed with cost {password_hasher.rounds}")
+            except Exception as e:
+                logger.warning(f"Password rehash failed for user '{username}': {e}")
+
+        password_hasher.hash_async(password).add_done_callback(store)
+
     def authorize_group(self, allowed_groups: list = None) -> bool:
         """Indicate if the current user is in an authorized group
 
@@ -277,8 +456,7 @@ class Access_manager:
         is disabled, false otherwise
         :rtype: bool
         """
-        if not self.m_users_groups:
-            self.load_authorizations()
+        self._update_index()
 
         if not self.m_login:
             return True
@@ -290,14 +468,11 @@ class Access_manager:
         if not session['username']:
             return False
 
-        if session['username'] not in self.m_users_groups:
+        permissions = self.m_index["users"].get(session['username'])
+        if permissions is None or not allowed_groups:
             return False
 
-        for user_group in self.m_users_groups[session['username']]:
-            if user_group in allowed_groups:
-                return True
-
-        return False
+        return not permissions[0].isdisjoint(allowed_groups)
 
     def authorize_module(self, module: str) -> bool:
         """Indicate if the current user has access to the given module
@@ -311,27 +486,23 @@ class Access_manager:
         if not self.m_login:
             return True
 
+        self._update_index()
+
         # No identification was provided
         if 'username' not in session:
             # Check if we have a default user:
             self.load_authorizations()
 
-        if not session['username']:
-            self.load_authorizations()
-
-        if session['username'] not in self.m_users_groups:
-            self.load_authorizations()
-
-        for user_group in self.m_users_groups[session['username']]:
-            if module not in self.m_modules:
-                # Core modules are always in admin mode
-                if user_group == "admin":
-                    return True
+        index = self.m_index
+        permissions = index["users"].get(session['username'])
+        if permissions is None:
+            return False
 
-            elif user_group in self.m_modules[module]:
-                return True
+        if module not in index["modules"]:
+            # Core modules are always in admin mode
+            return "admin" in permissions[0]
 
-        return False
+        return module in permissions[1]
 
     def get_remaining_attempts(self, username: str) -> int:
         """Get the number of remaining login attempts for a user
@@ -343,62 +514,3 @@ class Access_manager:
         """
         from submodules.framework.src.security_utils import failed_login_manager
         return failed_login_manager.get_remaining_attempts(username)
-    
-    def check_login_attempt(self, username: str, password: str) -> tuple:
-        """Check login attempt with lockout management
-        
-        :param username: Username to check
-        :type username: str
-        :param password: Password to verify
-        :type password: str
-        :return: (success: bool, error_message: str or None)
-        :rtype: tuple
-        """
-        config = utilities.util_read_parameters()
-        users_password = config["access"]["users_password"]["value"]
-        
-        # Check if user is currently locked
-        is_locked, locked_until = failed_login_manager.is_locked(username)
-        if is_locked:
-            remaining_time = failed_login_manager.get_lockout_time_remaining(username)
-            minutes = int(remaining_time // 60)
-            seconds = int(remaining_time % 60)
-            error_message = f"Account locked. Try again in {minutes}m {seconds}s"
-            logger.warning(f"Blocked login attempt for locked user '{username}' (locked until {locked_until.strftime('%H:%M:%S')})")
-            return (False, error_message)
-        
-        # Check if user has no password (allowed)
-        if username not in users_password:
-            failed_login_manager.reset_attempts(username)
-            logger.info(f"Successful login for user '{username}' (no password required)")
-            return (True, None)
-        
-        # Verify password with bcrypt
-        stored_password = users_password[username][0]
-        stored_hash = stored_password.encode('utf-8')
-        password_bytes = password.encode('utf-8')
-        
-        try:
-            if bcrypt.checkpw(password_bytes, stored_hash):
-                # Successful login - reset failed attempts
-                failed_login_manager.reset_attempts(username)
-                logger.info(f"Successful login for user '{username}'")
-                return (True, None)
-            else:
-                # Failed login attempt
-                count = failed_login_manager.increment_attempts(username)
-                attempts_left = failed_login_manager.get_remaining_attempts(username)
-                
-                if count >= ATTEMPTS_BEFORE_LOCKOUT:
-                    # Account is now locked for LOCKOUT_DURATION seconds
-                    status = failed_login_manager.get_user_status(username)
-                    error_message = f"Too many failed attempts. Account locked for {LOCKOUT_DURATION // 60} minutes."
-                    logger.warning(f"Account '{username}' LOCKED for {LOCKOUT_DURATION // 60} minutes (until {status['locked_until'].strftime('%H:%M:%S')})")
-                else:
-                    error_message = f"Bad Password for this user ({attempts_left} attempts remaining)"
-                    logger.warning(f"Failed login attempt for user '{username}' ({attempts_left} attempts remaining)")
-                
-                return (False, error_message)
-        except Exception as e:
-            logger.error(f"CRITICAL: Exception during password verification for user '{username}': {e}")
-            return (False, "Authentication error. Please contact administrator.")
@@ -0,0 +1,495 @@
+"""Streaming extraction of the update archives (tar or zip).
+
+The names of all the members (and the targets of the links) are checked against path traversal first, before anything
+is written: the headers of a tar archive are read in a first streaming pass, the central directory of a zip archive
+is read directly. The members are then extracted in the order of the archive. The data of the files is handed in
+chunks to a writer thread through a bounded queue: the decompression and the writes to the disk run in parallel, and
+the memory used doesn't depend on the size of the files. The folders and the links are created by the reader itself,
+once the files before them are written, so that the paths of the next members resolve through them.
+
+The installed files with the same content are not rewritten. For zip archives, the size and CRC of the installed file
+are compared to the header of the member, which is then not even decompressed. Tar archives have no checksum: the
+data of a member with the same size as the installed file is compared to it while it is decompressed, and the file is
+only written from the first difference.
+
+The archives can come with a manifest, a sidecar file with their SHA-256 (in the sha256sum format), written when they
+are uploaded and verified before they are extracted. The manifest comes from the same server or folder as the archive,
+and the host key of the SFTP server is not checked: it detects a corrupted archive (interrupted or damaged transfer,
+disk error), not an archive replaced on purpose, whose manifest can be replaced too. The archives without manifest
+(uploaded before the manifests, or given as a file by the user) are accepted with a warning, unless MANIFEST_REQUIRED
+is set (see check_archive).
+"""
+import hashlib
+import logging
+import os
+import queue
+import tarfile
+import tempfile
+import threading
+import time
+import zipfile
+
+from submodules.framework.src import utilities
+
+CHUNK_SIZE = 1024 * 1024
+"""Size of the chunks of data handed to the writer thread"""
+QUEUE_CHUNKS = 16
+"""Maximum number of chunks waiting to be written, which bounds the memory used by the extraction"""
+PROGRESS_INTERVAL = 0.5
+"""Minimum time, in seconds, between two progress reports"""
+MANIFEST_SUFFIX = ".sha256"
+"""Suffix of the manifest of an archive"""
+MANIFEST_REQUIRED = False
+"""Refuse the archives without manifest, instead of accepting them with a warning"""
+SIDE_FILE_SUFFIXES = (MANIFEST_SUFFIX, ".part", ".part.info")
+"""Suffixes of the files that go with the archives (manifests, partial downloads of SFTPConnection), not to be listed as archives"""
+
+
+class Archive_writer(threading.Thread):
+    """Thread that writes the files of an archive, from the chunks put in its queue by the reader.
+
+    The items of the queue are ("begin", path, size, mode, mtime), ("data", chunk), ("end",) for each file,
+    ("sync", event) to wait for the items before it (see sync), and None to stop the thread. After an error, the
+    items are consumed and ignored until None, so the reader never blocks.
+    """
+
+    def __init__(self):
+        super().__init__(name="Archive_writer", daemon=True)
+        self.m_queue = queue.Queue(maxsize=QUEUE_CHUNKS)
+
+        self.m_error = None
+        """The first exception raised by a write, if any"""
+        self.m_written = 0
+        """Number of files written"""
+        self.m_skipped = 0
+        """Number of files already installed with the same content"""
+
+        self.m_path = None
+        self.m_mode = None
+        self.m_mtime = None
+        self.m_installed = None
+        """The installed file, opened while its content is the same as the member (tar only)"""
+        self.m_matched = 0
+        """Number of bytes of the member identical to the installed file"""
+        self.m_temp = None
+        self.m_temp_path = None
+
+    def run(self):
+        """Process the queue until None"""
+        while True:
+            item = self.m_queue.get()
+            if item is None:
+                # Stopped in the middle of a file if the reader failed
+                self._discard()
+                return
+            if item[0] == "sync":
+                item[1].set()
+                continue
+            if self.m_error:
+                continue
+            try:
+                if item[0] == "data":
+                    self._data(item[1])
+                elif item[0] == "begin":
+                    self._begin(*item[1:])
+                else:
+                    self._end()
+            except Exception as e:
+                self.m_error = e
+                self._discard()
+
+    def _begin(self, path: str, size: int, mode: int, mtime: float):
+        """Start a file
+
+        :param path: The path of the file to write
+        :type path: str
+        :param size: The size of the member
+        :type size: int
+        :param mode: The permissions of the file, None to keep the default ones
+        :type mode: int
+        :param mtime: The modification time of the file, None to keep the current time
+        :type mtime: float
+        """
+        self.m_path = path
+        self.m_mode = mode
+        self.m_mtime = mtime
+        self.m_matched = 0
+        if size > 0 and os.path.isfile(path) and os.path.getsize(path) == size:
+            self.m_installed = open(path, "rb")
+        else:
+            self._open_temp()
+
+    def sync(self):
+        """Wait until the items already in the queue are processed. Called by the reader"""
+        done = threading.Event()
+        self.m_queue.put(("sync", done))
+        done.wait()
+
+    def _open_temp(self):
+        """Open the temporary file that replaces the installed one at the end"""
+        folder, name = os.path.split(self.m_path)
+        fd, self.m_temp_path = tempfile.mkstemp(dir=folder, prefix="." + name + ".", suffix=".tmp")
+        self.m_temp = os.fdopen(fd, "wb")
+
+    def _data(self, chunk: bytes):
+        """Write, or compare, a chunk of the current file
+
+        :param chunk: The data
+        :type chunk: bytes
+        """
+        if self.m_installed:
+            if self.m_installed.read(len(chunk)) == chunk:
+                self.m_matched += len(chunk)
+                return
+
+            # First difference: write the identical beginning, then the rest of the member
+            self._open_temp()
+            self.m_installed.seek(0)
+            remaining = self.m_matched
+            while remaining:
+                data = self.m_installed.read(min(remaining, CHUNK_SIZE))
+                self.m_temp.write(data)
+                remaining -= len(data)
+            self.m_installed.close()
+            self.m_installed = None
+        self.m_temp.write(chunk)
+
+    def _end(self):
+        """Finish the current file: replace the installed one, or keep it if the content is the same"""
+        if self.m_installed:
+            self.m_installed.close()
+            self.m_installed = None
+            self.m_skipped += 1
+            return
+
+        self.m_temp.close()
+        self.m_temp = None
+        if self.m_mode is not None:
+            os.chmod(self.m_temp_path, self.m_mode)
+        if self.m_mtime is not None:
+            os.utime(self.m_temp_path, (self.m_mtime, self.m_mtime))
+        os.replace(self.m_temp_path, self.m_path)
+        self.m_temp_path = None
+        self.m_written += 1
+
+    def _discard(self):
+        """Close the current file after an error, the installed one is left untouched"""
+        for file in (self.m_installed, self.m_temp):
+            if file:
+                try:
+                    file.close()
+                except OSError:
+                    pass
+        self.m_installed = None
+        self.m_temp = None
+        if self.m_temp_path:
+            try:
+                os.remove(self.m_temp_path)
+            except OSError:
+                pass
+            self.m_temp_path = None
+
+
+def _check_path(root: str, name: str, follow: bool = False) -> str:
+    """Return the path where a member must be extracted, after checking that it stays in the destination
+
+    :param root: The real path of the destination
+    :type root: str
+    :param name: The name of the member, or the target of a link
+    :type name: str
+    :param follow: Resolve the last component of the path if it is a link, defaults to False: an installed link is
+        replaced by the member, not followed
+    :type follow: bool, optional
+    :raises ValueError: If the path is outside of the destination
+    :return: The path of the member
+    :rtype: str
+    """
+    target = os.path.normpath(os.path.join(root, name))
+    if follow:
+        target = os.path.realpath(target)
+    elif target != root:
+        folder, base = os.path.split(target)
+        target = os.path.join(os.path.realpath(folder), base)
+    if os.path.commonpath([root, target]) != root:
+        raise ValueError(f"Blocked path traversal in archive member: {name}")
+    return target
+
+
+def _check_members(root: str, members: list):
+    """Check the names of all the members of an archive, before anything is extracted
+
+    :param root: The real path of the destination
+    :type root: str
+    :param members: The (name, link target) of each member, the link target is None for the other types
+    :type members: list
+    :raises ValueError: If a member, or the target of a link, is outside of the destination
+    """
+    for name, linkname in members:
+        _check_path(root, name)
+        if linkname is not None:
+            _check_path(root, linkname, True)
+
+
+def _make_link(writer: Archive_writer, path: str, target: str, symbolic: bool):
+    """Create a link, in place of the installed file, once the files before it in the archive are written
+
+    :param writer: The writer thread
+    :type writer: Archive_writer
+    :param path: The path of the link
+    :type path: str
+    :param target: The target of a symbolic link as stored in the archive, or the path of the file of a hard link
+    :type target: str
+    :param symbolic: True for a symbolic link, False for a hard link
+    :type symbolic: bool
+    """
+    writer.sync()
+    if writer.m_error:
+        return
+    os.makedirs(os.path.dirname(path), exist_ok=True)
+    if os.path.lexists(path):
+        os.remove(path)
+    if symbolic:
+        os.symlink(target, path)
+    else:
+        os.link(target, path)
+    # The writer is idle until the next item
+    writer.m_written += 1
+
+
+def _write_member(writer: Archive_writer, path: str, source, size: int, mode: int, mtime: float):
+    """Hand the data of a member to the writer, chunk by chunk
+
+    :param writer: The writer thread
+    :type writer: Archive_writer
+    :param path: The path of the file to write
+    :type path: str
+    :param source: The file object of the member
+    :type source: file
+    :param size: The size of the member
+    :type size: int
+    :param mode: The permissions of the file, None to keep the default ones
+    :type mode: int
+    :param mtime: The modification time of the file, None to keep the current time
+    :type mtime: float
+    """
+    os.makedirs(os.path.dirname(path), exist_ok=True)
+    writer.m_queue.put(("begin", path, size, mode, mtime))
+    while not writer.m_error:
+        chunk = source.read(CHUNK_SIZE)
+        if not chunk:
+            break
+        writer.m_queue.put(("data", chunk))
+    writer.m_queue.put(("end",))
+
+
+def _extract_tar(archive, root: str, writer: Archive_writer, files: set, report):
+    """Extract a tar archive (compressed or not) as a stream
+
+    :param archive: The archive file, opened in binary mode
+    :type archive: file
+    :param root: The real path of the destination
+    :type root: str
+    :param writer: The writer thread
+    :type writer: Archive_writer
+    :param files: Filled with the normalized names of the files of the archive
+    :type files: set
+    :param report: Called with the name of each file and the number of bytes of the archive read
+    :type report: Function
+    """
+    logger = logging.getLogger("website")
+
+    # First pass on the headers only: the data of the members is skipped, not handed to the writer
+    members = []
+    with tarfile.open(fileobj=archive, mode="r|*") as tf:
+        for member in tf:
+            if member.issym():
+                members.append((member.name, os.path.join(os.path.dirname(member.name), member.linkname)))
+            else:
+                members.append((member.name, member.linkname if member.islnk() else None))
+    _check_members(root, members)
+
+    archive.seek(0)
+    with tarfile.open(fileobj=archive, mode="r|*") as tf:
+        for member in tf:
+            if writer.m_error:
+                return
+            # Checked again on the disk: the folders of the path can be links extracted before this member
+            path = _check_path(root, member.name)
+            if member.isdir():
+                os.makedirs(path, exist_ok=True)
+            elif member.isfile():
+                files.add(os.path.normpath(member.name))
+                _write_member(writer, path, tf.extractfile(member), member.size, member.mode & 0o7777, member.mtime)
+            elif member.issym() or member.islnk():
+                # The target of the link must stay in the destination too
+                if member.issym():
+                    _check_path(root, os.path.join(os.path.dirname(member.name), member.linkname), True)
+                    target = member.linkname
+                else:
+                    target = _check_path(root, member.linkname, True)
+                _make_link(writer, path, target, member.issym())
+            else:
+                logger.warning(f"Archive member {member.name} ignored: unsupported type")
+            report(member.name, archive.tell())
+
+
+def _extract_zip(archive, root: str, writer: Archive_writer, files: set, report):
+    """Extract a zip archive
+
+    :param archive: The archive file, opened in binary mode
+    :type archive: file
+    :param root: The real path of the destination
+    :type root: str
+    :param writer: The writer thread
+    :type writer: Archive_writer
+    :param files: Filled with the normalized names of the files of the archive
+    :type files: set
+    :param report: Called with the name of each file and the number of bytes of the archive read
+    :type report: Function
+    """
+    with zipfile.ZipFile(archive, mode="r") as zf:
+        _check_members(root, [(info.filename, None) for info in zf.infolist()])
+        position = 0
+        for info in zf.infolist():
+            if writer.m_error:
+                return
+            path = _check_path(root, info.filename)
+            position += info.compress_size
+            if info.is_dir():
+                os.makedirs(path, exist_ok=True)
+                continue
+
+            files.add(os.path.normpath(info.filename))
+            if (
+                os.path.isfile(path)
+                and os.path.getsize(path) == info.file_size
+                and utilities.utils_calculate_crc32(path) == info.CRC
+            ):
+                # Same size and CRC: not even decompressed
+                writer.m_skipped += 1
+            else:
+                mode = (info.external_attr >> 16) & 0o7777
+                with zf.open(info) as source:
+                    _write_member(writer, path, source, info.file_size, mode or None, None)
+            report(info.filename, position)
+
+
+def extract_archive(archive_path: str, destination: str, progress=None) -> dict:
+    """Extract an archive as a stream, skipping the files already installed with the same content
+
+    :param archive_path: The path of the archive, a zip file or a tar file (compressed or not)
+    :type archive_path: str
+    :param destination: The folder where the archive is extracted
+    :type destination: str
+    :param progress: Function called with the name of the current file and the progress in percent (0 to 99),
+        at most every PROGRESS_INTERVAL seconds, defaults to None
+    :type progress: Function, optional
+    :raises ValueError: If a member would be extracted outside of the destination. Nothing is extracted, unless the
+        member only leaves the destination through a link of the disk, detected when it is reached
+    :return: A dictionnary with "files" (set of the normalized names of the files of the archive),
+        "written" and "skipped" (number of files written, and already installed)
+    :rtype: dict
+    """
+    root = os.path.realpath(destination)
+    total = max(os.path.getsize(archive_path), 1)
+    files = set()
+    last_report = [0.0]
+
+    def report(name: str, position: int):
+        now = time.monotonic()
+        if progress and now - last_report[0] >= PROGRESS_INTERVAL:
+            last_report[0] = now
+            progress(name, min(99, position * 100 // total))
+
+    writer = Archive_writer()
+    writer.start()
+    try:
+        with open(archive_path, "rb") as archive:
+            if zipfile.is_zipfile(archive):
+                archive.seek(0)
+                _extract_zip(archive, root, writer, files, report)
+            else:
+                archive.seek(0)
+                _extract_tar(archive, root, writer, files, report)
+    finally:
+        writer.m_queue.put(None)
+        writer.join()
+
+    if writer.m_error:
+        raise writer.m_error
+    return {"files": files, "written": writer.m_written, "skipped": writer.m_skipped}
+
+
+def file_sha256(path: str) -> str:
+    """Compute the SHA-256 of a file, by blocks
+
+    :param path: The path of the file
+    :type path: str
+    :return: The digest, in hexadecimal
+    :rtype: str
+    """
+    digest = hashlib.sha256()
+    with open(path, "rb") as file:
+        for block in iter(lambda: file.read(CHUNK_SIZE), b""):
+            digest.update(block)
+    return digest.hexdigest()
+
+
+def write_manifest(archive_path: str) -> str:
+    """Write the manifest of an archive, unless it is already up to date
+
+    :param archive_path: The path of the archive
+    :type archive_path: str
+    :return: The path of the manifest
+    :rtype: str
+    """
+    manifest_path = archive_path + MANIFEST_SUFFIX
+    if os.path.isfile(manifest_path) and os.path.getmtime(manifest_path) >= os.path.getmtime(archive_path):
+        return manifest_path
+
+    content = file_sha256(archive_path) + "  " + os.path.basename(archive_path) + "\n"
+    temp_path = manifest_path + ".tmp"
+    with open(temp_path, "w", encoding="utf-8") as file:
+        file.write(content)
+    os.replace(temp_path, manifest_path)
+    return manifest_path
+
+
+def verify_manifest(archive_path: str) -> bool:
+    """Verify an archive against its manifest. This is an integrity check (corruption), not an authenticity check
+
+    :param archive_path: The path of the archive
+    :type archive_path: str
+    :raises ValueError: If the archive doesn't match its manifest, or the manifest is invalid
+    :return: True if the archive matches its manifest, False if it has no manifest
+    :rtype: bool
+    """
+    manifest_path = archive_path + MANIFEST_SUFFIX
+    try:
+        with open(manifest_path, "r", encoding="utf-8") as file:
+            fields = file.read().split()
+    except FileNotFoundError:
+        return False
+
+    if not fields or len(fields[0]) != 64:
+        raise ValueError(f"Invalid manifest {manifest_path}")
+    if file_sha256(archive_path) != fields[0].lower():
+        raise ValueError(f"{os.path.basename(archive_path)} doesn't match its manifest, the archive is corrupted")
+    return True
+
+
+def check_archive(archive_path: str) -> bool:
+    """Check an archive before it is extracted, with the policy for the archives without manifest (MANIFEST_REQUIRED)
+
+    :param archive_path: The path of the archive
+    :type archive_path: str
+    :raises ValueError: If the archive doesn't match its manifest, or it has none and MANIFEST_REQUIRED is set
+    :return: True if the archive matches its manifest, False if it has none and is accepted anyway
+    :rtype: bool
+    """
+    if verify_manifest(archive_path):
+        return True
+    if MANIFEST_REQUIRED:
+        raise ValueError(f"{os.path.basename(archive_path)} has no manifest, it can't be verified")
+    logging.getLogger("website").warning(f"{os.path.basename(archive_path)} has no manifest, installed without verification")
+    return False
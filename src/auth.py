@@ -10,40 +10,24 @@ from datetime import datetime, timedelta
 import socket
 import logging
 import time
-from pathlib import Path
 
 from submodules.framework.src import utilities
 from submodules.framework.src import access_manager
 from submodules.framework.src import site_conf
+from submodules.framework.src import otp_record
 from submodules.framework.src.otp_manager import get_otp_manager, is_otp_enabled
 from submodules.framework.src.security_utils import failed_login_manager, ATTEMPTS_BEFORE_LOCKOUT, LOCKOUT_DURATION
 
 logger = logging.getLogger("website")
 bp = Blueprint("auth", __name__, url_prefix="")
 
-# Auth activity signal file configuration
-AUTH_SIGNAL_BASE_PATH = "/var/lib/dfnet"
-AUTH_SIGNAL_SUBDIR = "oufnis"
-AUTH_SIGNAL_FILENAME = "auth_active"
-
-
-def _get_auth_signal_path() -> Path:
-    """Get the path to the auth activity signal file."""
-    target_type = 'hmi'
-    return Path(AUTH_SIGNAL_BASE_PATH) / target_type / AUTH_SIGNAL_SUBDIR / AUTH_SIGNAL_FILENAME
-
-
 def _update_auth_signal():
-    """Update the auth activity signal file with current timestamp."""
+    """Update the auth activity time in the shared OTP record."""
     if not is_otp_enabled():
         return  # Only on target
     
-    signal_path = _get_auth_signal_path()
-    try:
-        signal_path.parent.mkdir(parents=True, exist_ok=True)
-        signal_path.write_text(str(time.time()))
-    except Exception as e:
-        logger.warning(f"Failed to update auth signal: {e}")
+    if not otp_record.get_otp_record().write(auth_activity=time.time()):
+        logger.warning(f"Failed to update auth signal in {otp_record.RECORD_PATH}")
 
 
 @bp.route("/auth", methods=["GET", "POST"])
@@ -54,14 +38,13 @@ def auth():
     
     access_manager.auth_object.unlog()
     config = utilities.util_read_parameters()
-    users = config["access"]["users"]["value"]
+    users = sorted(config["access"]["users"]["value"])
 
     error_message = None
     cooldown_remaining = 0
     attempts_remaining = ATTEMPTS_BEFORE_LOCKOUT
 
     # Sort users and remove GUEST if present
-    users.sort()
     if "GUEST" in users:
         users.remove("GUEST")
 
@@ -213,11 +196,8 @@ def auth_close():
     if not is_otp_enabled():
         return jsonify({"status": "ok"})
     
-    signal_path = _get_auth_signal_path()
-    try:
-        if signal_path.exists():
-            signal_path.write_text("0")  # Set to 0 to indicate closed
-    except Exception as e:
-        logger.warning(f"Failed to clear auth signal: {e}")
+    # Set to 0 to indicate closed
+    if not otp_record.get_otp_record().write(auth_activity=0.0):
+        logger.warning(f"Failed to clear auth signal in {otp_record.RECORD_PATH}")
     
     return jsonify({"status": "ok"})
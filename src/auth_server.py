@@ -59,14 +59,13 @@ def create_auth_app():
         """Authentication page for OnTarget mode"""
         access_manager.auth_object.unlog()
         config = utilities.util_read_parameters()
-        users = config["access"]["users"]["value"]
+        users = sorted(config["access"]["users"]["value"])
 
         error_message = None
         cooldown_remaining = 0
         attempts_remaining = ATTEMPTS_BEFORE_LOCKOUT
 
         # Sort users and remove GUEST if present
-        users.sort()
         if "GUEST" in users:
             users.remove("GUEST")
 
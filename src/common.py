@@ -62,12 +62,11 @@ def login():
     """Login page"""
     access_manager.auth_object.unlog()
     config = utilities.util_read_parameters()
-    users = config["access"]["users"]["value"]
+    users = sorted(config["access"]["users"]["value"])
 
     error_message = None
 
     # Sort users and remove GUEST if present
-    users.sort()
     if "GUEST" in users:
         users.remove("GUEST")
 
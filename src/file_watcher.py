@@ -0,0 +1,127 @@
+"""Watch files for modifications with inotify, without polling.
+
+inotify is only available on Linux: elsewhere get_file_watcher() returns None and the callers must check the
+modification time of the files themselves. The parent folder is watched, so that a file replaced by a rename
+(atomic write) is still followed.
+"""
+import ctypes
+import ctypes.util
+import os
+import struct
+import sys
+import threading
+import logging
+
+IN_MODIFY = 0x00000002
+IN_ATTRIB = 0x00000004
+IN_CLOSE_WRITE = 0x00000008
+IN_MOVED_FROM = 0x00000040
+IN_MOVED_TO = 0x00000080
+IN_CREATE = 0x00000100
+IN_DELETE = 0x00000200
+IN_IGNORED = 0x00008000
+
+WATCH_MASK = IN_MODIFY | IN_ATTRIB | IN_CLOSE_WRITE | IN_MOVED_FROM | IN_MOVED_TO | IN_CREATE | IN_DELETE
+
+EVENT_HEADER = struct.Struct("iIII")
+"""struct inotify_event: wd, mask, cookie, len, followed by the name"""
+
+_WATCHER = None
+_WATCHER_LOCK = threading.Lock()
+
+
+class File_watcher:
+    """Thread that reads the inotify events and calls the callbacks registered for each file"""
+
+    def __init__(self, libc: ctypes.CDLL):
+        """Create the inotify instance and start the reading thread
+
+        :param libc: The C library that provides the inotify functions
+        :type libc: ctypes.CDLL
+        :raises OSError: If inotify can't be initialized
+        """
+        self.m_libc = libc
+        self.m_fd = libc.inotify_init()
+        if self.m_fd < 0:
+            raise OSError(ctypes.get_errno(), "inotify_init failed")
+
+        self.m_folders = {}
+        """Watch descriptor of each watched folder"""
+        self.m_callbacks = {}
+        """Callbacks for each (watch descriptor, file name)"""
+        self.m_lock = threading.Lock()
+        self.m_logger = logging.getLogger("website")
+
+        self.m_thread = threading.Thread(target=self.run, name="File_watcher", daemon=True)
+        self.m_thread.start()
+
+    def watch(self, path: str, callback) -> bool:
+        """Call a function each time a file is created, modified, replaced or deleted
+
+        :param path: The path of the file
+        :type path: str
+        :param callback: The function to call, with the path as argument. It is called from the watcher thread and must be short
+        :type callback: Function
+        :return: True if the file is watched
+        :rtype: bool
+        """
+        folder, name = os.path.split(os.path.abspath(path))
+        with self.m_lock:
+            if folder not in self.m_folders:
+                wd = self.m_libc.inotify_add_watch(self.m_fd, os.fsencode(folder), WATCH_MASK)
+                if wd < 0:
+                    return False
+                self.m_folders[folder] = wd
+            key = (self.m_folders[folder], name)
+            self.m_callbacks.setdefault(key, []).append((path, callback))
+        return True
+
+    def run(self):
+        """Read the events and dispatch them"""
+        while True:
+            try:
+                data = os.read(self.m_fd, 4096)
+            except OSError as e:
+                self.m_logger.warning("File watcher stopped: " + str(e))
+                return
+
+            position = 0
+            while position + EVENT_HEADER.size <= len(data):
+                wd, mask, _, length = EVENT_HEADER.unpack_from(data, position)
+                position += EVENT_HEADER.size
+                name = os.fsdecode(data[position:position + length].rstrip(b"\0"))
+                position += length
+
+                if mask & IN_IGNORED:
+                    continue
+
+                with self.m_lock:
+                    callbacks = list(self.m_callbacks.get((wd, name), []))
+                for path, callback in callbacks:
+                    try:
+                        callback(path)
+                    except Exception as e:
+                        self.m_logger.warning("File watcher callback failed for " + path + ": " + str(e))
+
+
+def get_file_watcher() -> File_watcher:
+    """Return the inotify watcher of the process, created on first use
+
+    :return: The watcher, or None if inotify is not available on this system
+    :rtype: File_watcher
+    """
+    global _WATCHER
+    if _WATCHER is not None:
+        return _WATCHER or None
+
+    with _WATCHER_LOCK:
+        if _WATCHER is None:
+            _WATCHER = False
+            if sys.platform.startswith("linux"):
+                try:
+                    libc = ctypes.CDLL(ctypes.util.find_library("c"), use_errno=True)
+                    libc.inotify_add_watch.argtypes = [ctypes.c_int, ctypes.c_char_p, ctypes.c_uint32]
+                    _WATCHER = File_watcher(libc)
+                except (OSError, AttributeError):
+                    _WATCHER = False
+    return _WATCHER or None
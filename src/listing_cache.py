@@ -0,0 +1,162 @@
+"""Cache of the listings of the package servers (SFTP) and shared folders, for the update and package pages.
+
+The pages render from the cache and never wait for the server: a listing older than LISTING_TTL, or invalidated
+after an upload or a download, is refreshed in a background thread and the previous one is displayed meanwhile. The
+listings are also refreshed periodically by the long term scheduler (see refresh_listings).
+"""
+import logging
+import threading
+import time
+
+LISTING_TTL = 300
+"""Age, in seconds, after which a listing is refreshed when it is displayed"""
+LISTING_REFRESH_PERIOD = 5
+"""Period, in minutes, of the refresh of all the listings by the long term scheduler"""
+FIRST_LOAD_WAIT = 1.0
+"""Maximum time, in seconds, a page waits for a listing that was never retrieved"""
+LISTING_UNUSED_TIMEOUT = 24 * 3600
+"""Listings not displayed for this time, in seconds, are no longer refreshed and are forgotten"""
+
+
+class Listing_entry:
+    """A listing and the function that retrieves it"""
+
+    def __init__(self, loader):
+        """Create an entry, not retrieved yet
+
+        :param loader: Function without argument that returns the listing, or raises an exception
+        :type loader: Function
+        """
+        self.m_loader = loader
+        self.m_content = None
+        """The last listing retrieved, None if never retrieved"""
+        self.m_error = None
+        """The exception raised by the last retrieval, None if it succeeded"""
+        self.m_time = 0.0
+        """Time of the last retrieval, 0 to refresh at the next access"""
+        self.m_used = time.monotonic()
+        """Time of the last access by a page"""
+        self.m_loaded = threading.Event()
+        """Set once the first retrieval is finished"""
+        self.m_refreshing = False
+
+
+class Listing_cache:
+    """Listings by key. The key must identify the location, for instance ("FTP", address, user, path)"""
+
+    def __init__(self):
+        self.m_entries = {}
+        self.m_lock = threading.Lock()
+        self.m_logger = logging.getLogger("website")
+
+    def get(self, key: tuple, loader) -> tuple:
+        """Return the cached listing, and start its refresh in the background if it is too old
+
+        :param key: The key of the listing
+        :type key: tuple
+        :param loader: Function without argument that returns the listing, or raises an exception. It replaces the
+            function of the previous calls (to follow a configuration change)
+        :type loader: Function
+        :return: The listing (None if it was never retrieved) and the exception of the last retrieval (None if it succeeded)
+        :rtype: tuple
+        """
+        with self.m_lock:
+            entry = self.m_entries.get(key)
+            if entry is None:
+                entry = self.m_entries[key] = Listing_entry(loader)
+            entry.m_loader = loader
+            entry.m_used = time.monotonic()
+            stale = time.monotonic() - entry.m_time >= LISTING_TTL or entry.m_time == 0
+
+        if stale:
+            self._start_refresh(key, entry)
+        if not entry.m_loaded.is_set():
+            entry.m_loaded.wait(FIRST_LOAD_WAIT)
+        return entry.m_content, entry.m_error
+
+    def invalidate(self):
+        """Refresh all the listings in the background, for instance after an upload"""
+        with self.m_lock:
+            entries = list(self.m_entries.items())
+            for _, entry in entries:
+                entry.m_time = 0.0
+        for key, entry in entries:
+            self._start_refresh(key, entry)
+
+    def refresh(self):
+        """Refresh all the listings displayed recently, in the calling thread. Forget the others"""
+        limit = time.monotonic() - LISTING_UNUSED_TIMEOUT
+        with self.m_lock:
+            for key in [key for key, entry in self.m_entries.items() if entry.m_used < limit]:
+                del self.m_entries[key]
+            entries = list(self.m_entries.items())
+
+        for key, entry in entries:
+            with self.m_lock:
+                if entry.m_refreshing:
+                    continue
+                entry.m_refreshing = True
+            self._refresh(key, entry)
+
+    def _start_refresh(self, key: tuple, entry: Listing_entry):
+        """Start a thread to refresh a listing, unless it is already being refreshed
+
+        :param key: The key of the listing
+        :type key: tuple
+        :param entry: The listing
+        :type entry: Listing_entry
+        """
+        with self.m_lock:
+            if entry.m_refreshing:
+                return
+            entry.m_refreshing = True
+        threading.Thread(target=self._refresh, args=(key, entry), name="Listing_cache", daemon=True).start()
+
+    def _refresh(self, key: tuple, entry: Listing_entry):
+        """Retrieve a listing. The previous listing is kept if it fails
+
+        :param key: The key of the listing
+        :type key: tuple
+        :param entry: The listing
+        :type entry: Listing_entry
+        """
+        try:
+            content = entry.m_loader()
+            error = None
+        except Exception as e:
+            content = entry.m_content
+            error = e
+            self.m_logger.warning(f"Listing of {key} failed: {e}")
+
+        with self.m_lock:
+            entry.m_content = content
+            entry.m_error = error
+            entry.m_time = time.monotonic()
+            entry.m_refreshing = False
+        entry.m_loaded.set()
+
+
+listing_cache = Listing_cache()
+
+
+def get_listing(key: tuple, loader) -> tuple:
+    """Return a listing from the cache of the process, see Listing_cache.get
+
+    :param key: The key of the listing
+    :type key: tuple
+    :param loader: Function without argument that returns the listing
+    :type loader: Function
+    :return: The listing (None if it was never retrieved) and the exception of the last retrieval
+    :rtype: tuple
+    """
+    return listing_cache.get(key, loader)
+
+
+def invalidate_listings():
+    """Refresh all the listings in the background, to call when the content of a server or folder changed"""
+    listing_cache.invalidate()
+
+
+def refresh_listings():
+    """Refresh all the listings, registered in the long term scheduler"""
+    listing_cache.refresh()
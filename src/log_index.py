@@ -0,0 +1,235 @@
+"""Index of the log files, to display them without reading them entirely.
+
+The index keeps the byte offset, level and time of the start of each log entry. It is updated incrementally when the
+file grows, and rebuilt if the file is rotated or truncated. The queries filter on the index, then only read the
+selected entries by seeking in the file.
+"""
+import os
+import re
+import threading
+
+from datetime import datetime
+
+LOG_LEVELS = ["DEBUG", "INFO", "WARNING", "ERROR", "CRITICAL"]
+
+# Start of a log entry, as formatted by log_config.ini
+ENTRY_HEADER = re.compile(rb"(\d{4}-\d{2}-\d{2} \d{2}:\d{2}:\d{2}),\d{3} \| (\w+) +\|")
+ENTRY_PATTERN = re.compile(
+    r"(\d{4}-\d{2}-\d{2} \d{2}:\d{2}:\d{2},\d{3}) \| (\w+) +\| ([^|]*?) +\| ([^|]*?) +\| (\d+) +\| (.*)", re.DOTALL
+)
+
+START_MESSAGE = b"| Scheduler started"
+"""Message logged at the start of the application, used to display only the current execution"""
+
+READ_SIZE = 1024 * 1024
+"""Size of the chunks read when the index is updated"""
+
+
+class Log_index:
+    """Index of the entries of one log file"""
+
+    def __init__(self, path: str):
+        """Create the index. It is empty until the first update
+
+        :param path: The path of the log file
+        :type path: str
+        """
+        self.m_path = path
+
+        self.m_offsets = []
+        """Byte offset of the start of each entry"""
+        self.m_levels = []
+        """Level index (in LOG_LEVELS) of each entry"""
+        self.m_times = []
+        """Time of each entry, as a "YYYY-mm-dd HH:MM:SS" string (which sorts like the time)"""
+        self.m_starts = []
+        """Index of the entries that are an application start"""
+
+        self.m_size = 0
+        """Number of bytes of the file that are indexed (always the end of a line)"""
+        self.m_inode = None
+        self.m_lock = threading.Lock()
+
+    def _reset(self):
+        """Forget everything, the file will be indexed from the beginning"""
+        self.m_offsets = []
+        self.m_levels = []
+        self.m_times = []
+        self.m_starts = []
+        self.m_size = 0
+
+    def update(self) -> int:
+        """Index the lines added to the file since the last update
+
+        :return: The number of entries in the index
+        :rtype: int
+        """
+        with self.m_lock:
+            try:
+                stat = os.stat(self.m_path)
+            except OSError:
+                self._reset()
+                self.m_inode = None
+                return 0
+
+            # Rotated or truncated: start again
+            if stat.st_ino != self.m_inode or stat.st_size < self.m_size:
+                self._reset()
+                self.m_inode = stat.st_ino
+
+            if stat.st_size == self.m_size:
+                return len(self.m_offsets)
+
+            with open(self.m_path, "rb") as file:
+                file.seek(self.m_size)
+                offset = self.m_size
+                remaining = b""
+                while True:
+                    chunk = file.read(READ_SIZE)
+                    if not chunk:
+                        break
+                    data = remaining + chunk
+                    # Only complete lines are indexed, the last one may still be written
+                    end = data.rfind(b"\n") + 1
+                    self._index_lines(data[:end], offset)
+                    offset += end
+                    remaining = data[end:]
+
+            self.m_size = offset
+            return len(self.m_offsets)
+
+    def _index_lines(self, data: bytes, offset: int):
+        """Add the entries starting in a block of complete lines
+
+        :param data: The lines
+        :type data: bytes
+        :param offset: The offset of the block in the file
+        :type offset: int
+        """
+        position = 0
+        while position < len(data):
+            end = data.find(b"\n", position) + 1
+            match = ENTRY_HEADER.match(data, position)
+            if match:
+                level = match.group(2).decode("ascii", "replace")
+                self.m_offsets.append(offset + position)
+                self.m_levels.append(LOG_LEVELS.index(level) if level in LOG_LEVELS else len(LOG_LEVELS))
+                self.m_times.append(match.group(1).decode("ascii"))
+                if data.find(START_MESSAGE, position, end) != -1:
+                    self.m_starts.append(len(self.m_offsets) - 1)
+            position = end
+
+    def query(
+        self,
+        page: int = 0,
+        page_size: int = 100,
+        level: str = None,
+        start_time: datetime = None,
+        end_time: datetime = None,
+        since_start: bool = True,
+        newest_first: bool = True,
+    ) -> tuple:
+        """Return a page of the entries of the log, after updating the index
+
+        :param page: The index of the page, defaults to 0
+        :type page: int, optional
+        :param page_size: The number of entries per page, defaults to 100. None to get all the entries
+        :type page_size: int, optional
+        :param level: The minimum level of the entries, defaults to None (all)
+        :type level: str, optional
+        :param start_time: Only the entries at or after this time, defaults to None
+        :type start_time: datetime, optional
+        :param end_time: Only the entries at or before this time, defaults to None
+        :type end_time: datetime, optional
+        :param since_start: Only the entries since the last start of the application, defaults to True
+        :type since_start: bool, optional
+        :param newest_first: Order of the entries, defaults to True
+        :type newest_first: bool, optional
+        :return: The list of entries (dictionnaries with time, level, file, function, line, message) and the total number of matching entries
+        :rtype: tuple
+        """
+        self.update()
+
+        with self.m_lock:
+            count = len(self.m_offsets)
+            first = self.m_starts[-1] if since_start and self.m_starts else 0
+
+            selected = range(first, count)
+            if start_time or end_time:
+                start_str = start_time.strftime("%Y-%m-%d %H:%M:%S") if start_time else None
+                end_str = end_time.strftime("%Y-%m-%d %H:%M:%S") if end_time else None
+                selected = [
+                    i for i in selected
+                    if (not start_str or self.m_times[i] >= start_str) and (not end_str or self.m_times[i] <= end_str)
+                ]
+            if level and level in LOG_LEVELS:
+                minimum = LOG_LEVELS.index(level)
+                selected = [i for i in selected if self.m_levels[i] >= minimum]
+
+            total = len(selected)
+            if newest_first:
+                selected = selected[::-1]
+            if page_size:
+                selected = selected[page * page_size:(page + 1) * page_size]
+
+            # Bounds of each selected entry in the file
+            bounds = [
+                (self.m_offsets[i], self.m_offsets[i + 1] if i + 1 < count else self.m_size) for i in selected
+            ]
+
+        return self._read_entries(bounds), total
+
+    def _read_entries(self, bounds: list) -> list:
+        """Read and parse entries of the log
+
+        :param bounds: A list of (start, end) byte offsets
+        :type bounds: list
+        :return: The parsed entries
+        :rtype: list
+        """
+        entries = []
+        if not bounds:
+            return entries
+
+        try:
+            file = open(self.m_path, "rb")
+        except OSError:
+            return entries
+
+        with file:
+            for start, end in bounds:
+                file.seek(start)
+                text = file.read(end - start).decode("utf-8", "replace")
+                match = ENTRY_PATTERN.match(text)
+                if not match:
+                    continue
+                timestamp_str, level, filename, function, line_num, message = match.groups()
+                entries.append(
+                    {
+                        "time": datetime.strptime(timestamp_str, "%Y-%m-%d %H:%M:%S,%f").replace(microsecond=0),
+                        "level": level,
+                        "file": filename.strip(),
+                        "function": function.strip(),
+                        "line": int(line_num),
+                        "message": message.strip(),
+                    }
+                )
+        return entries
+
+
+_INDEXES = {}
+_INDEXES_LOCK = threading.Lock()
+
+
+def get_log_index(path: str) -> Log_index:
+    """Return the index of a log file, shared by the whole process
+
+    :param path: The path of the log file
+    :type path: str
+    :return: The index
+    :rtype: Log_index
+    """
+    with _INDEXES_LOCK:
+        if path not in _INDEXES:
+            _INDEXES[path] = Log_index(path)
+        return _INDEXES[path]
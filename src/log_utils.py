@@ -1,43 +1,303 @@
 """Utility module for logging configuration"""
 import logging
 import logging.config
-import os
+import logging.handlers
 import socket
 import configparser
-import tempfile
+import threading
+import queue
+import atexit
+import copy
 
+LOG_CONFIG_PATH = "submodules/framework/log_config.ini"
 
-def setup_logging():
-    """Configure logging with appropriate paths based on on_target status"""
-    # Determine log path based on on_target status
+ASYNC_LOGGING = True
+"""If True, the handlers of the configuration are fed by a queue and run in a dedicated thread, so that the calling threads never wait for the disk"""
+LOG_QUEUE_SIZE = 10000
+"""Maximum number of log records waiting to be written"""
+LOG_QUEUE_POLICY = "drop_newest"
+"""What to do with a new record when the queue is full: "drop_newest", "drop_oldest" or "block" """
+LOG_QUEUE_BLOCK_TIMEOUT = 0.5
+"""Maximum time, in seconds, a thread waits for room in the queue when it blocks (policy "block" or records of level ERROR and above)"""
+
+# The logging configuration is done once per process, reconfigure_logging must be used to change it afterwards
+_CONFIGURED = False
+_LOCK = threading.Lock()
+
+# Asynchronous pipeline
+_LISTENER = None
+_QUEUE_HANDLERS = []
+
+
+class Async_queue_handler(logging.handlers.QueueHandler):
+    """Handler that replaces the handlers of a logger: the records are put in a bounded queue shared by all the loggers,
+    with the list of the real handlers that must write them. If the queue is full, the overflow policy is applied.
+    """
+
+    def __init__(self, log_queue: queue.Queue, targets: list, policy: str = "drop_newest"):
+        """Create the handler
+
+        :param log_queue: The queue shared with the listener
+        :type log_queue: queue.Queue
+        :param targets: The real handlers of the logger
+        :type targets: list
+        :param policy: The overflow policy, defaults to "drop_newest"
+        :type policy: str, optional
+        """
+        super().__init__(log_queue)
+        self.m_targets = targets
+        self.m_policy = policy
+
+        self.m_dropped = 0
+        """Number of records lost because the queue was full"""
+        self.m_dropped_reported = 0
+
+        # No need to enqueue records that no target will write
+        levels = [target.level for target in targets]
+        self.setLevel(min(levels) if levels else logging.NOTSET)
+
+    def prepare(self, record: logging.LogRecord) -> logging.LogRecord:
+        """Prepare the record for the queue: the message is merged but the formatting is left to the real handlers
+
+        :param record: The record to enqueue
+        :type record: logging.LogRecord
+        :return: A copy of the record that can be pickled and used in another thread
+        :rtype: logging.LogRecord
+        """
+        record = copy.copy(record)
+        record.message = record.getMessage()
+        record.msg = record.message
+        record.args = None
+        if record.exc_info:
+            # Formatted now: the traceback objects must not outlive the calling frame
+            if not record.exc_text:
+                record.exc_text = logging.Formatter().formatException(record.exc_info)
+            record.exc_info = None
+        record.log_targets = self.m_targets
+        return record
+
+    def enqueue(self, record: logging.LogRecord):
+        """Put a record in the queue, applying the overflow policy
+
+        :param record: The prepared record
+        :type record: logging.LogRecord
+        """
+        try:
+            if self.m_policy == "block" or record.levelno >= logging.ERROR:
+                self.queue.put(record, timeout=LOG_QUEUE_BLOCK_TIMEOUT)
+            elif self.m_policy == "drop_oldest":
+                while True:
+                    try:
+                        self.queue.put_nowait(record)
+                        break
+                    except queue.Full:
+                        self.queue.get_nowait()
+                        self.m_dropped += 1
+            else:
+                self.queue.put_nowait(record)
+        except (queue.Full, queue.Empty):
+            self.m_dropped += 1
+            return
+
+        if self.m_dropped != self.m_dropped_reported:
+            self._report_dropped()
+
+    def _report_dropped(self):
+        """Enqueue a warning with the number of records that were lost since the last report"""
+        count = self.m_dropped - self.m_dropped_reported
+        warning = logging.LogRecord(
+            self.name or "log_utils", logging.WARNING, __file__, 0,
+            str(count) + " log records dropped because the logging queue was full", None, None
+        )
+        warning.log_targets = self.m_targets
+        try:
+            self.queue.put_nowait(warning)
+            self.m_dropped_reported = self.m_dropped
+        except queue.Full:
+            pass
+
+
+class Async_queue_listener(logging.handlers.QueueListener):
+    """Listener that writes each record with the real handlers of the logger it comes from"""
+
+    def handle(self, record: logging.LogRecord):
+        """Handle a record from the queue
+
+        :param record: The record
+        :type record: logging.LogRecord
+        """
+        for handler in getattr(record, "log_targets", self.handlers):
+            if record.levelno >= handler.level:
+                try:
+                    handler.handle(record)
+                except Exception:
+                    handler.handleError(record)
+
+    def enqueue_sentinel(self):
+        """Ask the thread to stop once the queue is written, even if it is full"""
+        self.queue.put(self._sentinel)
+
+
+def get_log_paths() -> tuple:
+    """Return the paths of the log files, based on on_target status
+
+    :return: The path of the website log and the path of the root log
+    :rtype: tuple
+    """
     hostname = socket.gethostname()
     on_target = "al70x" in hostname
-    
+
     if on_target:
-        website_log = "/tmp/website.log"
-        root_log = "/tmp/root.log"
-    else:
-        website_log = "website.log"
-        root_log = "root.log"
-    
-    # Configure logging with dynamic log paths
+        return "/tmp/website.log", "/tmp/root.log"
+    return "website.log", "root.log"
+
+
+def _apply_config(config_path: str, website_log: str, root_log: str, disable_existing_loggers: bool):
+    """Load the logging configuration file with the given log paths and apply it
+
+    :param config_path: The path of the ini configuration
+    :type config_path: str
+    :param website_log: The path of the website log
+    :type website_log: str
+    :param root_log: The path of the root log
+    :type root_log: str
+    :param disable_existing_loggers: Passed to fileConfig
+    :type disable_existing_loggers: bool
+    """
     config = configparser.ConfigParser()
-    config.read("submodules/framework/log_config.ini")
-    
+    config.read(config_path)
+
     # Update log file paths - need to escape backslashes for Windows paths
     config.set('handler_fileHandlerWebsite', 'args', f"(r'{website_log}', 'W0', 1)")
     config.set('handler_fileHandlerRoot', 'args', f"(r'{root_log}', 'W0', 1)")
-    
-    # Write temporary config
-    with tempfile.NamedTemporaryFile(mode='w', delete=False, suffix='.ini') as tmp_config:
-        config.write(tmp_config)
-        tmp_config_path = tmp_config.name
-    
-    # Load the modified config
-    logging.config.fileConfig(tmp_config_path)
-    
-    # Clean up temporary file
-    try:
-        os.unlink(tmp_config_path)
-    except:
-        pass
+
+    # fileConfig accepts the parser directly, no need for a temporary file
+    logging.config.fileConfig(config, disable_existing_loggers=disable_existing_loggers)
+
+
+def _start_async_logging():
+    """Move the handlers of the configured loggers behind a single queue and listener thread"""
+    global _LISTENER, _QUEUE_HANDLERS
+    log_queue = queue.Queue(maxsize=LOG_QUEUE_SIZE)
+    handlers = []
+    loggers = [logging.getLogger()] + [
+        logger for logger in logging.Logger.manager.loggerDict.values() if isinstance(logger, logging.Logger)
+    ]
+    for logger in loggers:
+        targets = [handler for handler in logger.handlers if not isinstance(handler, logging.handlers.QueueHandler)]
+        if not targets:
+            continue
+        queue_handler = Async_queue_handler(log_queue, targets, LOG_QUEUE_POLICY)
+        for target in targets:
+            logger.removeHandler(target)
+            if target not in handlers:
+                handlers.append(target)
+        logger.addHandler(queue_handler)
+        _QUEUE_HANDLERS.append(queue_handler)
+
+    _LISTENER = Async_queue_listener(log_queue, *handlers)
+    _LISTENER.start()
+
+
+def flush_logging():
+    """Write all the records waiting in the queue and stop the logging thread. The handlers are flushed.
+    Registered to be called at exit, it can also be called before a reboot or an update.
+    The logging is synchronous again afterwards, until the next reconfigure_logging.
+    """
+    global _LISTENER, _QUEUE_HANDLERS
+    listener = _LISTENER
+    if listener is None:
+        return
+
+    listener.stop()
+    _LISTENER = None
+
+    # Put the real handlers back, so that nothing is lost after the thread is stopped
+    for logger in [logging.getLogger()] + list(logging.Logger.manager.loggerDict.values()):
+        if not isinstance(logger, logging.Logger):
+            continue
+        for handler in list(logger.handlers):
+            if handler in _QUEUE_HANDLERS:
+                logger.removeHandler(handler)
+                for target in handler.m_targets:
+                    logger.addHandler(target)
+    _QUEUE_HANDLERS = []
+
+    for handler in listener.handlers:
+        try:
+            handler.flush()
+        except Exception:
+            pass
+
+
+def get_logging_statistics() -> dict:
+    """Return the state of the asynchronous logging
+
+    :return: A dictionnary with "async", "queued" (records waiting) and "dropped" (records lost since the start)
+    :rtype: dict
+    """
+    if _LISTENER is None:
+        return {"async": False, "queued": 0, "dropped": 0}
+    return {
+        "async": True,
+        "queued": _LISTENER.queue.qsize(),
+        "dropped": sum(handler.m_dropped for handler in _QUEUE_HANDLERS),
+    }
+
+
+def is_logging_configured() -> bool:
+    """Tell if setup_logging has already configured the logging of this process
+
+    :return: True if the logging is configured
+    :rtype: bool
+    """
+    return _CONFIGURED
+
+
+def setup_logging():
+    """Configure logging with appropriate paths based on on_target status.
+    Only the first call does the configuration, the next ones return immediately: it can be called from anywhere.
+    Use reconfigure_logging to change the configuration at runtime.
+    """
+    global _CONFIGURED
+    if _CONFIGURED:
+        return
+
+    with _LOCK:
+        if _CONFIGURED:
+            return
+        website_log, root_log = get_log_paths()
+        _apply_config(LOG_CONFIG_PATH, website_log, root_log, True)
+        if ASYNC_LOGGING:
+            _start_async_logging()
+        _CONFIGURED = True
+
+
+def reconfigure_logging(config_path: str = None, website_log: str = None, root_log: str = None):
+    """Reload the logging configuration, closing and reopening the handlers. The loggers already created are kept enabled.
+
+    :param config_path: The path of the ini configuration, defaults to None (framework configuration)
+    :type config_path: str, optional
+    :param website_log: The path of the website log, defaults to None (path based on on_target status)
+    :type website_log: str, optional
+    :param root_log: The path of the root log, defaults to None (path based on on_target status)
+    :type root_log: str, optional
+    """
+    global _CONFIGURED
+    default_website_log, default_root_log = get_log_paths()
+
+    with _LOCK:
+        # Write what is pending with the old handlers before they are closed
+        flush_logging()
+        _apply_config(
+            config_path or LOG_CONFIG_PATH,
+            website_log or default_website_log,
+            root_log or default_root_log,
+            False,
+        )
+        if ASYNC_LOGGING:
+            _start_async_logging()
+        _CONFIGURED = True
+
+
+atexit.register(flush_logging)
@@ -9,7 +9,7 @@ import webbrowser
 import logging
 import uuid
 
-from flask_socketio import SocketIO
+from flask_socketio import SocketIO, join_room
 import importlib
 import sys
 import threading
@@ -22,7 +22,7 @@ from submodules.framework.src import threaded_manager
 from submodules.framework.src import access_manager
 from submodules.framework.src import site_conf
 from submodules.framework.src import log_utils
-from jinja2 import ChoiceLoader, FileSystemLoader
+from submodules.framework.src import listing_cache
 
 app = Flask(
         __name__,
@@ -32,10 +32,9 @@ app = Flask(
     )
 
 # Configure multiple template folders: app templates override framework templates
-app.jinja_loader = ChoiceLoader([
-    FileSystemLoader(os.path.join(os.path.dirname(os.path.dirname(os.path.dirname(os.path.abspath(__file__)))), "..", "website", "templates")),
-    FileSystemLoader(os.path.join(os.path.dirname(os.path.abspath(__file__)), "..", "templates"))
-])
+# The loader and the bytecode cache are shared with the reload helpers of utilities
+app.jinja_loader = utilities.util_get_jinja_loader()
+app.jinja_options = dict(app.jinja_options, bytecode_cache=utilities.util_get_jinja_bytecode_cache())
 
 def authorize_refresh(f):
     f._disable_csrf = True  # Ajouter un attribut personnalisé
@@ -67,6 +66,9 @@ def setup_app(app):
     # Configure logging with appropriate paths
     log_utils.setup_logging()
 
+    # Compile the templates used by the threaded actions before the first update
+    utilities.util_precompile_templates()
+
     # Detect if we're running from exe
     if getattr(sys, "frozen", False) and hasattr(sys, "_MEIPASS"):
         app_path = sys._MEIPASS
@@ -135,6 +137,8 @@ def setup_app(app):
 
     # Start long term scheduler
     scheduler_lt = scheduler.Scheduler_LongTerm()
+    # Keep the package listings of the update pages fresh, the pages never wait for the servers
+    scheduler_lt.register_function(listing_cache.refresh_listings, listing_cache.LISTING_REFRESH_PERIOD)
     scheduler_lt.start()
     scheduler.scheduler_ltobj = scheduler_lt
 
@@ -154,11 +158,19 @@ def setup_app(app):
 
     @socketio_obj.on("user_connected")
     def connect(data=None):
-        scheduler.scheduler_obj.m_user_connected = True
+        endpoint = data.get("endpoint") if isinstance(data, dict) else None
+        try:
+            user = session.get("username")
+        except Exception:
+            user = None
+
+        rooms = scheduler.scheduler_obj.on_user_connected(request.sid, user, endpoint)
+        for room in rooms:
+            join_room(room)
 
     @socketio_obj.on("disconnect")
-    def disconnect():
-        scheduler.scheduler_obj.m_user_connected = False
+    def disconnect(reason=None):
+        scheduler.scheduler_obj.on_user_disconnected(request.sid)
 
     @socketio_obj.server.on("*")
     def catch_all(event, sid, *args):
@@ -261,8 +273,11 @@ def setup_app(app):
                     # Not a webview request — block access
                     return render_template("403_webview.j2"), 403
 
-        # Read the parameters
-        session["config"] = utilities.util_read_parameters()
+        # Read the parameters, for this request only (read-only snapshot shared by all the requests)
+        g.config = utilities.util_read_parameters()
+        if "config" in session:
+            # Sessions created before the configuration was kept out of them
+            session.pop("config")
 
         inject_bar()
         
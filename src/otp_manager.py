@@ -4,28 +4,23 @@ OTP (One-Time Password) Manager for OnTarget 2FA authentication.
 This module handles generation, storage, and validation of single-use
 authentication codes. OTP codes are valid for 30 seconds and auto-regenerate.
 
-The OTP secret is stored in: /var/lib/dfnet/{target}/oufnis/otp_secret
-where {target} is 'ppu' or 'hmi' based on the device IP.
+The OTP and its creation time are stored in the shared memory record of
+otp_record (a private folder of /dev/shm), which is also read by the OTP overlay.
 """
-import os
 import secrets
 import string
 import logging
 import time
-from pathlib import Path
 from typing import Tuple, Optional
 
 from submodules.framework.src import utilities
+from submodules.framework.src import otp_record
 
 logger = logging.getLogger("website")
 
 # OTP Configuration
 OTP_LENGTH = 6  # 6-digit code
 OTP_VALIDITY_SECONDS = 30  # Code valid for 30 seconds
-OTP_BASE_PATH = "/var/lib/dfnet"
-OTP_SUBDIR = "oufnis"
-OTP_FILENAME = "otp_secret"
-OTP_TIMESTAMP_FILENAME = "otp_timestamp"
 
 # Singleton instance
 _otp_manager_instance = None
@@ -43,14 +38,13 @@ class OTPManager:
     """
     Manages One-Time Password generation, storage, and validation.
     
-    The OTP is stored on disk with a 30-second validity period.
+    The OTP is stored in the shared record with a 30-second validity period.
     After expiration, a new code is automatically generated.
     """
     
     def __init__(self):
         self._current_otp: Optional[str] = None
         self._otp_created_at: float = 0.0
-        self._otp_file_path: Optional[Path] = None
         self._initialized = False
         
     def _get_target_type(self) -> str:
@@ -62,44 +56,6 @@ class OTPManager:
         """
         return "hmi"
     
-    def _get_otp_file_path(self) -> Path:
-        """
-        Get the path to the OTP secret file.
-        
-        Returns:
-            Path: Full path to the OTP secret file
-        """
-        if self._otp_file_path is None:
-            target_type = self._get_target_type()
-            self._otp_file_path = Path(OTP_BASE_PATH) / target_type / OTP_SUBDIR / OTP_FILENAME
-        return self._otp_file_path
-    
-    def _get_timestamp_file_path(self) -> Path:
-        """Get the path to the OTP timestamp file."""
-        target_type = self._get_target_type()
-        return Path(OTP_BASE_PATH) / target_type / OTP_SUBDIR / OTP_TIMESTAMP_FILENAME
-    
-    def _write_timestamp(self, timestamp: float) -> bool:
-        """Write the OTP creation timestamp to file."""
-        try:
-            ts_path = self._get_timestamp_file_path()
-            ts_path.parent.mkdir(parents=True, exist_ok=True)
-            ts_path.write_text(str(timestamp))
-            return True
-        except Exception as e:
-            logger.error(f"Failed to write timestamp: {e}")
-            return False
-    
-    def _read_timestamp(self) -> float:
-        """Read the OTP creation timestamp from file."""
-        try:
-            ts_path = self._get_timestamp_file_path()
-            if ts_path.exists():
-                return float(ts_path.read_text().strip())
-        except Exception as e:
-            logger.error(f"Failed to read timestamp: {e}")
-        return 0.0
-    
     def _is_expired(self) -> bool:
         """Check if the current OTP has expired (older than 30 seconds)."""
         if self._otp_created_at == 0:
@@ -130,85 +86,36 @@ class OTPManager:
         # Use only digits for user-friendly entry
         return ''.join(secrets.choice(string.digits) for _ in range(OTP_LENGTH))
     
-    def _ensure_directory(self, file_path: Path) -> bool:
-        """
-        Ensure the directory for the OTP file exists.
-        
-        Args:
-            file_path: Path to the OTP file
-            
-        Returns:
-            bool: True if directory exists or was created
-        """
-        try:
-            file_path.parent.mkdir(parents=True, exist_ok=True)
-            return True
-        except PermissionError:
-            logger.error(f"Permission denied creating directory: {file_path.parent}")
-            return False
-        except Exception as e:
-            logger.error(f"Failed to create directory {file_path.parent}: {e}")
-            return False
-    
-    def _write_otp_to_file(self, otp: str) -> bool:
+    def _write_otp(self, otp: str) -> bool:
         """
-        Write the OTP to the secret file.
+        Store the OTP and its creation time in the shared record.
         
         Args:
-            otp: The OTP code to write
+            otp: The OTP code to store
             
         Returns:
             bool: True if successfully written
         """
-        file_path = self._get_otp_file_path()
-        
-        if not self._ensure_directory(file_path):
+        now = time.time()
+        if not otp_record.get_otp_record().write(otp=otp, created_at=now):
+            logger.error(f"Failed to write OTP to {otp_record.RECORD_PATH}")
             return False
         
-        try:
-            # Write atomically using temp file
-            temp_path = file_path.with_suffix('.tmp')
-            temp_path.write_text(otp)
-            temp_path.replace(file_path)
-            
-            # Set permissions to be readable (for overlay display service)
-            os.chmod(file_path, 0o644)
-            
-            # Also write the timestamp
-            now = time.time()
-            self._write_timestamp(now)
-            self._otp_created_at = now
-            
-            logger.info(f"OTP written to {file_path}")
-            return True
-        except PermissionError:
-            logger.error(f"Permission denied writing OTP to {file_path}")
-            return False
-        except Exception as e:
-            logger.error(f"Failed to write OTP to {file_path}: {e}")
-            return False
+        self._otp_created_at = now
+        logger.info("OTP updated in the shared record")
+        return True
     
-    def _read_otp_from_file(self) -> Optional[str]:
+    def _read_otp(self) -> Tuple[Optional[str], float]:
         """
-        Read the current OTP from the secret file.
+        Read the current OTP and its creation time from the shared record.
         
         Returns:
-            str or None: The stored OTP, or None if not found
+            Tuple[Optional[str], float]: The stored OTP (None if not found or invalid) and its creation time
         """
-        file_path = self._get_otp_file_path()
-        
-        try:
-            if file_path.exists():
-                otp = file_path.read_text().strip()
-                if otp and len(otp) == OTP_LENGTH and otp.isdigit():
-                    return otp
-                else:
-                    logger.warning(f"Invalid OTP format in {file_path}, will regenerate")
-                    return None
-            return None
-        except Exception as e:
-            logger.error(f"Failed to read OTP from {file_path}: {e}")
-            return None
+        otp, created_at, _ = otp_record.get_otp_record().read()
+        if otp and len(otp) == OTP_LENGTH and otp.isdigit():
+            return otp, created_at
+        return None, 0.0
     
     def initialize(self) -> Tuple[bool, str]:
         """
@@ -223,17 +130,16 @@ class OTPManager:
             return True, self._current_otp or ""
         
         # Try to read existing OTP and timestamp
-        self._current_otp = self._read_otp_from_file()
-        self._otp_created_at = self._read_timestamp()
+        self._current_otp, self._otp_created_at = self._read_otp()
         
         if self._current_otp is None or self._is_expired():
             # Generate new OTP (expired or missing)
             self._current_otp = self._generate_otp()
-            if not self._write_otp_to_file(self._current_otp):
-                return False, "Failed to write OTP to file"
+            if not self._write_otp(self._current_otp):
+                return False, "Failed to write OTP to the shared record"
             logger.info("Generated new OTP at startup")
         else:
-            logger.info(f"Loaded existing OTP from file ({self.get_time_remaining()}s remaining)")
+            logger.info(f"Loaded existing OTP from the shared record ({self.get_time_remaining()}s remaining)")
         
         self._initialized = True
         return True, self._current_otp
@@ -293,20 +199,20 @@ class OTPManager:
         if self._is_expired():
             logger.info("OTP expired, auto-regenerating")
             self._current_otp = self._generate_otp()
-            self._write_otp_to_file(self._current_otp)
+            self._write_otp(self._current_otp)
         
         return self._current_otp
     
     def get_otp_file_path_str(self) -> str:
         """
-        Get the full path to the OTP file as a string.
+        Get the full path to the shared OTP record as a string.
         
         Useful for configuring external display services.
         
         Returns:
-            str: Full path to the OTP secret file
+            str: Full path to the OTP record
         """
-        return str(self._get_otp_file_path())
+        return otp_record.get_otp_record().path
     
     def regenerate(self) -> Tuple[bool, str]:
         """
@@ -319,7 +225,7 @@ class OTPManager:
         """
         new_otp = self._generate_otp()
         
-        if self._write_otp_to_file(new_otp):
+        if self._write_otp(new_otp):
             self._current_otp = new_otp
             logger.info("OTP forcefully regenerated")
             return True, new_otp
@@ -12,23 +12,26 @@ import ctypes
 import ctypes.util
 import logging
 import argparse
-from pathlib import Path
+import threading
+import pwd
 from typing import Optional, Tuple
 
+try:
+    from submodules.framework.src import otp_record, file_watcher
+except ImportError:
+    # Started as a standalone script, from the folder of the framework sources
+    import otp_record
+    import file_watcher
+
 logging.basicConfig(
     level=logging.INFO,
     format='%(asctime)s - %(levelname)s - %(message)s'
 )
 logger = logging.getLogger("otp_cairo")
 
-# OTP file configuration
-OTP_BASE_PATH = "/var/lib/dfnet"
-OTP_SUBDIR = "oufnis"
-OTP_FILENAME = "otp_secret"
-OTP_TIMESTAMP_FILENAME = "otp_timestamp"
+# OTP record configuration
 OTP_VALIDITY_SECONDS = 30
-AUTH_SIGNAL_FILENAME = "auth_active"
-POLL_INTERVAL = 1.0
+POLL_INTERVAL = 1.0  # Only used when the record can't be watched
 AUTH_SIGNAL_TIMEOUT = 5.0  # Must be > heartbeat interval (2s)
 
 # X11 connection retry configuration (for slow startup after reboot)
@@ -36,37 +39,11 @@ X11_MAX_RETRIES = 30  # Max attempts to connect to X11
 X11_RETRY_DELAY = 2.0  # Seconds between retries
 
 
-def get_target_type() -> str:
-    """Determine target type from hostname."""
-    return "hmi"
-
-
-def get_otp_file_path() -> Path:
-    """Get the path to the OTP secret file."""
-    target_type = get_target_type()
-    return Path(OTP_BASE_PATH) / target_type / OTP_SUBDIR / OTP_FILENAME
-
-
-def get_otp_timestamp_path() -> Path:
-    """Get the path to the OTP timestamp file."""
-    target_type = get_target_type()
-    return Path(OTP_BASE_PATH) / target_type / OTP_SUBDIR / OTP_TIMESTAMP_FILENAME
+_record = otp_record.OTPRecord(writable=True, create=False)
 
 
-def read_otp_timestamp() -> float:
-    """Read the OTP creation timestamp."""
-    try:
-        ts_path = get_otp_timestamp_path()
-        if ts_path.exists():
-            return float(ts_path.read_text().strip())
-    except Exception as e:
-        logger.error(f"Error reading timestamp: {e}")
-    return 0.0
-
-
-def get_otp_time_remaining() -> int:
-    """Get remaining validity time for current OTP in seconds."""
-    created_at = read_otp_timestamp()
+def get_otp_time_remaining(created_at: float) -> int:
+    """Get remaining validity time for an OTP created at the given time, in seconds."""
     if created_at == 0:
         return 0
     elapsed = time.time() - created_at
@@ -74,51 +51,32 @@ def get_otp_time_remaining() -> int:
     return max(0, int(remaining))
 
 
-def read_otp_code() -> Optional[str]:
-    """Read the current OTP code from file."""
-    otp_path = get_otp_file_path()
-    try:
-        if otp_path.exists():
-            code = otp_path.read_text().strip()
-            if code and len(code) == 6 and code.isdigit():
-                return code
-    except Exception as e:
-        logger.error(f"Error reading OTP: {e}")
-    return None
+def read_otp_record() -> Tuple[Optional[str], float, float]:
+    """Read the current OTP code, its creation time and the auth page activity from the shared record."""
+    code, created_at, auth_activity = _record.read()
+    if code and len(code) == 6 and code.isdigit():
+        return code, created_at, auth_activity
+    return None, created_at, auth_activity
 
 
-def get_auth_signal_path() -> Path:
-    """Get the path to the auth activity signal file."""
-    target_type = get_target_type()
-    return Path(OTP_BASE_PATH) / target_type / OTP_SUBDIR / AUTH_SIGNAL_FILENAME
+def set_record_owner(owner: str):
+    """Read the record of another user (the web application runs under its own account)."""
+    global _record
+    uid = int(owner) if owner.isdigit() else pwd.getpwnam(owner).pw_uid
+    _record = otp_record.OTPRecord(writable=True, create=False, owner=uid)
 
 
 def clear_auth_signal():
-    """Clear the auth signal file at startup to prevent stale signals."""
-    signal_path = get_auth_signal_path()
-    try:
-        if signal_path.exists():
-            signal_path.write_text("0")
-            logger.info(f"Cleared auth signal at startup: {signal_path}")
-    except Exception as e:
-        logger.warning(f"Failed to clear auth signal: {e}")
-
-
-def is_auth_page_active() -> bool:
-    """Check if someone is currently on the auth page."""
-    signal_path = get_auth_signal_path()
-    try:
-        if not signal_path.exists():
-            return False
-        content = signal_path.read_text().strip()
-        if not content or content == "0":
-            return False
-        signal_timestamp = float(content)
-        age = time.time() - signal_timestamp
-        return age < AUTH_SIGNAL_TIMEOUT
-    except (ValueError, OSError) as e:
-        logger.debug(f"Error reading auth signal: {e}")
+    """Clear the auth signal at startup to prevent stale signals."""
+    if _record.write(auth_activity=0.0):
+        logger.info(f"Cleared auth signal at startup: {_record.path}")
+
+
+def is_auth_page_active(auth_activity: float) -> bool:
+    """Check if someone is currently on the auth page, from the last activity time."""
+    if not auth_activity:
         return False
+    return time.time() - auth_activity < AUTH_SIGNAL_TIMEOUT
 
 
 # ============================================================================
@@ -207,8 +165,12 @@ class CairoOverlay:
         self.position = position
         self.font_size = font_size
         self.current_otp: Optional[str] = None
+        self.otp_created_at = 0.0
         self.window_visible = False
         
+        # Set when the shared record changes
+        self.record_changed = threading.Event()
+        
         # Window dimensions (specs: 1200x180)
         self.width = 1200
         self.height = 180
@@ -221,7 +183,16 @@ class CairoOverlay:
         # Cairo handles
         self.surface = None
         self.cr = None
+        self.font_desc = None
         self.layout = None
+        self.countdown_layout = None
+        self.countdown_width = 0
+        
+        # What is on screen, to only repaint what changed
+        self.layout_otp: Optional[str] = None
+        self.text_area = None
+        self.countdown_area = None
+        self.drawn_remaining: Optional[int] = None
         
         # Libraries loaded lazily in run()
         self.libs = None
@@ -391,41 +362,90 @@ class CairoOverlay:
         logger.info(f"Window created at ({x}, {y}), font_size={self.font_size}")
         return True
     
-    def _draw(self):
-        """Draw the OTP display using Cairo + Pango with countdown.
-        
-        Specs:
-        - Background: 0xA0A0A0 (160,160,160) with 60% opacity (153/255)
-        - Text: Open Sans, size 20, white (0xFFFFFFFF)
-        """
+    def _init_drawing(self):
+        """Create the Cairo context, font and Pango layouts, kept for the life of the window."""
         cairo = self.libs['cairo']
         pango = self.libs['pango']
         pangocairo = self.libs['pangocairo']
         
-        # Get time remaining
-        time_remaining = get_otp_time_remaining()
+        self.cr = cairo.cairo_create(self.surface)
+        
+        # Open Sans at specified size (default 20)
+        font_desc_str = f"Open Sans {self.font_size}".encode('utf-8')
+        self.font_desc = pango.pango_font_description_from_string(font_desc_str)
+        
+        # One layout for the code, only updated when the code changes, one for the countdown
+        self.layout = pangocairo.pango_cairo_create_layout(self.cr)
+        pango.pango_layout_set_font_description(self.layout, self.font_desc)
+        self.countdown_layout = pangocairo.pango_cairo_create_layout(self.cr)
+        pango.pango_layout_set_font_description(self.countdown_layout, self.font_desc)
+        
+        # Width reserved for the countdown: its largest value
+        self.countdown_width, _ = self._set_layout_text(self.countdown_layout, f"({OTP_VALIDITY_SECONDS}s)")
+    
+    def _set_layout_text(self, layout, text: str) -> Tuple[int, int]:
+        """Set the text of a Pango layout and return its size in pixels."""
+        pango = self.libs['pango']
+        text_bytes = text.encode('utf-8')
+        pango.pango_layout_set_text(layout, text_bytes, len(text_bytes))
+        
+        text_width = ctypes.c_int()
+        text_height = ctypes.c_int()
+        pango.pango_layout_get_pixel_size(layout, ctypes.byref(text_width), ctypes.byref(text_height))
+        return text_width.value, text_height.value
+    
+    def _update_text_layout(self):
+        """Update the layout of the code and the text areas, if the code changed."""
+        if self.layout_otp == self.current_otp and self.text_area is not None:
+            return
+        
+        if self.current_otp:
+            otp_text = f"Code 2FA :  {self.current_otp[:3]} {self.current_otp[3:]}  "
+            countdown_width = self.countdown_width
+        else:
+            otp_text = "Code 2FA :  --- ---"
+            countdown_width = 0
+        text_width, text_height = self._set_layout_text(self.layout, otp_text)
+        
+        # Center code and countdown in the full window (horizontally and vertically)
+        text_x = (self.width - text_width - countdown_width) // 2
+        text_y = (self.height - text_height) // 2
+        self.text_area = (text_x, text_y)
+        self.countdown_area = (text_x + text_width, text_y, countdown_width, text_height)
+        self.layout_otp = self.current_otp
+    
+    def _fill_background(self, x: float, y: float, width: float, height: float):
+        """Repaint the background of a region of the window.
         
-        # Create Cairo context
-        cr = cairo.cairo_create(self.surface)
+        Specs: 0xA0A0A0 (160,160,160) with 60% opacity (153/255)
+        """
+        cairo = self.libs['cairo']
+        cr = self.cr
         
-        # Clear entire surface first to prevent ghosting/remnants
+        # Clear the region first to prevent ghosting/remnants
         cairo.cairo_set_source_rgb(cr, 160/255, 160/255, 160/255)
-        cairo.cairo_rectangle(cr, 0, 0, self.width, self.height)
+        cairo.cairo_rectangle(cr, x, y, width, height)
         cairo.cairo_fill(cr)
         
-        # Fill background: 0xA0A0A0 (160,160,160) with 60% opacity
         cairo.cairo_set_source_rgba(cr, 160/255, 160/255, 160/255, 153/255)
-        cairo.cairo_rectangle(cr, 0, 0, self.width, self.height)
+        cairo.cairo_rectangle(cr, x, y, width, height)
         cairo.cairo_fill(cr)
+    
+    def _draw_progress(self, time_remaining: int):
+        """Draw the countdown and the progress bar, over a fresh background."""
+        cairo = self.libs['cairo']
+        pangocairo = self.libs['pangocairo']
+        cr = self.cr
         
-        # Draw progress bar background (darker, semi-transparent)
+        # Progress bar background (darker, semi-transparent)
         bar_height = 12
         bar_y = self.height - bar_height - 20
+        self._fill_background(40, bar_y, self.width - 80, bar_height)
         cairo.cairo_set_source_rgba(cr, 80/255, 80/255, 80/255, 0.8)
         cairo.cairo_rectangle(cr, 40, bar_y, self.width - 80, bar_height)
         cairo.cairo_fill(cr)
         
-        # Draw progress bar (filled portion)
+        # Progress bar (filled portion)
         if time_remaining > 0:
             progress_width = ((self.width - 80) * time_remaining) / OTP_VALIDITY_SECONDS
             # Color: green > 10s, yellow 5-10s, red < 5s
@@ -438,45 +458,72 @@ class CairoOverlay:
             cairo.cairo_rectangle(cr, 40, bar_y, progress_width, bar_height)
             cairo.cairo_fill(cr)
         
-        # Format OTP text with timer
+        # Countdown, next to the code
         if self.current_otp:
-            otp_text = f"Code 2FA :  {self.current_otp[:3]} {self.current_otp[3:]}  ({time_remaining}s)"
-        else:
-            otp_text = "Code 2FA :  --- ---"
+            x, y, width, height = self.countdown_area
+            self._fill_background(x, y, width, height)
+            self._set_layout_text(self.countdown_layout, f"({time_remaining}s)")
+            cairo.cairo_set_source_rgb(cr, 1.0, 1.0, 1.0)
+            cairo.cairo_move_to(cr, x, y)
+            pangocairo.pango_cairo_show_layout(cr, self.countdown_layout)
+        
+        self.drawn_remaining = time_remaining
+    
+    def _draw(self):
+        """Draw the whole OTP display using Cairo + Pango with countdown.
         
-        # Create Pango layout
-        layout = pangocairo.pango_cairo_create_layout(cr)
+        Only needed when the window is shown or exposed, or when the code changes:
+        the countdown ticks are drawn by _draw_countdown.
         
-        # Set font - Open Sans at specified size (default 20)
-        font_desc_str = f"Open Sans {self.font_size}".encode('utf-8')
-        font_desc = pango.pango_font_description_from_string(font_desc_str)
-        pango.pango_layout_set_font_description(layout, font_desc)
+        Specs:
+        - Background: 0xA0A0A0 (160,160,160) with 60% opacity (153/255)
+        - Text: Open Sans, size 20, white (0xFFFFFFFF)
+        """
+        cairo = self.libs['cairo']
+        pangocairo = self.libs['pangocairo']
         
-        # Set text
-        text_bytes = otp_text.encode('utf-8')
-        pango.pango_layout_set_text(layout, text_bytes, len(text_bytes))
+        if self.cr is None:
+            self._init_drawing()
+        self._update_text_layout()
         
-        # Get text size for centering
-        text_width = ctypes.c_int()
-        text_height = ctypes.c_int()
-        pango.pango_layout_get_pixel_size(layout, ctypes.byref(text_width), ctypes.byref(text_height))
+        self._fill_background(0, 0, self.width, self.height)
         
-        # Center text in the full window (horizontally and vertically)
-        text_x = (self.width - text_width.value) / 2
-        text_y = (self.height - text_height.value) / 2
+        # Draw code text in white (0xFFFFFFFF)
+        cairo.cairo_set_source_rgb(self.cr, 1.0, 1.0, 1.0)
+        cairo.cairo_move_to(self.cr, *self.text_area)
+        pangocairo.pango_cairo_show_layout(self.cr, self.layout)
         
-        # Draw text in white (0xFFFFFFFF)
-        cairo.cairo_set_source_rgb(cr, 1.0, 1.0, 1.0)
-        cairo.cairo_move_to(cr, text_x, text_y)
-        pangocairo.pango_cairo_show_layout(cr, layout)
+        self._draw_progress(get_otp_time_remaining(self.otp_created_at))
         
-        # Cleanup
         cairo.cairo_surface_flush(self.surface)
-        pango.pango_font_description_free(font_desc)
-        cairo.cairo_destroy(cr)
+        self.libs['x11'].XFlush(self.display)
+    
+    def _draw_countdown(self):
+        """Repaint only the countdown and the progress bar, if the remaining seconds changed."""
+        if self.cr is None:
+            self._draw()
+            return
+        
+        time_remaining = get_otp_time_remaining(self.otp_created_at)
+        if time_remaining == self.drawn_remaining:
+            return
         
+        self._draw_progress(time_remaining)
+        self.libs['cairo'].cairo_surface_flush(self.surface)
         self.libs['x11'].XFlush(self.display)
     
+    def _destroy_drawing(self):
+        """Release the Cairo context, font and surface."""
+        if self.font_desc:
+            self.libs['pango'].pango_font_description_free(self.font_desc)
+            self.font_desc = None
+        if self.cr:
+            self.libs['cairo'].cairo_destroy(self.cr)
+            self.cr = None
+        if self.surface:
+            self.libs['cairo'].cairo_surface_destroy(self.surface)
+            self.surface = None
+    
     def _show_window(self):
         """Show the overlay window and raise it to front."""
         x11 = self.libs['x11']
@@ -507,17 +554,20 @@ class CairoOverlay:
     
     def update(self):
         """Update OTP display based on auth page activity."""
-        auth_active = is_auth_page_active()
+        new_otp, self.otp_created_at, auth_activity = read_otp_record()
         
-        if auth_active:
+        if is_auth_page_active(auth_activity):
+            was_visible = self.window_visible
             self._show_window()
-            new_otp = read_otp_code()
             if new_otp != self.current_otp:
                 self.current_otp = new_otp
                 if new_otp:
                     logger.info(f"OTP updated: {new_otp[:3]} {new_otp[3:]}")
-            # Always redraw to update countdown timer and progress bar
-            self._draw()
+            if not was_visible or self.current_otp != self.layout_otp:
+                self._draw()
+            else:
+                # Only the countdown timer and progress bar can have changed
+                self._draw_countdown()
         else:
             self._hide_window()
     
@@ -565,20 +615,31 @@ class CairoOverlay:
         
         logger.info(f"OTP Cairo overlay started at {self.position}")
         logger.info(f"Font size: {self.font_size}pt")
-        logger.info(f"OTP file: {get_otp_file_path()}")
-        logger.info(f"Auth signal: {get_auth_signal_path()}")
+        logger.info(f"OTP record: {_record.path}")
+        
+        # Woken up by the writes of the web application instead of polling the record
+        watcher = file_watcher.get_file_watcher()
+        watched = watcher is not None and watcher.watch(_record.path, lambda path: self.record_changed.set())
+        if not watched:
+            logger.info(f"Record not watched, polling every {POLL_INTERVAL}s")
         
         try:
             while True:
                 self._process_events()
                 self.update()
-                time.sleep(POLL_INTERVAL)
+                if self.window_visible or not watched or not os.path.exists(_record.path):
+                    # The countdown is redrawn every second while the window is displayed,
+                    # and the heartbeat timeout must be detected without any write
+                    timeout = POLL_INTERVAL
+                else:
+                    timeout = None
+                self.record_changed.wait(timeout)
+                self.record_changed.clear()
         except KeyboardInterrupt:
             logger.info("Stopped by user")
         finally:
             if self.libs:
-                if self.surface:
-                    self.libs['cairo'].cairo_surface_destroy(self.surface)
+                self._destroy_drawing()
                 if self.display:
                     self.libs['x11'].XCloseDisplay(self.display)
         
@@ -594,9 +655,14 @@ def main():
                        help='Font size in points (default: 32)')
     parser.add_argument('--test', action='store_true',
                        help='Test mode - show window for 10 seconds')
+    parser.add_argument('--record-owner',
+                       help='User (name or uid) of the web application, if not the current user')
     
     args = parser.parse_args()
     
+    if args.record_owner:
+        set_record_owner(args.record_owner)
+    
     if 'DISPLAY' not in os.environ:
         os.environ['DISPLAY'] = ':0'
     
@@ -608,8 +674,7 @@ def main():
             overlay._show_window()
             overlay._draw()
             time.sleep(10)
-            if overlay.surface:
-                overlay.libs['cairo'].cairo_surface_destroy(overlay.surface)
+            overlay._destroy_drawing()
             overlay.libs['x11'].XCloseDisplay(overlay.display)
     else:
         overlay.run()
@@ -0,0 +1,231 @@
+"""
+Shared OTP record for OnTarget 2FA authentication.
+
+The current OTP, its creation time and the last activity on the auth page are kept in one small record with a
+fixed layout, in a file of a memory filesystem (/dev/shm). The web application and the OTP overlay map it in
+memory: reading or updating it does not open, stat or write any file on the flash.
+
+Writes to a mapping don't generate inotify events, so the writer touches the file times after each update:
+the overlay, watching the file with inotify, is woken up without polling.
+
+The memory filesystem is writable by everyone, so the record is kept in a private folder of the service user,
+named after its uid. The folder and the record are opened without following links, and both must belong to the
+service user and not be writable by anyone else: a record prepared by another local user (to choose the OTP) is
+refused, never used read-only.
+
+This module only depends on the standard library, so that the overlay can import it directly.
+"""
+import logging
+import mmap
+import os
+import stat
+import struct
+import threading
+import time
+from typing import Optional, Tuple
+
+try:
+    import fcntl
+except ImportError:
+    # Not on target: the record is only used on Linux
+    fcntl = None
+
+RECORD_BASE = "/dev/shm" if os.path.isdir("/dev/shm") else "/tmp"
+RECORD_NAME = "record"
+RECORD_MAGIC = b"OTPR"
+RECORD_VERSION = 1
+# magic, layout version, sequence (odd while a write is in progress), OTP (NUL padded), created at, auth activity
+RECORD_LAYOUT = struct.Struct("<4sII8sdd")
+RECORD_SIZE = 64
+SEQUENCE_LAYOUT = struct.Struct("<I")
+SEQUENCE_OFFSET = 8
+
+_record_instance = None
+_record_lock = threading.Lock()
+logger = logging.getLogger("website")
+
+
+def current_uid() -> int:
+    """Uid of the process, 0 where uids don't exist (st_uid is then always 0)."""
+    return os.getuid() if hasattr(os, "getuid") else 0
+
+
+def record_path(owner: Optional[int] = None) -> str:
+    """
+    Path of the record of a service user.
+
+    Args:
+        owner: The uid of the user of the web application, the current user if None
+
+    Returns:
+        str: The path of the record, in the private folder of the user
+    """
+    return os.path.join(RECORD_BASE, f"oufnis_otp.{current_uid() if owner is None else owner}", RECORD_NAME)
+
+
+RECORD_PATH = record_path()
+
+
+def _is_private(st: os.stat_result, owner: int) -> bool:
+    """Check that a file or folder belongs to the owner and is not writable by the others."""
+    return st.st_uid == owner and not st.st_mode & (stat.S_IWGRP | stat.S_IWOTH)
+
+
+class OTPRecord:
+    """
+    Memory mapped OTP / heartbeat record.
+
+    Readers never block: a sequence counter, odd while a write is in progress, lets them retry if they read
+    during an update (seqlock). Writers are serialized by a lock, and by flock between processes.
+
+    The record of another user (owner) is only mapped read only, and only if it belongs to that user.
+    """
+
+    def __init__(self, path: Optional[str] = None, writable: bool = True, create: bool = True,
+                 owner: Optional[int] = None):
+        self.owner = current_uid() if owner is None else owner
+        self.path = path or record_path(self.owner)
+        self.writable = writable and self.owner == current_uid()
+        self.create = create and self.writable
+        self._fd = None
+        self._map = None
+        self._lock = threading.Lock()
+
+    def open(self) -> bool:
+        """
+        Map the record, creating it if needed (if create is set).
+
+        Returns:
+            bool: True if the record is mapped
+        """
+        if self._map is not None:
+            return True
+
+        folder = os.path.dirname(self.path)
+        try:
+            if self.create:
+                try:
+                    os.mkdir(folder, 0o755)
+                except FileExistsError:
+                    pass
+            # lstat: a link in place of the folder is refused
+            st = os.lstat(folder)
+            if not stat.S_ISDIR(st.st_mode) or not _is_private(st, self.owner):
+                logger.error(f"OTP record folder {folder} is not a private folder of uid {self.owner}, refused")
+                return False
+
+            flags = getattr(os, "O_NOFOLLOW", 0)
+            if self.writable:
+                flags |= os.O_RDWR | (os.O_CREAT if self.create else 0)
+            else:
+                flags |= os.O_RDONLY
+            fd = os.open(self.path, flags, 0o644)
+        except OSError:
+            return False
+
+        try:
+            st = os.fstat(fd)
+            if not stat.S_ISREG(st.st_mode) or not _is_private(st, self.owner):
+                logger.error(f"OTP record {self.path} doesn't belong to uid {self.owner} or is writable by others, refused")
+                os.close(fd)
+                return False
+
+            if st.st_size < RECORD_SIZE:
+                if not self.create:
+                    os.close(fd)
+                    return False
+                os.ftruncate(fd, RECORD_SIZE)
+                # Readable by the overlay service, whatever the umask
+                os.fchmod(fd, 0o644)
+
+            access = mmap.ACCESS_WRITE if self.writable else mmap.ACCESS_READ
+            self._map = mmap.mmap(fd, RECORD_SIZE, access=access)
+            self._fd = fd
+        except (OSError, ValueError):
+            os.close(fd)
+            return False
+
+        if self.writable and self._map[:4] != RECORD_MAGIC:
+            self._map[:RECORD_LAYOUT.size] = RECORD_LAYOUT.pack(RECORD_MAGIC, RECORD_VERSION, 0, b"", 0.0, 0.0)
+        return True
+
+    def close(self):
+        """Unmap the record."""
+        if self._map is not None:
+            self._map.close()
+            self._map = None
+        if self._fd is not None:
+            os.close(self._fd)
+            self._fd = None
+
+    def read(self) -> Tuple[Optional[str], float, float]:
+        """
+        Read a consistent copy of the record.
+
+        Returns:
+            Tuple[Optional[str], float, float]: (otp or None, created_at, auth_activity)
+        """
+        if not self.open():
+            return None, 0.0, 0.0
+
+        for _ in range(100):
+            magic, version, sequence, otp, created_at, auth_activity = RECORD_LAYOUT.unpack_from(self._map, 0)
+            if magic != RECORD_MAGIC or version != RECORD_VERSION:
+                return None, 0.0, 0.0
+            if sequence % 2 == 0 and SEQUENCE_LAYOUT.unpack_from(self._map, SEQUENCE_OFFSET)[0] == sequence:
+                otp = otp.rstrip(b"\0").decode("ascii", "replace")
+                return otp or None, created_at, auth_activity
+            # A write is in progress
+            time.sleep(0)
+        return None, 0.0, 0.0
+
+    def write(self, otp: Optional[str] = None, created_at: Optional[float] = None,
+              auth_activity: Optional[float] = None) -> bool:
+        """
+        Update some fields of the record, the others are kept.
+
+        Args:
+            otp: The new OTP, or None to keep it
+            created_at: The creation time of the OTP, or None to keep it
+            auth_activity: The time of the last activity on the auth page (0 when closed), or None to keep it
+
+        Returns:
+            bool: True if the record was written
+        """
+        if not self.open() or not self.writable:
+            return False
+
+        with self._lock:
+            if fcntl:
+                fcntl.flock(self._fd, fcntl.LOCK_EX)
+            try:
+                _, _, sequence, old_otp, old_created_at, old_auth_activity = RECORD_LAYOUT.unpack_from(self._map, 0)
+                sequence |= 1  # Odd: write in progress
+                SEQUENCE_LAYOUT.pack_into(self._map, SEQUENCE_OFFSET, sequence)
+                RECORD_LAYOUT.pack_into(
+                    self._map, 0,
+                    RECORD_MAGIC, RECORD_VERSION, sequence,
+                    otp.encode("ascii") if otp is not None else old_otp,
+                    created_at if created_at is not None else old_created_at,
+                    auth_activity if auth_activity is not None else old_auth_activity,
+                )
+                SEQUENCE_LAYOUT.pack_into(self._map, SEQUENCE_OFFSET, (sequence + 1) & 0xFFFFFFFF)
+            finally:
+                if fcntl:
+                    fcntl.flock(self._fd, fcntl.LOCK_UN)
+
+        # Wake up the watchers: the writes to the mapping are not seen by inotify
+        try:
+            os.utime(self._fd)
+        except OSError:
+            pass
+        return True
+
+
+def get_otp_record() -> OTPRecord:
+    """Get or create the record of the process."""
+    global _record_instance
+    with _record_lock:
+        if _record_instance is None:
+            _record_instance = OTPRecord()
+        return _record_instance
@@ -0,0 +1,193 @@
+"""Full and delta packages of the binaries packager.
+
+Each package embeds a manifest (PACKAGE_MANIFEST, at the root of the zip) with the SHA-256 of every file of the
+resources it describes. A delta package is created against a base package: it only contains the files whose hash
+changed or that are new, and its manifest lists the files of the base to delete. Its manifest still describes all the
+files, so that a delta can itself be the base of the next one.
+
+The manifest is extracted with the package, which leaves in the resources folder the manifest of the installed
+package. A delta is only applied over the installed package it was created against, in place: the deleted files are
+removed, then the files are extracted, the manifest last, so an interrupted application can be run again.
+"""
+import json
+import os
+import time
+import zipfile
+
+from submodules.framework.src import archive_utils
+
+PACKAGE_MANIFEST = "package_manifest.json"
+"""Name of the manifest in the packages, and of the manifest of the installed package in the resources folder"""
+MANIFEST_FORMAT = 1
+"""Version of the layout of the manifest"""
+PROGRESS_INTERVAL = 0.5
+"""Minimum time, in seconds, between two progress reports"""
+
+
+def directory_hashes(root: str, files: list, progress=None) -> dict:
+    """Compute the SHA-256 of files of a folder
+
+    :param root: The folder
+    :type root: str
+    :param files: The paths of the files, relative to the folder
+    :type files: list
+    :param progress: Function called with the name of the current file and the progress in percent (0 to 99),
+        at most every PROGRESS_INTERVAL seconds, defaults to None
+    :type progress: Function, optional
+    :return: The hash of each file, by path relative to the folder with "/" as separator
+    :rtype: dict
+    """
+    hashes = {}
+    last_report = 0.0
+    for index, name in enumerate(files):
+        now = time.monotonic()
+        if progress and now - last_report >= PROGRESS_INTERVAL:
+            last_report = now
+            progress(name, index * 100 // len(files))
+        hashes[name.replace(os.path.sep, "/")] = archive_utils.file_sha256(os.path.join(root, name))
+    return hashes
+
+
+def read_package_manifest(package_path: str) -> dict:
+    """Read the manifest of a package
+
+    :param package_path: The path of the package
+    :type package_path: str
+    :return: The manifest, None if the package has none (created before the manifests)
+    :rtype: dict
+    """
+    with zipfile.ZipFile(package_path, mode="r") as package:
+        try:
+            return json.loads(package.read(PACKAGE_MANIFEST).decode("utf-8"))
+        except KeyError:
+            return None
+
+
+def read_installed_manifest(root: str) -> dict:
+    """Read the manifest of the package installed in a folder
+
+    :param root: The resources folder
+    :type root: str
+    :return: The manifest, None if the package installed is unknown
+    :rtype: dict
+    """
+    try:
+        with open(os.path.join(root, PACKAGE_MANIFEST), "r", encoding="utf-8") as file:
+            return json.load(file)
+    except (FileNotFoundError, ValueError):
+        return None
+
+
+def is_delta(manifest: dict) -> bool:
+    """Tell if a manifest is the one of a delta package
+
+    :param manifest: The manifest, or None
+    :type manifest: dict
+    :rtype: bool
+    """
+    return manifest is not None and manifest.get("base") is not None
+
+
+def create_package(
+    package_path: str, root: str, files: list, folders: list = None, base_path: str = None, progress=None
+) -> dict:
+    """Create a package of files of a folder, full or delta
+
+    The files are compressed directly from the folder, the package is written to a temporary file then renamed.
+
+    :param package_path: The path of the package to create
+    :type package_path: str
+    :param root: The folder of the files
+    :type root: str
+    :param files: The paths of the files to package, relative to the folder
+    :type files: list
+    :param folders: The paths of the folders to create, relative to the folder, defaults to None
+    :type folders: list, optional
+    :param base_path: The path of the base package, to create a delta package, defaults to None for a full package
+    :type base_path: str, optional
+    :param progress: Function called with the name of the current file and the progress in percent (0 to 99),
+        defaults to None
+    :type progress: Function, optional
+    :raises ValueError: If the base package has no manifest
+    :return: The manifest of the package
+    :rtype: dict
+    """
+    hashes = directory_hashes(root, files, progress)
+    manifest = {
+        "format": MANIFEST_FORMAT,
+        "package": os.path.basename(package_path),
+        "base": None,
+        "files": hashes,
+        "deleted": [],
+    }
+    packaged = sorted(hashes)
+
+    if base_path:
+        base = read_package_manifest(base_path)
+        if base is None:
+            raise ValueError(f"{os.path.basename(base_path)} has no manifest, it can't be the base of a delta package")
+        manifest["base"] = base["package"]
+        manifest["deleted"] = sorted(set(base["files"]) - set(hashes))
+        packaged = [name for name in packaged if base["files"].get(name) != hashes[name]]
+
+    temp_path = package_path + ".tmp"
+    try:
+        with zipfile.ZipFile(temp_path, mode="w", compression=zipfile.ZIP_DEFLATED) as package:
+            for folder in sorted(folders or []):
+                package.write(os.path.join(root, folder), folder.replace(os.path.sep, "/") + "/")
+            last_report = 0.0
+            for index, name in enumerate(packaged):
+                now = time.monotonic()
+                if progress and now - last_report >= PROGRESS_INTERVAL:
+                    last_report = now
+                    progress(name, index * 100 // len(packaged))
+                package.write(os.path.join(root, name), name)
+            # Last, so that it is extracted after all the files
+            package.writestr(PACKAGE_MANIFEST, json.dumps(manifest, indent=1))
+        os.replace(temp_path, package_path)
+    finally:
+        if os.path.exists(temp_path):
+            os.remove(temp_path)
+    return manifest
+
+
+def apply_delta(package_path: str, root: str, progress=None) -> dict:
+    """Apply a delta package in place
+
+    :param package_path: The path of the delta package
+    :type package_path: str
+    :param root: The resources folder, where its base package is installed
+    :type root: str
+    :param progress: Function called with the name of the current file and the progress in percent (0 to 99),
+        defaults to None
+    :type progress: Function, optional
+    :raises ValueError: If the package is not a delta package, if its base package is not the one installed, or if a
+        path is outside of the resources folder
+    :return: A dictionnary with "written", "skipped" and "deleted" (number of files written, already up to date, and
+        deleted)
+    :rtype: dict
+    """
+    manifest = read_package_manifest(package_path)
+    if not is_delta(manifest):
+        raise ValueError(f"{os.path.basename(package_path)} is not a delta package")
+    installed = read_installed_manifest(root)
+    if installed is None or installed.get("package") != manifest["base"]:
+        raise ValueError(
+            f"{os.path.basename(package_path)} applies over {manifest['base']}, installed package is "
+            f"{installed.get('package') if installed else 'unknown'}"
+        )
+
+    real_root = os.path.realpath(root)
+    deleted = 0
+    for name in manifest["deleted"]:
+        path = os.path.normpath(os.path.join(real_root, name))
+        if os.path.commonpath([real_root, path]) != real_root or path == real_root:
+            raise ValueError(f"Blocked path traversal in deleted file: {name}")
+        try:
+            os.remove(path)
+            deleted += 1
+        except FileNotFoundError:
+            pass
+
+    result = archive_utils.extract_archive(package_path, root, progress)
+    return {"written": result["written"], "skipped": result["skipped"], "deleted": deleted}
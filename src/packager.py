@@ -6,6 +6,9 @@ from submodules.framework.src import site_conf
 from submodules.framework.src import displayer
 from submodules.framework.src import scheduler
 from submodules.framework.src import SFTPConnection
+from submodules.framework.src import listing_cache
+from submodules.framework.src import archive_utils
+from submodules.framework.src import package_delta
 
 import shutil
 import socket
@@ -16,19 +19,78 @@ import errno
 from submodules.framework.src import threaded_action
 
 import os
-import tempfile
+
+FULL_PACKAGE = "Full package"
+"""Choice of the base package for a full package"""
 
 
 class SETUP_Packager(threaded_action.Threaded_action):
     m_default_name = "Binaries Package Manager"
     m_action = ""
+    m_base = None
+    """Base package of a delta package, None for a full package"""
 
     def set_file(self, file):
         self.m_file = file
 
+    def set_base(self, base):
+        self.m_base = base
+
     def set_action(self, action):
         self.m_action = action
 
+    def emit_reload_page(self):
+        """Emit the final status of an unpacking, with a meta tag that reloads the page"""
+        # Statut final avec balise meta pour rafraîchir la page
+        message = (
+            "<meta http-equiv='refresh' content='5'>"
+            "<p>Unpacking completed successfully. The page will reload shortly.</p>"
+        )
+        self.m_scheduler.emit_status(self.get_name(), message, 103)
+
+        time.sleep(7)
+        self.m_scheduler.emit_status(
+            self.get_name(), "Unpacking archive success", 100
+        )
+
+    def package_content(self) -> tuple:
+        """List the content of 'ressources' that goes in a package
+
+        :return: The folders and the files, relative to 'ressources'
+        :rtype: tuple
+        """
+        site_conf_obj = site_conf.site_conf_obj
+        folders = []
+        files_to_package = []
+
+        # Liste des dossiers spécifiques pour inclure tous les fichiers, y compris les .tar.gz
+        include_tar_gz_dirs = site_conf_obj.m_include_tar_gz_dirs
+        abs_tools_root = os.path.abspath("ressources/binaries/tools")
+
+        # Parcourir les fichiers dans 'ressources'
+        for root, dirs, files in os.walk("ressources"):
+            relative_path = os.path.relpath(root, "ressources")
+            if relative_path != ".":
+                folders.append(relative_path)
+
+            abs_root = os.path.abspath(root)
+            for file in files:
+                if relative_path == "." and file == package_delta.PACKAGE_MANIFEST:
+                    # Manifeste du paquet installé, remplacé par celui du nouveau paquet
+                    continue
+
+                if (
+                    # Tous les fichiers des dossiers spécifiques
+                    any(abs_root.startswith(os.path.abspath(include_dir)) for include_dir in include_tar_gz_dirs)
+                    # Uniquement les fichiers non .tar.gz pour les autres dossiers
+                    or not file.endswith(".tar.gz")
+                    # Les .tar.gz des sous-dossiers de tools, mais pas ceux à sa racine
+                    or (abs_root != abs_tools_root and abs_root.startswith(abs_tools_root))
+                ):
+                    files_to_package.append(os.path.normpath(os.path.join(relative_path, file)))
+
+        return folders, files_to_package
+
     def action(self):
         # Création d'une seule instance de connexion
         config = utilities.util_read_parameters()
@@ -59,42 +121,27 @@ class SETUP_Packager(threaded_action.Threaded_action):
                     with open(os.path.join("ressources", "version.txt"), 'w') as file:
                         file.write(site_conf_obj.m_app["version"].split("_")[0])
 
-                # Create a temporary directory to hold the archive content
-                with tempfile.TemporaryDirectory() as temp_dir:
-                    # Liste des dossiers spécifiques pour inclure tous les fichiers, y compris les .tar.gz
-                    include_tar_gz_dirs = site_conf_obj.m_include_tar_gz_dirs
-
-                    # Parcourir les fichiers dans 'ressources'
-                    for root, dirs, files in os.walk("ressources"):
-                        relative_path = os.path.relpath(root, "ressources")
-                        dest_dir = os.path.join(temp_dir, relative_path)
-                        os.makedirs(dest_dir, exist_ok=True)
-
-                        for file in files:
-                            source_path = os.path.join(root, file)
-                            dest_path = os.path.join(dest_dir, file)
-
-                            abs_root = os.path.abspath(root)
-                            abs_tools_root = os.path.abspath("ressources/binaries/tools")
-
-                            # Vérifier si le dossier actuel est un dossier spécifique
-                            # if any(os.path.commonpath([root, include_dir]) == include_dir for include_dir in include_tar_gz_dirs):
-                            if any(os.path.abspath(root).startswith(os.path.abspath(include_dir)) for include_dir in include_tar_gz_dirs):
-                                # Copier tous les fichiers des dossiers spécifiques
-                                shutil.copy(source_path, dest_path)
-                            elif not file.endswith(".tar.gz"):
-                                # Copier uniquement les fichiers non .tar.gz pour les autres dossiers
-                                shutil.copy(source_path, dest_path)
-                            elif (
-                                file.endswith(".tar.gz")
-                                and not abs_root == abs_tools_root  # <- exclut ceux à la racine de tools
-                                and abs_root.startswith(abs_tools_root)  # <- mais garde ceux dans ses sous-dossiers
-                            ):
-                                shutil.copy(source_path, dest_path)
-
-                    # Créer l'archive à partir du répertoire temporaire
-                    archive_path = os.path.join("packages", today.strftime("%y%m%d_" + self.m_file))
-                    shutil.make_archive(archive_path, "zip", temp_dir)
+                # Les fichiers sont compressés directement depuis 'ressources', sans copie
+                folders, files_to_package = self.package_content()
+
+                # Paquet delta : seuls les fichiers modifiés ou nouveaux depuis le paquet de base sont inclus
+                base_path = None
+                if self.m_base and self.m_base != FULL_PACKAGE:
+                    base_path = os.path.join("packages", self.m_base)
+
+                def package_progress(name, percent):
+                    self.m_scheduler.emit_status(
+                        self.get_name(), "Creating archive, this might take a while", percent, name
+                    )
+
+                archive_path = os.path.join("packages", today.strftime("%y%m%d_" + self.m_file) + ".zip")
+                manifest = package_delta.create_package(
+                    archive_path, "ressources", files_to_package, folders, base_path, package_progress
+                )
+                if package_delta.is_delta(manifest):
+                    self.m_logger.info(
+                        f"Delta package created over {manifest['base']}, {len(manifest['deleted'])} files deleted"
+                    )
 
                 self.m_scheduler.emit_status(
                     self.get_name(), "Creating archive, this might take a while", 100
@@ -106,7 +153,7 @@ class SETUP_Packager(threaded_action.Threaded_action):
                 )
 
             to_upload_files = utilities.util_dir_structure(
-                os.path.join("packages"), inclusion=[".zip"]
+                os.path.join("packages"), inclusion=[".zip"], exclusion=archive_utils.SIDE_FILE_SUFFIXES
             )
             reloader = utilities.util_view_reload_input_file_manager(
                 self.m_default_name,
@@ -117,7 +164,8 @@ class SETUP_Packager(threaded_action.Threaded_action):
                 ["primary"],
                 [False],
             )
-            self.m_scheduler.emit_reload(reloader)
+            # Only the clients viewing the packager page have the form
+            self.m_scheduler.emit_reload(reloader, room=self.m_scheduler.room_endpoint("packager.packager"))
 
         elif self.m_action == "upload_package":
             self.m_scheduler.emit_status(
@@ -144,15 +192,18 @@ class SETUP_Packager(threaded_action.Threaded_action):
                 except FileExistsError:
                     pass
 
-                shutil.copyfile(
-                    self.m_file,
-                    os.path.join(
-                        config["updates"]["folder"]["value"],
-                        "packages",
-                        site_conf_obj.m_app["name"],
-                        self.m_file.split(os.path.sep)[-1],
-                    ),
-                )
+                # The package goes with its manifest, verified before it is unpacked
+                manifest_path = archive_utils.write_manifest(self.m_file)
+                for file in (self.m_file, manifest_path):
+                    shutil.copyfile(
+                        file,
+                        os.path.join(
+                            config["updates"]["folder"]["value"],
+                            "packages",
+                            site_conf_obj.m_app["name"],
+                            file.split(os.path.sep)[-1],
+                        ),
+                    )
 
             # FTP mode
             elif config["updates"]["source"]["value"] == "FTP":
@@ -171,8 +222,16 @@ class SETUP_Packager(threaded_action.Threaded_action):
 
                     # Définition du chemin distant du fichier
                     remote_file_path = os.path.join(remote_dir, os.path.basename(self.m_file)).replace("\\", "/")
-                    # Envoi du fichier
-                    sftp_conn.upload_file(self.m_file, remote_file_path)
+                    # Envoi du fichier, puis de son manifeste (vérifié avant le déballage)
+                    manifest_path = archive_utils.write_manifest(self.m_file)
+                    sftp_conn.upload_file(
+                        self.m_file,
+                        remote_file_path,
+                        SFTPConnection.status_progress(
+                            self.m_scheduler, self.get_name(), "Uploading package, this might take a while"
+                        ),
+                    )
+                    sftp_conn.upload_file(manifest_path, remote_file_path + archive_utils.MANIFEST_SUFFIX)
 
                 except Exception as e:
                     self.m_logger.info(f"Package uploading failed: {e}")
@@ -184,6 +243,7 @@ class SETUP_Packager(threaded_action.Threaded_action):
             self.m_scheduler.emit_status(
                 self.get_name(), "Uploading package, this might take a while", 100
             )
+            listing_cache.invalidate_listings()
 
         elif (
             self.m_action == "download_package" or self.m_action == "load_package_file"
@@ -208,15 +268,18 @@ class SETUP_Packager(threaded_action.Threaded_action):
                 config = utilities.util_read_parameters()
                 # path_to_file = self.m_file
                 if config["updates"]["source"]["value"] == "Folder":
-                    shutil.copyfile(
-                        os.path.join(
-                            config["updates"]["folder"]["value"],
-                            "packages",
-                            site_conf_obj.m_app["name"],
-                            self.m_file,
-                        ),
-                        os.path.join("downloads", self.m_file),
+                    source_path = os.path.join(
+                        config["updates"]["folder"]["value"],
+                        "packages",
+                        site_conf_obj.m_app["name"],
+                        self.m_file,
                     )
+                    shutil.copyfile(source_path, os.path.join("downloads", self.m_file))
+                    if os.path.isfile(source_path + archive_utils.MANIFEST_SUFFIX):
+                        shutil.copyfile(
+                            source_path + archive_utils.MANIFEST_SUFFIX,
+                            os.path.join("downloads", self.m_file) + archive_utils.MANIFEST_SUFFIX,
+                        )
 
                 # FTP mode
                 elif config["updates"]["source"]["value"] == "FTP":
@@ -234,8 +297,23 @@ class SETUP_Packager(threaded_action.Threaded_action):
                         # Création du dossier local "downloads" s'il n'existe pas
                         os.makedirs(os.path.dirname(path_to_file), exist_ok=True)
 
-                        # Téléchargement du fichier
-                        sftp_conn.download_file(remote_file_path, path_to_file)
+                        # Téléchargement du fichier (repris s'il a été interrompu), puis de son manifeste
+                        sftp_conn.download_file(
+                            remote_file_path,
+                            path_to_file,
+                            SFTPConnection.status_progress(
+                                self.m_scheduler, self.get_name(), "Downloading package, this might take a while"
+                            ),
+                        )
+                        try:
+                            sftp_conn.download_file(
+                                remote_file_path + archive_utils.MANIFEST_SUFFIX,
+                                path_to_file + archive_utils.MANIFEST_SUFFIX,
+                            )
+                        except FileNotFoundError:
+                            # Package uploaded without manifest
+                            if os.path.isfile(path_to_file + archive_utils.MANIFEST_SUFFIX):
+                                os.remove(path_to_file + archive_utils.MANIFEST_SUFFIX)
 
                     except Exception as e:
                         self.m_logger.info(f"Download package failed: {e}")
@@ -243,11 +321,14 @@ class SETUP_Packager(threaded_action.Threaded_action):
                             self.get_name(),
                             "Downloading package, this might take a while",
                             101,
+                            supplement=str(e),
                         )
+                        return
 
                 self.m_scheduler.emit_status(
                     self.get_name(), "Downloading package, this might take a while", 100
                 )
+                listing_cache.invalidate_listings()
             else:
                 if ".zip" not in self.m_file:
                     self.m_scheduler.emit_popup(
@@ -255,6 +336,46 @@ class SETUP_Packager(threaded_action.Threaded_action):
                     )
                     return
 
+            # The package must match its manifest before the current content is removed
+            # Integrity only; a package without manifest is accepted unless archive_utils.MANIFEST_REQUIRED is set
+            try:
+                archive_utils.check_archive(path_to_file)
+            except (ValueError, OSError) as e:
+                self.m_logger.warning(f"Package verification failed: {e}")
+                self.m_scheduler.emit_status(
+                    self.get_name(), "Verifying package", 101, supplement=str(e)
+                )
+                return
+
+            # Paquet delta : appliqué sur place, par-dessus le paquet installé sur lequel il a été créé
+            try:
+                delta = package_delta.is_delta(package_delta.read_package_manifest(path_to_file))
+            except Exception as e:
+                self.m_logger.info("Package reading failed: " + str(e))
+                self.m_scheduler.emit_status(self.get_name(), "Reading package", 101, str(e))
+                return
+
+            if delta:
+                self.m_scheduler.emit_status(self.get_name(), "Applying delta package", 103)
+
+                def delta_progress(name, percent):
+                    self.m_scheduler.emit_status(self.get_name(), "Applying delta package", percent, name)
+
+                try:
+                    result = package_delta.apply_delta(path_to_file, os.path.join("ressources"), delta_progress)
+                except Exception as e:
+                    self.m_logger.info("Delta package application failed: " + str(e))
+                    self.m_scheduler.emit_status(self.get_name(), "Applying delta package", 101, str(e))
+                    return
+
+                self.m_logger.info(
+                    f"Delta package applied: {result['written']} files written, {result['skipped']} already up "
+                    f"to date, {result['deleted']} deleted"
+                )
+                self.m_scheduler.emit_status(self.get_name(), "Applying delta package", 100)
+                self.emit_reload_page()
+                return
+
             # Remove only .tar.gz files in the "ressources" folder and its subfolders, excluding specific directories
             self.m_scheduler.emit_status(self.get_name(), "Deleting old tar.gz content", 103)
 
@@ -265,6 +386,12 @@ class SETUP_Packager(threaded_action.Threaded_action):
             # exclude_tar_gz_dirs = site_conf_obj.m_include_tar_gz_dirs
 
             if os.path.exists(ressources_path):
+                # The manifest of the installed package is replaced by the one of the package, if it has one
+                try:
+                    os.remove(os.path.join(ressources_path, package_delta.PACKAGE_MANIFEST))
+                except FileNotFoundError:
+                    pass
+
                 for root, dirs, files in os.walk(ressources_path):
                     root_abs = os.path.abspath(root)
                     # Vérifie si root est dans un des dossiers exclus
@@ -308,19 +435,7 @@ class SETUP_Packager(threaded_action.Threaded_action):
                 self.m_scheduler.emit_status(
                     self.get_name(), "Unpacking archive, this might take a while", 100
                 )
-
-                # Émettre un statut avec une balise meta pour rafraîchir la page
-                # Statut final avec balise meta pour rafraîchir la page
-                message = (
-                    "<meta http-equiv='refresh' content='5'>"
-                    "<p>Unpacking completed successfully. The page will reload shortly.</p>"
-                )
-                self.m_scheduler.emit_status(self.get_name(), message, 103)
-
-                time.sleep(7)
-                self.m_scheduler.emit_status(
-                    self.get_name(), "Unpacking archive success", 100
-                )
+                self.emit_reload_page()
 
             except Exception as e:
                 self.m_logger.info("Unpacking failed: " + str(e))
@@ -350,6 +465,7 @@ def packager():
 
             if "pack" in data_in:
                 packager.set_file(data_in["create_package"])
+                packager.set_base(data_in.get("base_package"))
                 packager.set_action("create_package")
 
             elif "upload" in data_in:
@@ -404,8 +520,33 @@ def packager():
             displayer.DisplayerItemButton("pack", "Package creation"), 2
         )
 
+        # Base package of a delta package: only the files changed since it are packaged
+        base_packages = [
+            item for item in (os.listdir("packages") if os.path.isdir("packages") else [])
+            if item.endswith(".zip")
+        ]
+        disp.add_master_layout(
+            displayer.DisplayerLayout(
+                displayer.Layouts.VERTICAL,
+                [3, 6, 3],
+                subtitle="",
+                alignment=[
+                    displayer.BSalign.L,
+                    displayer.BSalign.L,
+                    displayer.BSalign.R,
+                ],
+            )
+        )
+        disp.add_display_item(displayer.DisplayerItemText("Delta over package"), 0)
+        disp.add_display_item(
+            displayer.DisplayerItemInputSelect(
+                "base_package", None, FULL_PACKAGE, [FULL_PACKAGE] + base_packages
+            ),
+            1,
+        )
+
         to_upload_files = utilities.util_dir_structure(
-            os.path.join("packages"), inclusion=[".zip"]
+            os.path.join("packages"), inclusion=[".zip"], exclusion=archive_utils.SIDE_FILE_SUFFIXES
         )
         disp.add_master_layout(
             displayer.DisplayerLayout(
@@ -450,7 +591,7 @@ def packager():
     )
 
     package_file = utilities.util_dir_structure(
-            os.path.join("downloads"), inclusion=[".zip"]
+            os.path.join("downloads"), inclusion=[".zip"], exclusion=archive_utils.SIDE_FILE_SUFFIXES
         )
     disp.add_display_item(displayer.DisplayerItemText("Package available localy"), 0)
     # disp.add_display_item(displayer.DisplayerItemInputFile("load_package_file"), 1)
@@ -472,8 +613,23 @@ def packager():
 
     # Folder mode
     if config["updates"]["source"]["value"] == "Folder":
-        if not os.path.exists(os.path.join(config["updates"]["folder"]["value"])):
-            info = "Configured package folder doesn't exists"
+        folder = config["updates"]["folder"]["value"]
+        package_dir = os.path.join(folder, "packages", site_conf_obj.m_app["name"])
+
+        def list_folder():
+            if not os.path.exists(os.path.join(folder)):
+                raise FileNotFoundError(folder)
+            return utilities.util_dir_structure(package_dir, inclusion=[".zip"], exclusion=archive_utils.SIDE_FILE_SUFFIXES)
+
+        # The listing of the share comes from the cache, refreshed in the background
+        content, error = listing_cache.get_listing(("Folder", package_dir), list_folder)
+        if isinstance(error, FileNotFoundError) or content is None:
+            if isinstance(error, FileNotFoundError):
+                info = "Configured package folder doesn't exists"
+            elif error is not None:
+                info = "Configured package folder not accessible: " + str(error)
+            else:
+                info = "The list of packages is being retrieved, please reload the page in a moment"
             disp.add_master_layout(
                 displayer.DisplayerLayout(
                     displayer.Layouts.VERTICAL,
@@ -486,14 +642,6 @@ def packager():
                 displayer.DisplayerItemAlert(info, displayer.BSstyle.INFO), 0
             )
         else:
-            content = utilities.util_dir_structure(
-                os.path.join(
-                    config["updates"]["folder"]["value"],
-                    "packages",
-                    site_conf_obj.m_app["name"],
-                ),
-                inclusion=[".zip"],
-            )
             disp.add_master_layout(
                 displayer.DisplayerLayout(
                     displayer.Layouts.VERTICAL,
@@ -521,29 +669,35 @@ def packager():
 
     # FTP mode
     elif config["updates"]["source"]["value"] == "FTP":
-        try:
-            sftp_conn = SFTPConnection.SFTPConnection(
-                config["updates"]["address"]["value"],
-                config["updates"]["user"]["value"],
-                config["updates"]["password"]["value"]
-            )
+        sftp_conn = SFTPConnection.SFTPConnection(
+            config["updates"]["address"]["value"],
+            config["updates"]["user"]["value"],
+            config["updates"]["password"]["value"]
+        )
 
-            # Définition du chemin distant
-            remote_dir = os.path.join(
-                config["updates"]["path"]["value"],
-                "packages",
-                site_conf_obj.m_app["name"]
-            ).replace("\\", "/")  # Compatibilité Windows/Linux
+        # Définition du chemin distant
+        remote_dir = os.path.join(
+            config["updates"]["path"]["value"],
+            "packages",
+            site_conf_obj.m_app["name"]
+        ).replace("\\", "/")  # Compatibilité Windows/Linux
 
-            # Récupération de la liste des fichiers
+        def list_server():
             try:
-                content = sftp_conn.listdir(remote_dir)
+                return [
+                    item for item in sftp_conn.listdir(remote_dir)
+                    if not item.endswith(archive_utils.SIDE_FILE_SUFFIXES)
+                ]
             except FileNotFoundError:
-                content = []
+                return []
 
-            # Fermeture de la connexion SFTP
-            sftp_conn.close()
+        # Récupération de la liste des fichiers, depuis le cache : la page n'attend pas le serveur
+        content, error = listing_cache.get_listing(
+            ("FTP", config["updates"]["address"]["value"], config["updates"]["user"]["value"], remote_dir),
+            list_server,
+        )
 
+        if content is not None:
             disp.add_master_layout(
                 displayer.DisplayerLayout(
                     displayer.Layouts.VERTICAL,
@@ -569,7 +723,20 @@ def packager():
                 displayer.DisplayerItemButton("download", "Install package"), 2
             )
 
-        except socket.gaierror:
+        if content is None and error is None:
+            info = "The list of packages is being retrieved from the server, please reload the page in a moment"
+            disp.add_master_layout(
+                displayer.DisplayerLayout(
+                    displayer.Layouts.VERTICAL,
+                    [12],
+                    subtitle="",
+                    alignment=[displayer.BSalign.C],
+                )
+            )
+            disp.add_display_item(
+                displayer.DisplayerItemAlert(info, displayer.BSstyle.INFO), 0
+            )
+        elif isinstance(error, (SFTPConnection.SFTPError, socket.gaierror)):
             info = "FTP server not accessible, please check your connection, use a zip file or use a local folder"
             disp.add_master_layout(
                 displayer.DisplayerLayout(
@@ -582,8 +749,8 @@ def packager():
             disp.add_display_item(
                 displayer.DisplayerItemAlert(info, displayer.BSstyle.INFO), 0
             )
-        except Exception as e:
-            info = "Unkown FTP error: " + str(e)
+        elif error is not None:
+            info = "Unkown FTP error: " + str(error)
             disp.add_master_layout(
                 displayer.DisplayerLayout(
                     displayer.Layouts.VERTICAL,
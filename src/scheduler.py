@@ -3,6 +3,7 @@ import threading
 import logging
 import logging.config
 
+from collections import OrderedDict
 from enum import Enum
 
 from submodules.framework.src import threaded_manager
@@ -20,6 +21,103 @@ class logLevel(Enum):
     empty = 4
 
 
+class queuePolicy(Enum):
+    drop_oldest = 0
+    drop_newest = 1
+
+
+class Message_queue:
+    """Thread-safe, bounded queue used by the scheduler to store the messages that have not been sent to the website yet.
+
+    When a key function is given, a message with the same key as a queued one replaces it in place (coalescing),
+    so that only the last value is sent. When the queue is full, the policy decides which message is dropped.
+    """
+
+    def __init__(self, capacity: int, policy: queuePolicy = queuePolicy.drop_oldest, key=None):
+        """Constructor
+
+        :param capacity: The maximum number of messages in the queue
+        :type capacity: int
+        :param policy: The message to drop when the queue is full, defaults to queuePolicy.drop_oldest
+        :type policy: queuePolicy, optional
+        :param key: A function that returns the coalescing key of a message, defaults to None (no coalescing)
+        :type key: Function, optional
+        """
+        self.m_capacity = capacity
+        self.m_policy = policy
+        self.m_key = key
+        self.m_lock = threading.Lock()
+        self.m_items = OrderedDict()
+        self.m_sequence = 0
+
+        self.m_dropped = 0
+        """Number of messages dropped because the queue was full"""
+
+        self.m_coalesced = 0
+        """Number of messages that replaced a queued message with the same key"""
+
+    def put(self, item) -> bool:
+        """Add a message to the queue
+
+        :param item: The message to add
+        :type item: Any
+        :return: True if the message has been queued, False if it has been dropped
+        :rtype: bool
+        """
+        with self.m_lock:
+            if self.m_key:
+                key = self.m_key(item)
+                if key in self.m_items:
+                    self.m_items[key] = item
+                    self.m_coalesced += 1
+                    return True
+            else:
+                key = self.m_sequence
+                self.m_sequence += 1
+
+            if len(self.m_items) >= self.m_capacity:
+                self.m_dropped += 1
+                if self.m_policy == queuePolicy.drop_newest:
+                    return False
+                self.m_items.popitem(last=False)
+
+            self.m_items[key] = item
+            return True
+
+    def drain(self) -> list:
+        """Return all the queued messages, in order, and empty the queue
+
+        :return: The queued messages
+        :rtype: list
+        """
+        with self.m_lock:
+            items = list(self.m_items.values())
+            self.m_items.clear()
+        return items
+
+    def get_statistics(self) -> dict:
+        """Return the statistics of the queue
+
+        :return: A dictionnary with the current length, the capacity, and the number of dropped and coalesced messages
+        :rtype: dict
+        """
+        with self.m_lock:
+            return {
+                "length": len(self.m_items),
+                "capacity": self.m_capacity,
+                "dropped": self.m_dropped,
+                "coalesced": self.m_coalesced,
+            }
+
+    def __len__(self):
+        with self.m_lock:
+            return len(self.m_items)
+
+    def __iter__(self):
+        with self.m_lock:
+            return iter(list(self.m_items.values()))
+
+
 class Scheduler_LongTerm:
     def __init__(self):
         self.functions = []
@@ -84,36 +182,222 @@ class Scheduler:
     socket_obj = None
     """Main object to the client socketio instance"""
 
-    m_status = []
-    """List of the status information that has not been sent to the website yet"""
+    m_status = Message_queue(500, key=lambda item: (item[4], item[0], item[1]))
+    """Queue of the status information that has not been sent to the website yet. Each line (category and text) is a row of the page: only the repeats of a same line are coalesced, to its last status"""
 
-    m_reload = []
-    """List of the reload information. A reload information concerns any item on the website that can be dinamicaly reloaded."""
+    m_reload = Message_queue(200, key=lambda item: (item[2], item[0]))
+    """Queue of the reload information. A reload information concerns any item on the website that can be dinamicaly reloaded."""
 
-    m_popups = []
-    """List of the popups that has not been sent to the website yet"""
+    m_popups = Message_queue(50)
+    """Queue of the popups that has not been sent to the website yet"""
 
-    m_contents = []
+    m_contents = Message_queue(100, key=lambda item: item[0])
     """To remove"""
 
-    m_buttons = []
-    """List of the buttons information (for instance, in topbar) that has not been sent to the website yet"""
+    m_buttons = Message_queue(100, key=lambda item: (item[4], item[0]))
+    """Queue of the buttons information (for instance, in topbar) that has not been sent to the website yet"""
 
-    m_results = []
-    """List of the results (from the task actions field in the webengine) that has not been sent to the website yet"""
+    m_results = Message_queue(50)
+    """Queue of the results (from the task actions field in the webengine) that has not been sent to the website yet"""
 
-    m_modals = []
-    """List of the modals dialogs that has not been sent to the website yet"""
+    m_modals = Message_queue(5, key=lambda item: (item[2], item[0]))
+    """Queue of the modals dialogs that has not been sent to the website yet. Modals can be big, so only the last 5 are kept"""
 
-    m_button_disable = []
-    """List of the buttons that will be disabled"""
+    m_button_disable = Message_queue(200, key=lambda item: (item[1], item[0]))
+    """Queue of the buttons that will be disabled"""
 
-    m_button_enable = []
-    """List of the buttons that will be enabled"""
+    m_button_enable = Message_queue(200, key=lambda item: (item[1], item[0]))
+    """Queue of the buttons that will be enabled"""
 
     m_user_connected = False
     """Indicate if a user is connected. If not, the scheduler is halted"""
 
+    m_clients = {}
+    """Connected clients, by socketio session id, in the form {sid: {"user": ..., "endpoints": [...]}}"""
+
+    m_clients_lock = threading.Lock()
+    """Lock protecting the connected clients"""
+
+    m_event_driven = True
+    """If True, the dispatch loop sleeps until an emit_* call wakes it up. Otherwise, it polls every 100 ms"""
+
+    m_idle_period = 1.0
+    """Maximum time, in seconds, the event driven dispatch loop sleeps without being woken up. Used to refresh the threads states and run the user hooks"""
+
+    m_min_period = 0.05
+    """Minimum time, in seconds, between two event driven cycles, so that bursts of emit_* calls are sent together"""
+
+    m_wakeup = threading.Event()
+    """Event set by the emit_* functions to wake the dispatch loop"""
+
+    m_last_threads = None
+    """Last threads information sent to the website, to only send it again when it changes"""
+
+    m_batch = True
+    """If True, all the information of a cycle is sent in a single "batch" event, with only the threads and buttons states that changed. Otherwise, one event is sent per information"""
+
+    m_button_states = {}
+    """Last enable (True) or disable (False) state sent to the website, by (room, button id)"""
+
+    def wake(self):
+        """Wake the dispatch loop, so that the queued information is sent as soon as possible"""
+        self.m_wakeup.set()
+
+    @staticmethod
+    def room_user(user: str) -> str:
+        """Return the name of the room of all the clients of a user
+
+        :param user: The user name
+        :type user: str
+        :return: The room name
+        :rtype: str
+        """
+        return f"user:{user}"
+
+    @staticmethod
+    def room_endpoint(endpoint: str) -> str:
+        """Return the name of the room of all the clients viewing a page
+
+        :param endpoint: The flask endpoint of the page, for instance "packager.packager"
+        :type endpoint: str
+        :return: The room name
+        :rtype: str
+        """
+        return f"endpoint:{endpoint}"
+
+    def on_user_connected(self, sid: str = None, user: str = None, endpoint: str = None) -> list:
+        """Register that a client is connected. When a new client or page is seen, the threads information is sent again so that it is up to date
+
+        :param sid: The socketio session id of the client, defaults to None
+        :type sid: str, optional
+        :param user: The user logged on the client, defaults to None
+        :type user: str, optional
+        :param endpoint: The flask endpoint of the page viewed by the client, defaults to None
+        :type endpoint: str, optional
+        :return: The rooms the client must join
+        :rtype: list
+        """
+        rooms = []
+        if user:
+            rooms.append(self.room_user(user))
+        if endpoint:
+            rooms.append(self.room_endpoint(endpoint))
+
+        new_page = True
+        if sid:
+            with self.m_clients_lock:
+                new_page = sid not in self.m_clients
+                client = self.m_clients.setdefault(sid, {"user": user, "endpoints": []})
+                client["user"] = user
+                if endpoint and endpoint not in client["endpoints"]:
+                    client["endpoints"].append(endpoint)
+                    new_page = True
+
+        self.m_user_connected = True
+        if new_page:
+            self.m_last_threads = None
+            self.m_button_states = {}
+        self.wake()
+        return rooms
+
+    def on_user_disconnected(self, sid: str = None):
+        """Register that a client is disconnected. The scheduler is halted when no more client is connected
+
+        :param sid: The socketio session id of the client, defaults to None (all the clients)
+        :type sid: str, optional
+        """
+        with self.m_clients_lock:
+            if sid:
+                self.m_clients.pop(sid, None)
+            else:
+                self.m_clients.clear()
+            self.m_user_connected = len(self.m_clients) > 0
+
+    def get_clients(self) -> dict:
+        """Return the connected clients
+
+        :return: The connected clients, by socketio session id, in the form {sid: {"user": ..., "endpoints": [...]}}
+        :rtype: dict
+        """
+        with self.m_clients_lock:
+            return {sid: {"user": client["user"], "endpoints": list(client["endpoints"])} for sid, client in self.m_clients.items()}
+
+    def _send(self, batches: dict, event: str, content, room: str = None):
+        """Send an information to the website, or add it to the batch of the current cycle in batch mode
+
+        :param batches: The batches of the current cycle, by room, in the form {room: {event: [content, ...]}}
+        :type batches: dict
+        :param event: The name of the socketio event
+        :type event: str
+        :param content: The content of the event
+        :type content: Any
+        :param room: The room to send the information to, defaults to None (all the clients)
+        :type room: str, optional
+        """
+        if self.m_batch:
+            batches.setdefault(room, {}).setdefault(event, []).append(content)
+        else:
+            self.socket_obj.emit(event, content, to=room)
+
+    def _send_threads(self, batches: dict, thread_info: list):
+        """Send the threads information, if it changed since the last cycle.
+        In batch mode, only the entries that changed are sent, in a "threads_delta" event
+
+        :param batches: The batches of the current cycle, by room
+        :type batches: dict
+        :param thread_info: The current threads information, a list of {name: ..., state: ...}
+        :type thread_info: list
+        """
+        if thread_info == self.m_last_threads:
+            return
+
+        if not self.m_batch or self.m_last_threads is None:
+            self._send(batches, "threads", thread_info)
+        else:
+            # Whole entries are compared: a change of "queued" alone must reach the clients too
+            previous = {item["name"]: item for item in self.m_last_threads}
+            current = {item["name"]: item for item in thread_info}
+            changed = [item for item in thread_info if previous.get(item["name"]) != item]
+            removed = [name for name in previous if name not in current]
+            self._send(batches, "threads_delta", {"changed": changed, "removed": removed})
+
+        self.m_last_threads = thread_info
+
+    def _filter_button_states(self, items: list, enabled: bool) -> dict:
+        """Keep only the buttons whose state differs from the last one sent, and remember the new state
+
+        :param items: The buttons, in the form [id, room]
+        :type items: list
+        :param enabled: True for the buttons to enable, False for the buttons to disable
+        :type enabled: bool
+        :return: The ids of the buttons to send, by room
+        :rtype: dict
+        """
+        changed = {}
+        for id, room in items:
+            if self.m_button_states.get((room, id)) != enabled:
+                self.m_button_states[(room, id)] = enabled
+                changed.setdefault(room, []).append(id)
+        return changed
+
+    def get_queues_statistics(self) -> dict:
+        """Return the statistics of all the message queues
+
+        :return: A dictionnary with the statistics of each queue, by queue name
+        :rtype: dict
+        """
+        return {
+            "status": self.m_status.get_statistics(),
+            "reload": self.m_reload.get_statistics(),
+            "popups": self.m_popups.get_statistics(),
+            "contents": self.m_contents.get_statistics(),
+            "buttons": self.m_buttons.get_statistics(),
+            "results": self.m_results.get_statistics(),
+            "modals": self.m_modals.get_statistics(),
+            "button_disable": self.m_button_disable.get_statistics(),
+            "button_enable": self.m_button_enable.get_statistics(),
+        }
+
     def user_before(self):
         """Function to be overwritten by specific website, ut is executed at the begning of a scheduler cycle"""
         return
@@ -122,35 +406,44 @@ class Scheduler:
         """Function to be overwritten by specific website, ut is executed at the end of a scheduler cycle"""
         return
 
-    def emit_reload(self, content: str):
+    def emit_reload(self, content: str, room: str = None):
         """Send some information about a formulaire that needs to be refreshed on the page
 
         :param content: The content of the formulaire, in the form of a list of {id: "...", content: "..."}
         :type content: str
+        :param room: The room to send the information to (see room_user and room_endpoint), defaults to None (all the clients)
+        :type room: str, optional
         """
         i = 0
         for item in content:
-            self.m_reload.append([item["id"], item["content"]])
+            self.m_reload.put([item["id"], item["content"], room])
             i += 1
+        self.wake()
 
-    def disable_button(self, id: str):
+    def disable_button(self, id: str, room: str = None):
         """Disable a button by its id
 
         :param id: The id of the button
         :type id: str
+        :param room: The room to send the information to (see room_user and room_endpoint), defaults to None (all the clients)
+        :type room: str, optional
         """
-        self.m_button_disable.append(id)
+        self.m_button_disable.put([id, room])
+        self.wake()
 
-    def enable_button(self, id: str):
+    def enable_button(self, id: str, room: str = None):
         """Enable a button by its id
 
         :param id: The id of the button
         :type id: str
+        :param room: The room to send the information to (see room_user and room_endpoint), defaults to None (all the clients)
+        :type room: str, optional
         """
-        self.m_button_enable.append(id)
+        self.m_button_enable.put([id, room])
+        self.wake()
 
     def emit_status(
-        self, category: str, string: str, status: int = 0, supplement: str = ""
+        self, category: str, string: str, status: int = 0, supplement: str = "", room: str = None
     ):
         """Queue a message status to be sent to the web client
 
@@ -163,21 +456,27 @@ class Scheduler:
         :type status: int, optional
         :param supplement: A supplement status that can be used to add information on the main case, defaults to ""
         :type supplement: str, optional
+        :param room: The room to send the information to (see room_user and room_endpoint), defaults to None (all the clients)
+        :type room: str, optional
         """
-        self.m_status.append([category, string, status, supplement])
+        self.m_status.put([category, string, status, supplement, room])
+        self.wake()
 
-    def emit_popup(self, level: logLevel, string: str):
+    def emit_popup(self, level: logLevel, string: str, room: str = None):
         """ "Emit a a popup that will be displayed to the user
 
         :param level: The log level of the popup (succes, info, warning or error)
         :type level: logLevel
         :param string: The content of the popup. Some html can be present in it.
         :type string: str
+        :param room: The room to send the information to (see room_user and room_endpoint), defaults to None (all the clients)
+        :type room: str, optional
         """
-        self.m_popups.append([level, string])
+        self.m_popups.put([level, string, room])
+        self.wake()
         return
 
-    def emit_result(self, category: str, content):
+    def emit_result(self, category: str, content, room: str = None):
         """Add a result information in the bottom of the "Action progress".
         The category is any category supported by bootstrap (success, danger, etc...)
 
@@ -185,11 +484,14 @@ class Scheduler:
         :type category: str
         :param content: The content to display. HTML is supported
         :type content: _type_
+        :param room: The room to send the information to (see room_user and room_endpoint), defaults to None (all the clients)
+        :type room: str, optional
         """
 
-        self.m_results.append([category, content])
+        self.m_results.put([category, content, room])
+        self.wake()
 
-    def emit_button(self, id: str, icon: str, text: str, style: str = "primary"):
+    def emit_button(self, id: str, icon: str, text: str, style: str = "primary", room: str = None):
         """Change the content of a topbar button
 
         :param id: The id of the button to
@@ -200,22 +502,27 @@ class Scheduler:
         :type text: str
         :param style: The bootstrap style of the button. Defaults to "primary"., defaults to "primary"
         :type style: str, optional
+        :param room: The room to send the information to (see room_user and room_endpoint), defaults to None (all the clients)
+        :type room: str, optional
         """
-        self.m_buttons.append([id, icon, text, style])
+        self.m_buttons.put([id, icon, text, style, room])
+        self.wake()
 
-    def emit_modal(self, id: str, content: str):
+    def emit_modal(self, id: str, content: str, room: str = None):
         """Change the content of a topbar modal
 
         :param id: The id of the button to
         :type id: str
         :param content: The new text
         :type content: str
+        :param room: The room to send the information to (see room_user and room_endpoint), defaults to None (all the clients)
+        :type room: str, optional
 
-        :notes: modal might be big, and having a lot of them can use a vast amount of memory if the user don't consume them. So only the last 5 ones are kept.
+        :notes: modal might be big, and having a lot of them can use a vast amount of memory if the user don't consume them. So only the last 5 ones are kept, and a new content for a queued id replaces the previous one.
         """
 
-        self.m_modals.append([id, content])
-        self.m_modals = self.m_modals[-5:] 
+        self.m_modals.put([id, content, room])
+        self.wake()
 
     def start(self):
         """Start the scheduler"""
@@ -223,52 +530,64 @@ class Scheduler:
         self.m_logger = logging.getLogger("website")
         self.m_logger.info("Scheduler started")
 
+        last_cycle = 0
+        last_dropped = 0
         while 1:
+            if self.m_event_driven:
+                # Sleep until an emit_* call or the idle period, then give a
+                # chance to the bursts to be grouped in the same cycle
+                self.m_wakeup.wait(self.m_idle_period)
+                elapsed = time.time() - last_cycle
+                if elapsed < self.m_min_period:
+                    time.sleep(self.m_min_period - elapsed)
+                self.m_wakeup.clear()
+
             if not self.m_user_connected:
-                time.sleep(1)
+                if not self.m_event_driven:
+                    time.sleep(1)
                 continue
 
+            last_cycle = time.time()
+
             self.user_before()
 
+            # Batches of the cycle, by room (None for all the clients)
+            batches = {}
+
             # Send buttons, if any
-            for item in self.m_buttons:
-                self.socket_obj.emit("button", {item[0]: [item[1], item[2], item[3]]})
+            for item in self.m_buttons.drain():
+                self._send(batches, "button", {item[0]: [item[1], item[2], item[3]]}, item[4])
 
             # Send popups if any
-            for item in self.m_popups:
+            for item in self.m_popups.drain():
                 level = item[0].name
-                self.socket_obj.emit("popup", {level: item[1]})
+                self._send(batches, "popup", {level: item[1]}, item[2])
 
             # Send content if any
-            for item in self.m_contents:
-                self.socket_obj.emit("content", {item[0]: item[1]})
-
-            # Send the status if any. Start by filtering the status so we only keep the last important ones
-            previous_status = ""
-            filtered_status = []
-            for item in reversed(self.m_status):
-                if item[1] != previous_status:
-                    filtered_status.append(item)
-                    previous_status = item[1]
-                else:
-                    continue
-
-            if len(filtered_status) > 0:
-                for item in reversed(filtered_status):
-                    self.socket_obj.emit(
-                        "action_status", {item[0]: [item[1], item[2], item[3]]}
-                    )
+            for item in self.m_contents.drain():
+                self._send(batches, "content", {item[0]: item[1]})
+
+            # Send the status if any. The queue already coalesced the status of a same line, so only the last ones are left.
+            # The status of different categories are merged in the same message
+            status_messages = {}
+            for item in self.m_status.drain():
+                room = item[4]
+                if item[0] in status_messages.get(room, {}):
+                    self._send(batches, "action_status", status_messages.pop(room), room)
+                status_messages.setdefault(room, {})[item[0]] = [item[1], item[2], item[3]]
+            for room, status_message in status_messages.items():
+                self._send(batches, "action_status", status_message, room)
 
             # Send result if any
-            for item in self.m_results:
-                self.socket_obj.emit("result", {"category": item[0], "text": item[1]})
+            for item in self.m_results.drain():
+                self._send(batches, "result", {"category": item[0], "text": item[1]}, item[2])
 
-            for item in self.m_modals:
-                self.socket_obj.emit("modal", {"id": item[0], "text": item[1]})
+            for item in self.m_modals.drain():
+                self._send(batches, "modal", {"id": item[0], "text": item[1]}, item[2])
 
             # Send new formulaire information
-            for item in self.m_reload:
-                self.socket_obj.emit("reload", {"id": item[0], "content": item[1]})
+            for item in self.m_reload.drain():
+                self._send(batches, "reload", {"id": item[0], "content": item[1]}, item[2])
 
             threads_names = threaded_manager.thread_manager_obj.get_unique_names()
             thread_info = []
@@ -277,24 +596,28 @@ class Scheduler:
                 for i, thread in enumerate(current_thread):
                     thread_info.append({
                         "name": f"{name} #{i+1}" if len(current_thread) > 1 else name,
-                        "state": thread.m_running_state
+                        "state": thread.m_running_state,
+                        "queued": getattr(thread, "m_queued", False)
                     })
 
-            self.socket_obj.emit("threads", thread_info)
+            self._send_threads(batches, thread_info)
 
-            # Send the button disable / enable
-            self.socket_obj.emit("disable_button", self.m_button_disable)
-            self.socket_obj.emit("enable_button", self.m_button_enable)
+            # Send the button disable / enable, only for the buttons that changed
+            for room, ids in self._filter_button_states(self.m_button_disable.drain(), False).items():
+                self._send(batches, "disable_button", ids, room)
+            for room, ids in self._filter_button_states(self.m_button_enable.drain(), True).items():
+                self._send(batches, "enable_button", ids, room)
 
-            self.m_status = []
-            self.m_popups = []
-            self.m_contents = []
-            self.m_results = []
-            self.m_modals = []
-            self.m_buttons = []
-            self.m_reload = []
-            self.m_button_disable = []
-            self.m_button_enable = []
+            for room, batch in batches.items():
+                self.socket_obj.emit("batch", batch, to=room)
+
+            # Report the messages lost since the last cycle
+            dropped = sum(stats["dropped"] for stats in self.get_queues_statistics().values())
+            if dropped > last_dropped:
+                self.m_logger.warning(f"Scheduler queues full, {dropped - last_dropped} message(s) dropped")
+                last_dropped = dropped
 
             self.user_after()
-            time.sleep(0.1)
+            if not self.m_event_driven:
+                time.sleep(0.1)
+
@@ -7,6 +7,12 @@ import json
 import logging
 import socket
 import os
+import threading
+import tempfile
+import time
+import atexit
+import bcrypt
+from concurrent.futures import Future, ThreadPoolExecutor
 from pathlib import Path
 from datetime import datetime, timedelta
 
@@ -40,11 +46,24 @@ LOCKOUT_DURATION = 300  # Lockout duration in seconds (5 minutes)
 # Fichier de stockage persistant des tentatives échouées
 LOCKOUT_FILE = _get_lockout_file_path()
 
+BCRYPT_ROUNDS = 12  # Coût bcrypt des nouveaux hash (peut être changé par access.bcrypt_rounds dans la config)
+HASH_WORKERS = 2  # Nombre de threads de calcul bcrypt
+HASH_WAIT_STEP = 0.01  # Pas de l'attente d'un calcul bcrypt, en secondes (cède la main aux autres requêtes)
+HASH_TIMEOUT = 30.0  # Attente maximale d'un calcul bcrypt, en secondes
+LOCKOUT_FLUSH_INTERVAL = 10  # Délai maximal (secondes) avant l'écriture des tentatives modifiées
+
 
 class FailedLoginManager:
-    """Gestionnaire persistant des tentatives de connexion échouées"""
+    """Gestionnaire persistant des tentatives de connexion échouées.
+    L'état est gardé en mémoire; le fichier n'est réécrit que si l'état a changé, au plus une fois par
+    LOCKOUT_FLUSH_INTERVAL (immédiatement quand un compte est verrouillé), de façon atomique.
+    """
     
     def __init__(self):
+        self._lock = threading.RLock()
+        self._write_lock = threading.Lock()  # Une seule écriture à la fois, de la photo de l'état au renommage
+        self._dirty = False
+        self._timer = None
         self.attempts = self._load_attempts()
     
     def _load_attempts(self):
@@ -65,63 +84,110 @@ class FailedLoginManager:
                 return {}
         return {}
     
-    def _save_attempts(self):
-        """Sauvegarde les tentatives dans le fichier JSON"""
-        try:
-            # Convertir les datetime en string pour JSON
-            data = {}
-            for username, info in self.attempts.items():
-                data[username] = {
-                    'count': info['count'],
-                    'locked_until': info['locked_until'].isoformat() if info.get('locked_until') else None
-                }
-            
-            with open(LOCKOUT_FILE, 'w') as f:
-                json.dump(data, f, indent=4)
-        except Exception as e:
-            logger.error(f"Error saving failed login attempts: {e}")
+    def _save_attempts(self, immediate: bool = False):
+        """Note que l'état a changé: il sera écrit par flush, tout de suite ou après LOCKOUT_FLUSH_INTERVAL"""
+        with self._lock:
+            self._dirty = True
+            if not immediate and self._timer is None:
+                self._timer = threading.Timer(LOCKOUT_FLUSH_INTERVAL, self.flush)
+                self._timer.daemon = True
+                self._timer.start()
+        if immediate:
+            self.flush()
+    
+    def flush(self):
+        """Sauvegarde les tentatives dans le fichier JSON si elles ont changé (fichier temporaire puis renommage).
+
+        Les écritures (timer et verrouillage immédiat) sont sérialisées : une photo plus ancienne de l'état ne
+        peut pas remplacer une plus récente, et le fichier temporaire n'est jamais partagé.
+        """
+        with self._write_lock:
+            with self._lock:
+                if self._timer is not None:
+                    self._timer.cancel()
+                    self._timer = None
+                if not self._dirty:
+                    return
+                self._dirty = False
+
+                # Convertir les datetime en string pour JSON, sans les utilisateurs sans tentative
+                data = {}
+                for username, info in self.attempts.items():
+                    if info['count'] == 0 and not info.get('locked_until'):
+                        continue
+                    data[username] = {
+                        'count': info['count'],
+                        'locked_until': info['locked_until'].isoformat() if info.get('locked_until') else None
+                    }
+
+            tmp_file = None
+            try:
+                fd, tmp_file = tempfile.mkstemp(dir=os.path.dirname(str(LOCKOUT_FILE)), suffix=".tmp")
+                with os.fdopen(fd, 'w') as f:
+                    json.dump(data, f)
+                    f.flush()
+                    os.fsync(f.fileno())
+                os.replace(tmp_file, LOCKOUT_FILE)
+            except Exception as e:
+                logger.error(f"Error saving failed login attempts: {e}")
+                if tmp_file and os.path.exists(tmp_file):
+                    os.remove(tmp_file)
+                # Réessayé à la prochaine modification
+                with self._lock:
+                    self._dirty = True
     
     def get_user_status(self, username):
         """Retourne le statut d'un utilisateur (count, locked_until)"""
-        if username not in self.attempts:
-            self.attempts[username] = {'count': 0, 'locked_until': None}
-        return self.attempts[username]
+        with self._lock:
+            if username not in self.attempts:
+                self.attempts[username] = {'count': 0, 'locked_until': None}
+            return self.attempts[username]
     
     def is_locked(self, username):
         """Vérifie si un utilisateur est verrouillé"""
-        status = self.get_user_status(username)
-        locked_until = status.get('locked_until')
-        
-        if locked_until and datetime.now() < locked_until:
-            return True, locked_until
-        elif locked_until and datetime.now() >= locked_until:
-            # Lock expiré, réinitialiser
-            self.reset_attempts(username)
+        with self._lock:
+            status = self.get_user_status(username)
+            locked_until = status.get('locked_until')
+            
+            if locked_until and datetime.now() < locked_until:
+                return True, locked_until
+            elif locked_until and datetime.now() >= locked_until:
+                # Lock expiré, réinitialiser
+                self.reset_attempts(username)
+                return False, None
+            
             return False, None
-        
-        return False, None
     
     def increment_attempts(self, username):
         """Incrémente le compteur de tentatives échouées"""
-        status = self.get_user_status(username)
-        status['count'] += 1
-        
-        if status['count'] >= ATTEMPTS_BEFORE_LOCKOUT:
-            status['locked_until'] = datetime.now() + timedelta(seconds=LOCKOUT_DURATION)
-            logger.warning(f"Account '{username}' locked until {status['locked_until'].strftime('%Y-%m-%d %H:%M:%S')}")
-        
-        self._save_attempts()
-        return status['count']
+        with self._lock:
+            status = self.get_user_status(username)
+            status['count'] += 1
+            
+            locked = status['count'] >= ATTEMPTS_BEFORE_LOCKOUT
+            if locked:
+                status['locked_until'] = datetime.now() + timedelta(seconds=LOCKOUT_DURATION)
+                logger.warning(f"Account '{username}' locked until {status['locked_until'].strftime('%Y-%m-%d %H:%M:%S')}")
+            
+            # Un verrouillage doit survivre à un redémarrage: écrit tout de suite
+            self._save_attempts(immediate=locked)
+            return status['count']
     
     def reset_attempts(self, username):
         """Réinitialise les tentatives échouées (après connexion réussie)"""
-        self.attempts[username] = {'count': 0, 'locked_until': None}
-        self._save_attempts()
+        with self._lock:
+            status = self.attempts.get(username)
+            if not status or (status['count'] == 0 and not status.get('locked_until')):
+                # Rien n'a changé, pas d'écriture
+                return
+            self.attempts[username] = {'count': 0, 'locked_until': None}
+            self._save_attempts()
     
     def get_remaining_attempts(self, username):
         """Retourne le nombre de tentatives restantes"""
-        status = self.get_user_status(username)
-        return max(0, ATTEMPTS_BEFORE_LOCKOUT - status['count'])
+        with self._lock:
+            status = self.get_user_status(username)
+            return max(0, ATTEMPTS_BEFORE_LOCKOUT - status['count'])
     
     def get_lockout_time_remaining(self, username):
         """Retourne le temps restant avant déverrouillage (en secondes)"""
@@ -132,5 +198,81 @@ class FailedLoginManager:
         return 0
 
 
+def _bcrypt_check(password: bytes, stored_hash: bytes) -> bool:
+    """Exécuté dans le pool de calcul: vérifie un mot de passe"""
+    return bcrypt.checkpw(password, stored_hash)
+
+
+def _bcrypt_hash(password: bytes, rounds: int) -> bytes:
+    """Exécuté dans le pool de calcul: hash un mot de passe"""
+    return bcrypt.hashpw(password, bcrypt.gensalt(rounds))
+
+
+class PasswordHasher:
+    """Service de hash bcrypt: les calculs sont faits dans un petit pool de threads. bcrypt libère le GIL
+    pendant le calcul, les centaines de millisecondes d'un checkpw sur la cible ne bloquent donc pas le serveur.
+    Pas de pool de processus: ses processus réimporteraient __main__, qui démarre l'application.
+
+    La requête de connexion attend son propre résultat, par petits pas (time.sleep) : les autres requêtes
+    continuent, y compris avec un serveur à threads verts.
+    """
+
+    def __init__(self, rounds: int = BCRYPT_ROUNDS, workers: int = HASH_WORKERS):
+        self.rounds = rounds
+        self.workers = workers
+        self._executor = None
+        self._lock = threading.Lock()
+
+    def _get_executor(self):
+        """Crée le pool au premier usage"""
+        with self._lock:
+            if self._executor is None:
+                self._executor = ThreadPoolExecutor(max_workers=self.workers, thread_name_prefix="bcrypt")
+            return self._executor
+
+    def _run(self, function, *args):
+        """Exécute une fonction dans le pool et attend son résultat"""
+        future = self._get_executor().submit(function, *args)
+        deadline = time.monotonic() + HASH_TIMEOUT
+        while not future.done():
+            if time.monotonic() > deadline:
+                future.cancel()
+                raise TimeoutError("bcrypt computation timed out")
+            time.sleep(HASH_WAIT_STEP)
+        return future.result()
+
+    def set_rounds(self, rounds: int):
+        """Change le coût des prochains hash"""
+        self.rounds = max(4, min(31, int(rounds)))
+
+    def check(self, password: str, stored_hash: str) -> bool:
+        """Vérifie un mot de passe contre son hash bcrypt"""
+        return self._run(_bcrypt_check, password.encode('utf-8'), stored_hash.encode('utf-8'))
+
+    def hash(self, password: str) -> str:
+        """Retourne le hash bcrypt d'un mot de passe, au coût courant"""
+        return self._run(_bcrypt_hash, password.encode('utf-8'), self.rounds).decode('utf-8')
+
+    def hash_async(self, password: str) -> Future:
+        """Comme hash, mais retourne un Future au lieu d'attendre le résultat"""
+        return self._get_executor().submit(_bcrypt_hash, password.encode('utf-8'), self.rounds)
+
+    def needs_rehash(self, stored_hash: str) -> bool:
+        """Indique si un hash a été calculé avec un coût différent du coût courant"""
+        try:
+            return int(stored_hash.split('$')[2]) != self.rounds
+        except (IndexError, ValueError):
+            return False
+
+    def shutdown(self):
+        """Arrête le pool de calcul"""
+        with self._lock:
+            if self._executor is not None:
+                self._executor.shutdown(wait=False)
+                self._executor = None
+
+
 # Instance globale
 failed_login_manager = FailedLoginManager()
+atexit.register(failed_login_manager.flush)
+password_hasher = PasswordHasher()
@@ -5,22 +5,95 @@ from submodules.framework.src import utilities
 from submodules.framework.src import access_manager
 from submodules.framework.src import displayer
 from submodules.framework.src import User_defined_module
+from submodules.framework.src import log_utils
+from submodules.framework.src import log_index
 
 import json
 import subprocess
 import psutil
-import socket
 import importlib
 import os
 import sys
-import re
 import platform
+import threading
+import time
+import uuid
+import logging
+
+from urllib.parse import quote
 
 from datetime import datetime
 
 
 bp = Blueprint("settings", __name__, url_prefix="/settings")
 
+LOG_PAGE_SIZE = 100
+"""Number of entries of each log displayed per page"""
+
+CONFIG_DRAFT_LIFETIME = 3600
+"""Time, in seconds, after which a configuration draft that was not applied is forgotten"""
+
+
+class Config_draft:
+    """Copy of the configuration being edited on the settings page. It is kept in memory between the display of
+    the edition page and the application of the form, and only its id is stored in the session of the user.
+    """
+
+    m_drafts = {}
+    """The drafts in progress, by id"""
+    m_lock = threading.Lock()
+
+    def __init__(self, config: dict, version: int):
+        """Create a draft, use Config_draft.start() to register it for the current session
+
+        :param config: A modifiable copy of the configuration
+        :type config: dict
+        :param version: The version of the configuration the copy was taken from
+        :type version: int
+        """
+        self.m_id = str(uuid.uuid4())
+        self.m_config = config
+        self.m_version = version
+        self.m_time = time.time()
+
+    @classmethod
+    def start(cls):
+        """Start the edition of the configuration for the current session, replacing its previous draft if any
+
+        :return: The new draft, completed with config_complete
+        :rtype: Config_draft
+        """
+        version = utilities.util_get_parameters_version()
+        draft = cls(config_complete(utilities.util_copy_parameters()), version)
+
+        now = time.time()
+        with cls.m_lock:
+            # Forget the drafts that were abandoned, and the previous one of this session
+            for draft_id in [key for key, value in cls.m_drafts.items() if now - value.m_time > CONFIG_DRAFT_LIFETIME]:
+                cls.m_drafts.pop(draft_id)
+            cls.m_drafts.pop(session.get("config_draft"), None)
+            cls.m_drafts[draft.m_id] = draft
+
+        session["config_draft"] = draft.m_id
+        return draft
+
+    @classmethod
+    def get(cls):
+        """Return the draft of the current session
+
+        :return: The draft, or None if there is no edition in progress
+        :rtype: Config_draft
+        """
+        with cls.m_lock:
+            return cls.m_drafts.get(session.get("config_draft"))
+
+    def discard(self):
+        """End the edition: the draft is forgotten"""
+        with self.m_lock:
+            self.m_drafts.pop(self.m_id, None)
+        if session.get("config_draft") == self.m_id:
+            session.pop("config_draft")
+
 
 @bp.route("/ip_config", methods=["GET"])
 def ip_config():
@@ -100,24 +173,15 @@ def ip_config_apply():
     return render_template("base.j2")
 
 
-@bp.route("/config_edit", methods=["GET"])
-def config_edit():
-    """Standard page to edit the config file"""
-
-    if not access_manager.auth_object.authorize_group("admin"):
-        return render_template("unauthorized.j2")
-
-    # Load configuration
-    session["page_info"] = "sidebar.configuration_settings"
-    serial = []
-    for item in session["config"]:
-        for subitem in session["config"][item]:
-            if (
-                "type" in session["config"][item][subitem]
-                and session["config"][item][subitem]["type"] == "serial_select"
-            ):
-                serial = utilities.util_list_serial()
+def config_complete(config: dict) -> dict:
+    """Complete a configuration before its edition: add the modules of the application, the new users, and remove
+    what is related to the deleted users
 
+    :param config: A modifiable copy of the configuration
+    :type config: dict
+    :return: The same configuration, completed
+    :rtype: dict
+    """
     # Detect if we're running from exe
     if getattr(sys, "frozen", False) and hasattr(sys, "_MEIPASS"):
         app_path = sys._MEIPASS
@@ -140,47 +204,68 @@ def config_edit():
                 continue
 
     # Update modules
-    if "access" in session["config"]:
+    if "access" in config:
         for module in modules:
-            if module not in session["config"]["access"]["modules"]["value"]:
-                session["config"]["access"]["modules"]["value"][module] = ["admin"]
-        session["config"]["access"]["modules"]["constrains"] = session["config"]["access"]["groups"]["value"]
+            if module not in config["access"]["modules"]["value"]:
+                config["access"]["modules"]["value"][module] = ["admin"]
+        config["access"]["modules"]["constrains"] = config["access"]["groups"]["value"]
 
         # Also add system modules:
-        session["config"]["access"]["modules"]["value"]["Website engine update creation"] = ["admin", "user", "quality", "technicians"]
-        session["config"]["access"]["modules"]["value"]["Website engine update"] = ["admin", "user", "quality", "technicians"]
+        config["access"]["modules"]["value"]["Website engine update creation"] = ["admin", "user", "quality", "technicians"]
+        config["access"]["modules"]["value"]["Website engine update"] = ["admin", "user", "quality", "technicians"]
 
         # Update user groups
-        for user in session["config"]["access"]["users"]["value"]:
-            if user not in session["config"]["access"]["users_groups"]["value"]:
-                session["config"]["access"]["users_groups"]["value"][user] = ["admin"]
-        session["config"]["access"]["users_groups"]["constrains"] = session["config"]["access"]["groups"]["value"]
+        for user in config["access"]["users"]["value"]:
+            if user not in config["access"]["users_groups"]["value"]:
+                config["access"]["users_groups"]["value"][user] = ["admin"]
+        config["access"]["users_groups"]["constrains"] = config["access"]["groups"]["value"]
         to_remove = []
-        for user in session["config"]["access"]["users_groups"]["value"]:
-            if user not in session["config"]["access"]["users"]["value"]:
+        for user in config["access"]["users_groups"]["value"]:
+            if user not in config["access"]["users"]["value"]:
                 to_remove.append(user)
 
         for removal in to_remove:
-            session["config"]["access"]["users_groups"]["value"].pop(removal)
+            config["access"]["users_groups"]["value"].pop(removal)
 
         # Update user passwords
-        for user in session["config"]["access"]["users"]["value"]:
-            if user not in session["config"]["access"]["users_password"]["value"]:
-                session["config"]["access"]["users_password"]["value"][user] = [""]
+        for user in config["access"]["users"]["value"]:
+            if user not in config["access"]["users_password"]["value"]:
+                config["access"]["users_password"]["value"][user] = [""]
 
         to_remove = []
-        for user in session["config"]["access"]["users_password"]["value"]:
-            if user not in session["config"]["access"]["users"]["value"]:
+        for user in config["access"]["users_password"]["value"]:
+            if user not in config["access"]["users"]["value"]:
                 to_remove.append(user)
 
         for removal in to_remove:
-            session["config"]["access"]["users_password"]["value"].pop(removal)
+            config["access"]["users_password"]["value"].pop(removal)
+
+    return config
+
+
+@bp.route("/config_edit", methods=["GET"])
+def config_edit():
+    """Standard page to edit the config file"""
+
+    if not access_manager.auth_object.authorize_group("admin"):
+        return render_template("unauthorized.j2")
+
+    # Load configuration, in a draft kept until it is applied
+    session["page_info"] = "sidebar.configuration_settings"
+    config = Config_draft.start().m_config
+    serial = []
+    for item in config:
+        for subitem in config[item]:
+            if (
+                "type" in config[item][subitem]
+                and config[item][subitem]["type"] == "serial_select"
+            ):
+                serial = utilities.util_list_serial()
 
     # And now, display!
     disp = displayer.Displayer()
     disp.add_generic("Configuration", display=False)
     disp.set_title(f"Settings")
-    config = session["config"]
 
     for group in config:
         disp.add_master_layout(
@@ -380,43 +465,54 @@ def config_apply():
         # Jsonify the input data
         data_json = utilities.util_post_to_json(data_post)["Configuration"]
 
+        # The draft of the configuration that was displayed, or a new one if it expired
+        draft = Config_draft.get() or Config_draft.start()
+        config = draft.m_config
+        if draft.m_version != utilities.util_get_parameters_version():
+            logging.getLogger("website").warning("The configuration changed since its edition started, it is overwritten")
+
         for group in data_json:
             for item in data_json[group]:
                 if "_list" not in item and "mapleft" not in item and "mapright" not in item and "persistent" not in group:
                     if (
-                        session["config"][group][item]["type"] == "string"
-                        or session["config"][group][item]["type"] == "int"
-                        or session["config"][group][item]["type"] == "select"
-                        or session["config"][group][item]["type"] == "serial_select"
+                        config[group][item]["type"] == "string"
+                        or config[group][item]["type"] == "int"
+                        or config[group][item]["type"] == "select"
+                        or config[group][item]["type"] == "serial_select"
                     ):
-                        session["config"][group][item]["value"] = data_json[group][item]
+                        config[group][item]["value"] = data_json[group][item]
                     elif (
-                        session["config"][group][item]["type"] == "free_list"
-                        or session["config"][group][item]["type"] == "constrained_list"
-                        or session["config"][group][item]["type"] == "s"
+                        config[group][item]["type"] == "free_list"
+                        or config[group][item]["type"] == "constrained_list"
+                        or config[group][item]["type"] == "s"
                     ):
-                        session["config"][group][item]["value"] = data_json[group][
+                        config[group][item]["value"] = data_json[group][
                             item
                         ].split("#")
-                    elif session["config"][group][item]["type"] == "modules":
-                        session["config"][group][item]["value"] = json.loads(
+                    elif config[group][item]["type"] == "modules":
+                        config[group][item]["value"] = json.loads(
                             data_json[group][item].replace("'", '"')
                         )
-                    elif "mapping" in session["config"][group][item]["type"]:
+                    elif "mapping" in config[group][item]["type"]:
                         mapping_info = {}
                         for map_item in data_json[group][item]:
                             if "_list" not in map_item and data_json[group][item][map_item]:
                                 mapping_info[map_item] = data_json[group][item][
                                     map_item
                                 ].split("#")
-                        session["config"][group][item]["value"] = mapping_info
+                        config[group][item]["value"] = mapping_info
 
                     if "persistent" in data_json and group in data_json["persistent"] and item in data_json["persistent"][group]:
-                        session["config"][group][item]["persistent"] = True
+                        config[group][item]["persistent"] = True
                     else:
-                        session["config"][group][item]["persistent"] = False
+                        config[group][item]["persistent"] = False
 
-        utilities.util_write_parameters(session["config"])
+        # Written before answering, so that a failed write is reported instead of a success
+        try:
+            utilities.util_write_parameters(config, flush=True)
+        except Exception as e:
+            return render_template("failure.j2", message=f"Settings save failed with the following message: {e}")
+        draft.discard()
 
         # Reload authorization
         access_manager.auth_object.load_authorizations()
@@ -428,92 +524,65 @@ def config_apply():
 
 
 def parse_log_file(log_file):
-    log_entries = []
-
-    log_pattern = r"(\d{4}-\d{2}-\d{2} \d{2}:\d{2}:\d{2},\d{3}) \| (\w+) +\| (\w+\.\w+) +\| (\w+) +\| (\d+) +\| (.*)"
-
-    with open(log_file, "r") as file:
-        lines = file.readlines()
-
-    full_line = ""
-    previous_entry = {
-        "time": 0,
-        "level": 0,
-        "file": "",
-        "function": "",
-        "line": 0,
-        "message": "",
-    }
-    current_entry = {
-        "time": 0,
-        "level": 0,
-        "file": "",
-        "function": "",
-        "line": 0,
-        "message": "",
-    }
-    for line in reversed(lines):
-        full_line = line + full_line
-        if "|" not in line:
-            continue
-        else:
-            match = re.match(log_pattern, full_line, re.DOTALL)
-            if match:
-                timestamp_str, level, file, function, line_num, message = match.groups()
-
-                timestamp = datetime.strptime(timestamp_str, "%Y-%m-%d %H:%M:%S,%f")
-                timestamp = timestamp.replace(microsecond=0)
-
-                current_entry = {
-                    "time": timestamp,
-                    "level": level,
-                    "file": file,
-                    "function": function,
-                    "line": int(line_num),
-                    "message": message.strip(),
-                }
-
-                if current_entry["message"] == "Scheduler started":
-                    log_entries.append(current_entry)
-                    break
-
-                are_equal = all(previous_entry[key] == current_entry[key] for key in previous_entry if key != "message")
-                if are_equal:
-                    current_entry["message"] = previous_entry["message"] + '<br>' + current_entry["message"]
-                    previous_entry = current_entry
-                    break
-
-                if previous_entry["time"] != 0:
-                    log_entries.append(previous_entry)
-                previous_entry = current_entry
-                full_line = ""
-
-    # Don't forget the last one...
-    if current_entry["time"] != 0:
-        log_entries.append(current_entry)
-    log_entries.reverse()
-
+    """Return the entries of a log file since the last start of the application, the oldest first
+
+    :param log_file: The path of the log file
+    :type log_file: str
+    :return: The list of entries (dictionnaries with time, level, file, function, line, message)
+    :rtype: list
+    """
+    log_entries, _ = log_index.get_log_index(log_file).query(page_size=None, newest_first=False)
     return log_entries
 
 
+def parse_log_time(value: str) -> datetime:
+    """Parse a time given in the url of the log page
+
+    :param value: The time, as "YYYY-mm-dd HH:MM:SS", "YYYY-mm-ddTHH:MM" or "YYYY-mm-dd"
+    :type value: str
+    :return: The time, or None if it is empty or invalid
+    :rtype: datetime
+    """
+    if not value:
+        return None
+    for time_format in ["%Y-%m-%d %H:%M:%S", "%Y-%m-%dT%H:%M:%S", "%Y-%m-%dT%H:%M", "%Y-%m-%d"]:
+        try:
+            return datetime.strptime(value, time_format)
+        except ValueError:
+            continue
+    return None
+
+
 @bp.route("/logs", methods=["GET"])
 def logs():
-    """Log pages"""
+    """Log pages. The url parameters page, level (minimum level), start and end (times) and all (not only since the last start) select the entries"""
     disp = displayer.Displayer()
     disp.add_generic("Log", display=False)
     disp.set_title(f"Logs display")
 
+    try:
+        page = max(int(request.args.get("page", 0)), 0)
+    except ValueError:
+        page = 0
+    level = request.args.get("level")
+    start_time = parse_log_time(request.args.get("start"))
+    end_time = parse_log_time(request.args.get("end"))
+    since_start = request.args.get("all") is None
+
     # Determine log path based on on_target status
-    hostname = socket.gethostname()
-    on_target = "al70x" in hostname
-    
-    if on_target:
-        log_files = ["/tmp/website.log", "/tmp/root.log"]
-    else:
-        log_files = ["website.log", "root.log"]
-    
+    log_files = list(log_utils.get_log_paths())
+
+    more = False
     for log_file in log_files:
-        log_entries = parse_log_file(log_file)
+        log_entries, total = log_index.get_log_index(log_file).query(
+            page=page,
+            page_size=LOG_PAGE_SIZE,
+            level=level,
+            start_time=start_time,
+            end_time=end_time,
+            since_start=since_start,
+        )
+        more = more or total > (page + 1) * LOG_PAGE_SIZE
 
         # Extract just the filename for display
         log_name = os.path.basename(log_file)
@@ -526,7 +595,7 @@ def logs():
         )
 
         i = 0
-        for log in reversed(log_entries):
+        for log in log_entries:
             disp.add_display_item(
                 displayer.DisplayerItemText(log["time"].strftime("%H:%M:%S")), 0, line=i
             )
@@ -569,4 +638,30 @@ def logs():
 
             i += 1
 
+    # Navigation between the pages, keeping the filters
+    parameters = [key + "=" + quote(value) for key, value in request.args.items() if key != "page"]
+    if page > 0 or more:
+        disp.add_master_layout(
+            displayer.DisplayerLayout(
+                displayer.Layouts.VERTICAL,
+                [6, 6],
+                subtitle="",
+                alignment=[displayer.BSalign.L, displayer.BSalign.R],
+            )
+        )
+        if page > 0:
+            disp.add_display_item(
+                displayer.DisplayerItemButtonLink(
+                    "log_newer", "Newer", "chevron-left", "settings.logs", parameters + ["page=" + str(page - 1)]
+                ),
+                0,
+            )
+        if more:
+            disp.add_display_item(
+                displayer.DisplayerItemButtonLink(
+                    "log_older", "Older", "chevron-right", "settings.logs", parameters + ["page=" + str(page + 1)]
+                ),
+                1,
+            )
+
     return render_template("base_content.j2", content=disp.display(), target="")
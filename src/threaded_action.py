@@ -1,15 +1,24 @@
 import threading
-import time
-import copy
 import subprocess
 import logging
 import traceback
+import selectors
+import codecs
+import locale
+import os
+import re
+import sys
 
 
 from submodules.framework.src import threaded_manager
 from submodules.framework.src import scheduler
 from submodules.framework.src import access_manager
 
+PROCESS_READ_SIZE = 65536
+"""Size of the chunks read from the outputs of the local processes"""
+PROCESS_NEWLINES = re.compile(r"\r\n|\r|\n")
+"""Line separators of the outputs of the local processes, as with the universal newlines of readline"""
+
 
 class Threaded_action:
     """Base class to execute long term action. It registeres itself on the thread manager and handle the creation and destruction of the python thread.
@@ -28,6 +37,12 @@ class Threaded_action:
 
     m_error = None
     """A possible error that can be appended to the module for display option"""
+
+    m_pooled = True
+    """If True, the action is executed by the pool of workers of the thread manager. Set it to False for actions that never end, so that they don't hold a worker"""
+
+    m_queued = False
+    """Indicate if the action is waiting for a free worker"""
     
     def __init__(self):       
         self.m_name = None
@@ -35,6 +50,7 @@ class Threaded_action:
         """Constructor"""
         # Prepare the important variable
         self.m_thread_action = None
+        self.m_finished = threading.Event()
         self.m_thread_command = None
         self.m_thread_process_stdout = None
         self.m_thread_process_sterr = None
@@ -47,6 +63,11 @@ class Threaded_action:
         self.m_process = None
         self.m_process_running = False
         self.m_process_results = []
+        self.m_process_condition = threading.Condition()
+        self.m_process_done = threading.Event()
+        self.m_process_partial = {}
+        self.m_process_pipes_open = 0
+        self.m_process_callback = None
 
         self.m_stderr = None
         self.m_stdout = None
@@ -102,10 +123,14 @@ class Threaded_action:
         """Delete the thread and unregister it from the thread manager"""
         self.m_running = False
         threaded_manager.thread_manager_obj.del_thread(self)
+        if self.m_scheduler:
+            self.m_scheduler.wake()
 
-    def process_exec(self, command: list, source_folder: str, shell=True, inputs=None):
-        """Execute a local process command.  This function is not blocking, and will return immediately, even if the command is not over. Use command_wait() to detect the end of the command.
+    def process_exec(self, command: list, source_folder: str, shell=True, inputs=None, callback=None):
+        """Execute a local process command.  This function is not blocking, and will return immediately, even if the command is not over. Use process_wait() to detect the end of the command.
 
+        Both outputs are drained by a single reader thread (one per output on Windows, where pipes can't be selected), without any sleep.
+        The lines are stored in the process results, and can also be consumed as they arrive with process_stream() or the callback.
 
         :param command: The command to execute
         :type command: list
@@ -115,7 +140,13 @@ class Threaded_action:
         :type shell: bool, optional
         :param inputs: a list with detection of a specific string and how to react, defaults to None
         :type inputs: _type_, optional
+        :param callback: A function called from the reader thread with each new line, defaults to None
+        :type callback: Function, optional
         """
+        if inputs:
+            self.m_process_input = inputs
+        self.m_process_callback = callback
+        self.m_process_done.clear()
 
         self.m_process = subprocess.Popen(
             command,
@@ -128,15 +159,22 @@ class Threaded_action:
         )
         self.m_process_running = True
 
-        # Start a reading thread
-        self.m_thread_process_stdout = threading.Thread(
-            target=self.process_read_stdout, daemon=True
-        )
-        self.m_thread_process_stdout.start()
-        self.m_thread_process_stderr = threading.Thread(
-            target=self.process_read_stderr, daemon=True
-        )
-        self.m_thread_process_stderr.start()
+        # Start the reading thread(s)
+        if sys.platform.startswith("win"):
+            self.m_process_pipes_open = 2
+            self.m_thread_process_stdout = threading.Thread(
+                target=self.process_read_pipe, args=(self.m_process, self.m_process.stdout), daemon=True
+            )
+            self.m_thread_process_stdout.start()
+            self.m_thread_process_stderr = threading.Thread(
+                target=self.process_read_pipe, args=(self.m_process, self.m_process.stderr), daemon=True
+            )
+            self.m_thread_process_stderr.start()
+        else:
+            self.m_thread_process_stdout = threading.Thread(
+                target=self.process_read_outputs, args=(self.m_process,), daemon=True
+            )
+            self.m_thread_process_stdout.start()
 
     def process_close(self):
         """Kill and close the local process"""
@@ -151,76 +189,170 @@ class Threaded_action:
         Returns:
             list: The result of the last executed (or executing) process
         """
-        result = copy.copy(self.m_process_results)
-        self.m_process_results = []
+        with self.m_process_condition:
+            result = self.m_process_results
+            self.m_process_results = []
         return result
 
     def process_delete_results(self):
         """Delete the results of the process"""
-        self.m_process_results = []
+        with self.m_process_condition:
+            self.m_process_results = []
+
+    def _process_add_output(self, process: subprocess.Popen, pipe, text: str, final: bool = False):
+        """Split a chunk of output in lines and store them in the process results
+
+        :param process: The process that produced the output
+        :type process: subprocess.Popen
+        :param pipe: The pipe the chunk comes from
+        :type pipe: TextIO
+        :param text: The decoded chunk
+        :type text: str
+        :param final: True when the pipe is closed, so that the last incomplete line is stored too, defaults to False
+        :type final: bool, optional
+        """
+        buffered = self.m_process_partial.get(pipe, "") + text
+        # A final "\r" may be the first half of a "\r\n" split across two chunks: it is kept for the next one
+        carry = "\r" if buffered.endswith("\r") and not final else ""
+        if carry:
+            buffered = buffered[:-1]
+        # The progress outputs that redraw their line with a bare "\r" give one line per redraw
+        lines = PROCESS_NEWLINES.split(buffered)
+        self.m_process_partial[pipe] = lines.pop() + carry
+        lines = [line + "\n" for line in lines]
+        if final and self.m_process_partial[pipe]:
+            lines.append(self.m_process_partial.pop(pipe))
+
+        if not lines:
+            return
 
-    def process_read_stderr(self):
-        """Read thread for the error output of the currently executing local process"""
-        while self.m_process and self.m_process.poll() is None:
-            try:
-                line = self.m_process.stderr.readline()
-                self.m_process_results.append(line)
-            except Exception:
-                self.m_process_running = False
-            time.sleep(0.1)
+        if pipe is process.stdout and self.m_process_input:
+            for line in lines:
+                if self.m_process_input[0] in line:
+                    try:
+                        process.stdin.write(self.m_process_input[1])
+                        process.stdin.close()
+                    except Exception as e:
+                        self.m_logger.info("Process input failed: " + str(e))
+                    self.m_process_input = []
+                    break
+
+        with self.m_process_condition:
+            self.m_process_results.extend(lines)
+            self.m_process_condition.notify_all()
+
+        if self.m_process_callback:
+            for line in lines:
+                try:
+                    self.m_process_callback(line)
+                except Exception as e:
+                    self.m_logger.info("Process callback failed: " + str(e))
+
+    def _process_finished(self, process: subprocess.Popen):
+        """Called when all the outputs of the process are closed
 
-        # Process is done, read any line that might still be there
+        :param process: The finished process
+        :type process: subprocess.Popen
+        """
         try:
-            lines = self.m_process.stderr.readlines()
-            for line in lines:
-                self.m_process_results.append(line)
+            process.wait()
+        except Exception:
+            pass
 
+        with self.m_process_condition:
             self.m_process_running = False
-        except Exception:
-            # If we kill the process there won't be anything left to read: it's ok.
-            self.m_command_running = False
-            return
-        return
+            self.m_process_condition.notify_all()
+        self.m_process_done.set()
+
+    def process_read_outputs(self, process: subprocess.Popen):
+        """Read thread for both outputs of the currently executing local process, using a selector"""
+        encoding = locale.getpreferredencoding(False)
+        selector = selectors.DefaultSelector()
+        decoders = {}
+        for pipe in (process.stdout, process.stderr):
+            selector.register(pipe.fileno(), selectors.EVENT_READ, pipe)
+            decoders[pipe] = codecs.getincrementaldecoder(encoding)(errors="replace")
 
-    def process_read_stdout(self):
-        """Read thread for the standard output of the currently executing local process"""
-        while self.m_process_running and self.m_process.poll() is None:
-            try:
-                line = self.m_process.stdout.readline()
-                if self.m_process_input:
-                    if self.m_process_input[0] in line:
-                        self.m_process.communicate(input=self.m_process_input[1])
-                self.m_process_results.append(line)
-            except Exception:
-                self.m_process_running = False
-            time.sleep(0.1)
-
-        # Process is done, read any line that might still be there
         try:
-            lines = self.m_process.stdout.readlines()
-            for line in lines:
-                self.m_process_results.append(line)
+            while selector.get_map():
+                for key, _ in selector.select():
+                    pipe = key.data
+                    try:
+                        data = os.read(key.fd, PROCESS_READ_SIZE)
+                    except OSError:
+                        # If we kill the process there won't be anything left to read: it's ok.
+                        data = b""
+
+                    if data:
+                        self._process_add_output(process, pipe, decoders[pipe].decode(data))
+                    else:
+                        selector.unregister(key.fd)
+                        self._process_add_output(process, pipe, decoders[pipe].decode(b"", final=True), final=True)
+        finally:
+            selector.close()
+            self._process_finished(process)
+
+    def process_read_pipe(self, process: subprocess.Popen, pipe):
+        """Read thread for one output of the currently executing local process, used where pipes can't be selected"""
+        decoder = codecs.getincrementaldecoder(locale.getpreferredencoding(False))(errors="replace")
+        while True:
+            try:
+                data = os.read(pipe.fileno(), PROCESS_READ_SIZE)
+            except (OSError, ValueError):
+                # If we kill the process there won't be anything left to read: it's ok.
+                data = b""
+
+            if not data:
+                self._process_add_output(process, pipe, decoder.decode(b"", final=True), final=True)
+                break
+            self._process_add_output(process, pipe, decoder.decode(data))
+
+        with self.m_process_condition:
+            self.m_process_pipes_open -= 1
+            last = self.m_process_pipes_open == 0
+        if last:
+            self._process_finished(process)
+
+    def process_stream(self, timeout: float = None):
+        """Generator that yields the lines of the currently executing local process as they arrive, until it is over.
+        The yielded lines are removed from the process results.
+
+        :param timeout: The maximum time to wait for a new line, in seconds, defaults to None (no limit)
+        :type timeout: float, optional
+        :yield: The lines of the process outputs
+        :rtype: str
+        """
+        while True:
+            with self.m_process_condition:
+                if not self.m_process_results and self.m_process_running:
+                    self.m_process_condition.wait(timeout)
+                lines = self.m_process_results
+                self.m_process_results = []
+                running = self.m_process_running
 
-            self.m_process_running = False
-        except Exception:
-            # If we kill the process there won't be anything left to read: it's ok.
-            self.m_command_running = False
-            return
-        return
+            for line in lines:
+                yield line
 
-    def process_wait(self):
-        """Wait for the currently executing local process to finish"""
-        # TODO: must be semaphored
-        while 1:
-            time.sleep(0.3)
-            if not self.m_process_running:
+            if not lines and (not running or timeout is not None):
                 return
 
+    def process_wait(self, timeout: float = None) -> bool:
+        """Wait for the currently executing local process to finish
+
+        :param timeout: The maximum time to wait, in seconds, defaults to None (no limit)
+        :type timeout: float, optional
+        :return: True if the process is over, False if the timeout expired
+        :rtype: bool
+        """
+        if not self.m_process_running:
+            return True
+        return self.m_process_done.wait(timeout)
+
     def process_read_results(self):
         """Read the raw results of the last executed (executing) process, and delete them"""
-        # TODO: must be semaphored
-        result = copy.copy(self.m_process_results)
-        self.m_process_results = []
+        with self.m_process_condition:
+            result = self.m_process_results
+            self.m_process_results = []
         return result
 
     def action(self):
@@ -241,15 +373,25 @@ class Threaded_action:
         if not self.m_background:
             # Wait a bit to finish all the reading, we are not in a hurry anyway...
             self.delete()
+        self.m_finished.set()
         return
 
     def start(self):
         """Thread start"""
-        self.m_thread_action = threading.Thread(target=self.thread_process, daemon=True)
-        self.m_thread_action.start()
+        manager = threaded_manager.thread_manager_obj
+        if manager.m_pool_mode and self.m_pooled:
+            manager.submit(self)
+        else:
+            self.m_thread_action = threading.Thread(target=self.thread_process, daemon=True)
+            self.m_thread_action.start()
+        if self.m_scheduler:
+            self.m_scheduler.wake()
         return
 
     def wait_finished(self):
         """Thread finish"""
-        self.m_thread_action.join()
+        if self.m_thread_action:
+            self.m_thread_action.join()
+        else:
+            self.m_finished.wait()
         return
\ No newline at end of file
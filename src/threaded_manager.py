@@ -1,5 +1,7 @@
 import threading
 import logging
+import queue
+from collections import deque
 from submodules.framework.src import log_utils
 
 thread_manager_obj = None
@@ -8,8 +10,28 @@ thread_manager_obj = None
 class Threaded_manager:
     """Manage the different threads of the framework"""
 
+    m_pool_mode = True
+    """If True, the threaded actions are executed by a bounded pool of workers. Otherwise, one thread is created per action"""
+
+    m_max_workers = 16
+    """Maximum number of threaded actions running at the same time, all names included"""
+
     def __init__(self):
         self.m_running_threads = []  # ✅ déplacement ici : variable d'instance
+
+        self.m_concurrency = {}
+        """Maximum number of threaded actions running at the same time, by m_default_name. Names that are not listed are only limited by m_max_workers"""
+
+        self.m_tasks = queue.Queue()
+        """Actions given to the pool, waiting for a worker"""
+        self.m_workers = []
+        self.m_idle_workers = 0
+        """Workers waiting for an action, and not reserved by an action already given to the pool"""
+        self.m_backlog = 0
+        """Actions given to the pool while all the workers were busy"""
+        self.m_pool_lock = threading.Lock()
+        self.m_pending = {}
+        self.m_running_count = {}
         log_utils.setup_logging()
         self.m_logger = logging.getLogger("website")
         self.m_logger.info("Scheduler started")
@@ -37,12 +59,116 @@ class Threaded_manager:
             self.m_logger.info("Thread deletion failed: " + str(e))
             pass
 
+        # A queued action that is deleted will never be started
+        with self.m_pool_lock:
+            pending = self.m_pending.get(thread.m_default_name)
+            if pending and thread in pending:
+                pending.remove(thread)
+
         try:
             self.m_running_threads.remove(thread)
         except Exception as e:
             self.m_logger.info("Thread removal failed: " + str(e))
             pass
 
+    def set_concurrency(self, name: str, limit: int):
+        """Set the maximum number of threaded actions with the given name that can run at the same time.
+        The other ones are queued and started in order when a slot is free.
+
+        :param name: The m_default_name of the threaded actions
+        :type name: str
+        :param limit: The maximum number of running actions, or None for no limit
+        :type limit: int
+        """
+        if limit is None:
+            self.m_concurrency.pop(name, None)
+        else:
+            self.m_concurrency[name] = limit
+
+    def submit(self, thread) -> bool:
+        """Execute a threaded action in the pool of workers, or queue it if the concurrency limit of its name is reached
+
+        :param thread: The threaded action to execute
+        :type thread: Threaded_action
+        :return: True if the action has been given to the pool, False if it is waiting for another action of the same name to finish
+        :rtype: bool
+        """
+        name = thread.m_default_name
+        with self.m_pool_lock:
+            thread.m_queued = True
+            limit = self.m_concurrency.get(name)
+            if limit is not None and self.m_running_count.get(name, 0) >= limit:
+                self.m_pending.setdefault(name, deque()).append(thread)
+                self.m_logger.info(f"Threaded action {name} queued ({len(self.m_pending[name])} waiting)")
+                return False
+
+            self._execute(thread)
+            return True
+
+    def _execute(self, thread):
+        """Give a threaded action to the pool of workers. Must be called with the pool lock held
+
+        :param thread: The threaded action to execute
+        :type thread: Threaded_action
+        """
+        name = thread.m_default_name
+        self.m_running_count[name] = self.m_running_count.get(name, 0) + 1
+        if self.m_idle_workers > 0:
+            self.m_idle_workers -= 1
+        elif len(self.m_workers) < self.m_max_workers:
+            # Daemon workers, like the threads of the actions outside of the pool: an action that never ends doesn't
+            # prevent the interpreter from exiting
+            worker = threading.Thread(
+                target=self._worker, name=f"threaded_action_{len(self.m_workers)}", daemon=True
+            )
+            self.m_workers.append(worker)
+            worker.start()
+        else:
+            self.m_backlog += 1
+        self.m_tasks.put(thread)
+
+    def _worker(self):
+        """Worker function of the pool: execute the actions given to the pool, one at a time"""
+        while True:
+            thread = self.m_tasks.get()
+            try:
+                thread.m_queued = False
+                thread.thread_process()
+            except Exception as e:
+                self.m_logger.warning("Threaded action failed: " + str(e))
+            finally:
+                with self.m_pool_lock:
+                    # The worker takes the next action of the backlog, or waits for the next one
+                    if self.m_backlog > 0:
+                        self.m_backlog -= 1
+                    else:
+                        self.m_idle_workers += 1
+                self._release(thread)
+
+    def _release(self, thread):
+        """Free the slot of a finished threaded action and start the next queued action of the same name, if any
+
+        :param thread: The finished threaded action
+        :type thread: Threaded_action
+        """
+        name = thread.m_default_name
+        with self.m_pool_lock:
+            self.m_running_count[name] = max(0, self.m_running_count.get(name, 0) - 1)
+            pending = self.m_pending.get(name)
+            if pending:
+                self._execute(pending.popleft())
+
+    def get_queue_depth(self, name: str = None) -> int:
+        """Return the number of threaded actions that are waiting to be executed
+
+        :param name: The m_default_name of the actions, defaults to None (all the names)
+        :type name: str, optional
+        :return: The number of queued actions
+        :rtype: int
+        """
+        threads = self.get_threads_by_name(name) if name else self.get_all_threads()
+        return len([t for t in threads if getattr(t, "m_queued", False)])
+
     def get_all_threads(self) -> list:
         """Return all threads currently managed"""
         return self.m_running_threads.copy()
@@ -7,10 +7,11 @@ from submodules.framework.src import displayer
 from submodules.framework.src import SFTPConnection
 
 from submodules.framework.src import threaded_action
+from submodules.framework.src import archive_utils
+from submodules.framework.src import listing_cache
 
 import os
 import zipfile
-import tarfile
 import pathlib
 import sys
 import platform
@@ -71,16 +72,32 @@ class SETUP_Updater(threaded_action.Threaded_action):
 
         if self.m_action in ("update", "load_update_file"):
             self.m_scheduler.emit_status(self.get_name(), "Applying update", 103)
-            current_param = utilities.util_read_parameters() or {}
+            current_param = utilities.util_copy_parameters() or {}
 
-            # --- Get list of files in archive before extraction ---
-            files_in_archive = set()
-            if platform.system().lower() == "windows":
-                with zipfile.ZipFile(os.path.join(self.m_file), mode="r") as zf:
-                    files_in_archive = {os.path.normpath(name) for name in zf.namelist()}
-            else:
-                with tarfile.open(os.path.join(self.m_file), mode="r:gz") as tf:
-                    files_in_archive = {os.path.normpath(member.name) for member in tf.getmembers() if member.isfile()}
+            # --- Check the archive against its manifest, before anything is changed ---
+            # Integrity only; an archive without manifest is accepted unless archive_utils.MANIFEST_REQUIRED is set
+            try:
+                archive_utils.check_archive(self.m_file)
+            except (ValueError, OSError) as e:
+                self.m_logger.warning(f"Update verification failed: {e}")
+                self.m_scheduler.emit_status(self.get_name(), "Applying update", 101, supplement=str(e))
+                return
+
+            # --- Unzip / Untar, streamed ---
+            # The paths are checked and the files already installed with the same content are not rewritten
+            def extract_progress(name, percent):
+                self.m_scheduler.emit_status(self.get_name(), "Applying update", percent, name)
+
+            try:
+                result = archive_utils.extract_archive(self.m_file, "../", extract_progress)
+            except Exception as e:
+                self.m_logger.info("Update extraction failed: " + str(e))
+                self.m_scheduler.emit_status(self.get_name(), "Applying update", 101, str(e))
+                return
+            files_in_archive = result["files"]
+            self.m_logger.info(
+                f"Update extracted: {result['written']} files written, {result['skipped']} already up to date"
+            )
 
             # --- Clean obsolete files ---
             # Remove files that exist in the installation but not in the new archive
@@ -99,25 +116,6 @@ class SETUP_Updater(threaded_action.Threaded_action):
                     except Exception as e:
                         self.m_logger.warning(f"Failed to remove obsolete file {file_path}: {e}")
 
-            # --- Unzip / Untar ---
-            if platform.system().lower() == "windows":
-                with zipfile.ZipFile(os.path.join(self.m_file), mode="r") as zf:
-                    zf.extractall(path="../")
-            else:
-                # Safe extraction for tar.gz
-                def is_within_directory(directory, target):
-                    abs_directory = os.path.abspath(directory)
-                    abs_target = os.path.abspath(target)
-                    return os.path.commonprefix([abs_directory, abs_target]) == abs_directory
-
-                dest = "../"
-                with tarfile.open(os.path.join(self.m_file), mode="r:gz") as tf:
-                    for member in tf.getmembers():
-                        target_path = os.path.join(dest, member.name)
-                        if not is_within_directory(dest, target_path):
-                            raise Exception(f"Blocked path traversal in tar member: {member.name}")
-                    tf.extractall(path=dest)
-
             # Recharger le nouveau config.json (qui vient d'être écrasé par l'archive)
             # IMPORTANT: Lire directement le fichier pour éviter le cache de util_read_parameters
             with open("website/config.json", 'r', encoding="utf-8") as f:
@@ -175,7 +173,7 @@ class SETUP_Updater(threaded_action.Threaded_action):
                 if topic not in new_param:
                     current_param.pop(topic)
 
-            utilities.util_write_parameters(current_param)
+            utilities.util_write_parameters(current_param, flush=True)
 
             # Configuration pour le lancement du bootloader
             if platform.system().lower() == "windows":
@@ -234,15 +232,18 @@ class SETUP_Updater(threaded_action.Threaded_action):
             )
             config = utilities.util_read_parameters()
             if config["updates"]["source"]["value"] == "Folder":
-                shutil.copyfile(
-                    os.path.join(
-                        config["updates"]["folder"]["value"],
-                        "updates",
-                        site_conf_obj.m_app["name"],
-                        self.m_file,
-                    ),
-                    os.path.join("downloads", self.m_file),
+                source_path = os.path.join(
+                    config["updates"]["folder"]["value"],
+                    "updates",
+                    site_conf_obj.m_app["name"],
+                    self.m_file,
                 )
+                shutil.copyfile(source_path, os.path.join("downloads", self.m_file))
+                if os.path.isfile(source_path + archive_utils.MANIFEST_SUFFIX):
+                    shutil.copyfile(
+                        source_path + archive_utils.MANIFEST_SUFFIX,
+                        os.path.join("downloads", self.m_file) + archive_utils.MANIFEST_SUFFIX,
+                    )
 
             # FTP mode
             elif config["updates"]["source"]["value"] == "FTP":
@@ -257,8 +258,30 @@ class SETUP_Updater(threaded_action.Threaded_action):
 
                     local_file_path = os.path.join("updates", self.m_file)
 
-                    # Téléchargement du fichier
-                    sftp_conn.download_file(remote_file_path, local_file_path)
+                    # Téléchargement du fichier (repris s'il a été interrompu), puis de son manifeste
+                    sftp_conn.download_file(
+                        remote_file_path,
+                        local_file_path,
+                        SFTPConnection.status_progress(
+                            self.m_scheduler, self.get_name(), "Downloading archive, this might take a while"
+                        ),
+                    )
+                    try:
+                        sftp_conn.download_file(
+                            remote_file_path + archive_utils.MANIFEST_SUFFIX,
+                            local_file_path + archive_utils.MANIFEST_SUFFIX,
+                        )
+                    except FileNotFoundError:
+                        # Archive envoyée sans manifeste : elle sera appliquée sans vérification
+                        if os.path.isfile(local_file_path + archive_utils.MANIFEST_SUFFIX):
+                            os.remove(local_file_path + archive_utils.MANIFEST_SUFFIX)
+
+                    # Une archive corrompue n'est pas gardée, elle serait proposée à l'application
+                    try:
+                        archive_utils.verify_manifest(local_file_path)
+                    except ValueError:
+                        os.remove(local_file_path)
+                        raise
 
                 except Exception as e:
                     self.m_logger.info(f"Update download failed: {e}")
@@ -266,15 +289,21 @@ class SETUP_Updater(threaded_action.Threaded_action):
                         self.get_name(),
                         "Downloading archive, this might take a while",
                         101,
+                        supplement=str(e),
                     )
+                    return
 
             self.m_scheduler.emit_status(
                 self.get_name(), "Downloading archive, this might take a while", 100
             )
+            listing_cache.invalidate_listings()
 
             # Relist the package availables
             try:
-                packages_total = os.listdir(os.path.join("updates"))
+                packages_total = [
+                    pack for pack in os.listdir(os.path.join("updates"))
+                    if not pack.endswith(archive_utils.SIDE_FILE_SUFFIXES)
+                ]
                 packages = []
                 for pack in packages_total:
                     if (
@@ -300,7 +329,8 @@ class SETUP_Updater(threaded_action.Threaded_action):
                 }
             )
             reloader = utilities.util_view_reload_multi_input("update_package", inputs)
-            self.m_scheduler.emit_reload(reloader)
+            # Only the clients viewing the update page have the form
+            self.m_scheduler.emit_reload(reloader, room=self.m_scheduler.room_endpoint("updater.update"))
 
         elif self.m_action == "create":
             pass
@@ -390,15 +420,17 @@ class SETUP_Updater(threaded_action.Threaded_action):
 
                 for file in files_to_upload:
                     try:
-                        shutil.copyfile(
-                            file,
-                            os.path.join(
-                                config["updates"]["folder"]["value"],
-                                "updates",
-                                site_conf_obj.m_app["name"],
-                                os.path.basename(file),
-                            ),
-                        )
+                        # The archive goes with its manifest, verified before it is applied
+                        for copied in (file, archive_utils.write_manifest(file)):
+                            shutil.copyfile(
+                                copied,
+                                os.path.join(
+                                    config["updates"]["folder"]["value"],
+                                    "updates",
+                                    site_conf_obj.m_app["name"],
+                                    os.path.basename(copied),
+                                ),
+                            )
                     except Exception as e:
                         self.m_scheduler.emit_status(self.get_name(), f"Failed to copy file {file}: {str(e)}", 101)
                         return
@@ -428,7 +460,8 @@ class SETUP_Updater(threaded_action.Threaded_action):
                     except FileNotFoundError:
                         sftp_conn.mkdir(remote_dir_4target)
 
-                    # Envoi des fichiers
+                    # Envoi des fichiers, en parallèle
+                    uploads = []
                     for file in files_to_upload:
                         filename = os.path.basename(file)
                         # Les packages 4Target vont dans le sous-dossier 4Target
@@ -438,7 +471,17 @@ class SETUP_Updater(threaded_action.Threaded_action):
                             # Windows/Linux packages restent dans le dossier principal
                             target_dir = remote_dir
                         remote_file_path = os.path.join(target_dir, filename).replace("\\", "/")
-                        sftp_conn.upload_file(file, remote_file_path)  # Upload du fichier
+                        uploads.append((file, remote_file_path))
+                        # Manifeste SHA-256, vérifié avant l'application de la mise à jour
+                        uploads.append(
+                            (archive_utils.write_manifest(file), remote_file_path + archive_utils.MANIFEST_SUFFIX)
+                        )
+                    sftp_conn.upload_files(
+                        uploads,
+                        SFTPConnection.status_progress(
+                            self.m_scheduler, self.get_name(), "Uploading updates, this might take a while"
+                        ),
+                    )
 
                 except Exception as e:
                     self.m_logger.info(f"Update upload failed: {e}")
@@ -451,6 +494,7 @@ class SETUP_Updater(threaded_action.Threaded_action):
             self.m_scheduler.emit_status(
                 self.get_name(), "Uploading updates, this might take a while", 100
             )
+            listing_cache.invalidate_listings()
 
 
 bp = Blueprint("updater", __name__, url_prefix="/updater")
@@ -543,7 +587,9 @@ def update():
         )
         disp.add_display_item(displayer.DisplayerItemButton("upload", "Upload"), 2)
 
-    to_apply = utilities.util_dir_structure(os.path.join("updates"), ".zip")
+    to_apply = utilities.util_dir_structure(
+        os.path.join("updates"), ".zip", exclusion=archive_utils.SIDE_FILE_SUFFIXES
+    )
     disp.add_master_layout(
         displayer.DisplayerLayout(
             displayer.Layouts.VERTICAL,
@@ -564,8 +610,25 @@ def update():
 
     # Folder mode
     if config["updates"]["source"]["value"] == "Folder":
-        if not os.path.exists(os.path.join(config["updates"]["folder"]["value"])):
-            info = "Configured update folder doesn't exists"
+        folder = config["updates"]["folder"]["value"]
+        package_dir = os.path.join(folder, "updates", site_conf_obj.m_app["name"])
+
+        def list_folder():
+            if not os.path.exists(os.path.join(folder)):
+                raise FileNotFoundError(folder)
+            return utilities.util_dir_structure(
+                package_dir, inclusion=[".zip"], exclusion=archive_utils.SIDE_FILE_SUFFIXES
+            )
+
+        # The listing of the share comes from the cache, refreshed in the background
+        content, error = listing_cache.get_listing(("Folder", package_dir), list_folder)
+        if isinstance(error, FileNotFoundError) or content is None:
+            if isinstance(error, FileNotFoundError):
+                info = "Configured update folder doesn't exists"
+            elif error is not None:
+                info = "Configured update folder not accessible: " + str(error)
+            else:
+                info = "The list of updates is being retrieved, please reload the page in a moment"
             disp.add_master_layout(
                 displayer.DisplayerLayout(
                     displayer.Layouts.VERTICAL,
@@ -578,14 +641,6 @@ def update():
                 displayer.DisplayerItemAlert(info, displayer.BSstyle.INFO), 0
             )
         else:
-            content = utilities.util_dir_structure(
-                os.path.join(
-                    config["updates"]["folder"]["value"],
-                    "updates",
-                    site_conf_obj.m_app["name"],
-                ),
-                inclusion=[".zip"],
-            )
             disp.add_master_layout(
                 displayer.DisplayerLayout(
                     displayer.Layouts.VERTICAL,
@@ -613,32 +668,38 @@ def update():
 
     # FTP mode
     elif config["updates"]["source"]["value"] == "FTP":
-        try:
-            sftp_conn = SFTPConnection.SFTPConnection(
-                config["updates"]["address"]["value"],
-                config["updates"]["user"]["value"],
-                config["updates"]["password"]["value"]
-            )
+        sftp_conn = SFTPConnection.SFTPConnection(
+            config["updates"]["address"]["value"],
+            config["updates"]["user"]["value"],
+            config["updates"]["password"]["value"]
+        )
 
-            # Définition du chemin distant
-            remote_path = os.path.join(
-                config["updates"]["path"]["value"],
-                "updates",
-                site_conf_obj.m_app["name"]
-            ).replace("\\", "/")  # Assure la compatibilité Windows/Linux
+        # Définition du chemin distant
+        remote_path = os.path.join(
+            config["updates"]["path"]["value"],
+            "updates",
+            site_conf_obj.m_app["name"]
+        ).replace("\\", "/")  # Assure la compatibilité Windows/Linux
 
-            # Liste des fichiers dans le dossier distant
+        def list_server():
             try:
-                content = sftp_conn.listdir(remote_path)
-                content = [item for item in content if platform.system() in item]
+                return [
+                    item for item in sftp_conn.listdir(remote_path)
+                    if not item.endswith(archive_utils.SIDE_FILE_SUFFIXES)
+                ]
             except FileNotFoundError:
-                content = []
-
-            # Fermeture de la connexion SFTP
-            sftp_conn.close()
+                return []
 
-        except Exception:
-            info = "FTP server not accessible, please check your connection, use a zip file or use a local folder"
+        # Liste des fichiers dans le dossier distant, depuis le cache : la page n'attend pas le serveur
+        content, error = listing_cache.get_listing(
+            ("FTP", config["updates"]["address"]["value"], config["updates"]["user"]["value"], remote_path),
+            list_server,
+        )
+        if error is not None or content is None:
+            if error is None:
+                info = "The list of updates is being retrieved from the server, please reload the page in a moment"
+            else:
+                info = "FTP server not accessible, please check your connection, use a zip file or use a local folder"
             disp.add_master_layout(
                 displayer.DisplayerLayout(
                     displayer.Layouts.VERTICAL,
@@ -650,6 +711,7 @@ def update():
             disp.add_display_item(
                 displayer.DisplayerItemAlert(info, displayer.BSstyle.INFO), 0
             )
+        content = [item for item in content or [] if platform.system() in item]
 
         disp.add_master_layout(
             displayer.DisplayerLayout(
@@ -6,22 +6,66 @@ import math
 import serial
 import zlib
 import tarfile
-import time
+import logging
 import re
 import socket
 import shutil
-
-from jinja2 import Environment, FileSystemLoader
+import threading
+import copy
+import tempfile
+import atexit
+
+try:
+    import fcntl
+except ImportError:
+    # Windows: the writers of the process are still serialized by _CONFIG_WRITE_LOCK
+    fcntl = None
+
+from jinja2 import Environment, FileSystemLoader, ChoiceLoader, FileSystemBytecodeCache
 from flask import session
 from submodules.framework.src import displayer
+from submodules.framework.src import file_watcher
 
-CONFIG_GLOBAL = {}
-LAST_ACCESS_CONFIG = None
+CONFIG_GLOBAL = {}  # Snapshot of the configuration, read-only
 CONFIG_FILE_PATH = None  # Cached config file path
 
+# State of the configuration file when CONFIG_GLOBAL was loaded: (inode, mtime, size)
+_CONFIG_STAT = None
+_CONFIG_VERSION = 0
+_CONFIG_DIRTY = True  # Set by the file watcher, always True if inotify isn't available
+_CONFIG_WATCHED = False
+_CONFIG_LOCK = threading.RLock()
+
+# Delayed writing of the configuration
+CONFIG_WRITE_DELAY = 0.5  # seconds during which successive writes are coalesced in one
+CONFIG_RETRY_DELAY = 5.0  # seconds before a failed write is tried again
+_CONFIG_PENDING = None  # Data to write, if a write is waiting
+_CONFIG_TIMER = None
+_CONFIG_WRITE_LOCK = threading.Lock()
+
 # Global on_target detection (cached)
 _ON_TARGET = None
 
+# Process-wide jinja objects, shared with the Flask application (see util_get_jinja_environment)
+_JINJA_LOADER = None
+_JINJA_BYTECODE_CACHE = None
+_JINJA_ENV = None
+_JINJA_LOCK = threading.Lock()
+
+RELOAD_TEMPLATES = [
+    "base_content_reloader.j2",
+    "reload/select.j2",
+    "reload/text.j2",
+    "reload/slider.j2",
+    "reload/int.j2",
+    "reload/select-text.j2",
+    "reload/text-text.j2",
+    "reload/list-select.j2",
+    "reload/list-text.j2",
+    "reload/files.j2",
+]
+"""Templates used by the util_view_reload_* helpers, compiled at startup"""
+
 
 def is_on_target() -> bool:
     """Check if running on target (read-only filesystem).
@@ -406,54 +450,341 @@ def util_post_to_json(data: dict) -> dict:
     return formated
 
 
+class Frozen_dict(dict):
+    """Read-only dictionnary used for the configuration snapshot. It is still a dict for json, jinja and isinstance.
+    A copy (copy.deepcopy, pickle or util_copy_parameters) gives back plain, modifiable, objects.
+    """
+
+    def _read_only(self, *args, **kwargs):
+        raise TypeError("The configuration is read-only, use utilities.util_copy_parameters() to modify it")
+
+    __setitem__ = __delitem__ = __ior__ = _read_only
+    clear = pop = popitem = setdefault = update = _read_only
+
+    def __reduce_ex__(self, protocol):
+        return (dict, (dict(self),))
+
+
+class Frozen_list(list):
+    """Read-only list used for the configuration snapshot, see Frozen_dict"""
+
+    def _read_only(self, *args, **kwargs):
+        raise TypeError("The configuration is read-only, use utilities.util_copy_parameters() to modify it")
+
+    __setitem__ = __delitem__ = __iadd__ = __imul__ = _read_only
+    append = extend = insert = pop = remove = clear = sort = reverse = _read_only
+
+    def __reduce_ex__(self, protocol):
+        return (list, (list(self),))
+
+
+def util_freeze(data):
+    """Return a read-only copy of a json-like structure
+
+    :param data: The structure (dict, list and values)
+    :type data: Any
+    :return: The same structure made of Frozen_dict and Frozen_list
+    :rtype: Any
+    """
+    if isinstance(data, dict):
+        return Frozen_dict((key, util_freeze(value)) for key, value in data.items())
+    if isinstance(data, list):
+        return Frozen_list(util_freeze(value) for value in data)
+    return data
+
+
+def _config_changed(path: str):
+    """Called by the file watcher when the configuration file is modified"""
+    global _CONFIG_DIRTY
+    _CONFIG_DIRTY = True
+
+
+def _config_file_stat(path: str) -> tuple:
+    """Return what identifies a version of the configuration file
+
+    :param path: The path of the file
+    :type path: str
+    :return: (inode, mtime, size), or None if the file can't be accessed
+    :rtype: tuple
+    """
+    try:
+        stat = os.stat(path)
+    except OSError:
+        return None
+    return (stat.st_ino, stat.st_mtime_ns, stat.st_size)
+
+
 def util_read_parameters() -> dict:
-    """Read the parameters of the application, and reload the configuration
-    if it hasn't been accessed in the last 10 seconds.
+    """Read the parameters of the application. The file is only parsed again when it changes (modification time,
+    inode or size), which is notified by inotify where it is available.
 
-    :return: The parameters of the application
+    :return: The parameters of the application, as a read-only snapshot (see util_copy_parameters)
     :rtype: dict
     """
-    global CONFIG_GLOBAL
-    global LAST_ACCESS_CONFIG
+    global CONFIG_GLOBAL, _CONFIG_STAT, _CONFIG_VERSION, _CONFIG_DIRTY, _CONFIG_WATCHED
+
+    # Nothing changed since the last read
+    if not _CONFIG_DIRTY and _CONFIG_STAT is not None:
+        return CONFIG_GLOBAL
+
     config_file_path = _get_config_file_path()
-    reload_interval = 10  # seconds
+    with _CONFIG_LOCK:
+        if not _CONFIG_WATCHED:
+            _CONFIG_WATCHED = True
+            watcher = file_watcher.get_file_watcher()
+            if watcher is None or not watcher.watch(config_file_path, _config_changed):
+                _CONFIG_WATCHED = None  # No notification: the file is checked at each read
+
+        # Cleared before the check, so that a modification during the read is seen next time
+        if _CONFIG_WATCHED:
+            _CONFIG_DIRTY = False
+
+        # Our last write is not on the disk yet, it is the most recent version
+        if _CONFIG_PENDING is not None:
+            return CONFIG_GLOBAL
+
+        stat = _config_file_stat(config_file_path)
+        if stat is not None and stat == _CONFIG_STAT:
+            return CONFIG_GLOBAL
 
-    # If it's the first access or more than 10 seconds have passed, reload the config
-    if not LAST_ACCESS_CONFIG or time.time() - LAST_ACCESS_CONFIG > reload_interval:
         try:
             with open(config_file_path, 'r', encoding="utf-8") as f:
                 config_data = json.load(f)
-            CONFIG_GLOBAL = config_data
+            CONFIG_GLOBAL = util_freeze(config_data)
+            _CONFIG_STAT = stat
+            _CONFIG_VERSION += 1
         except Exception as e:
             # If there's an error, fall back to the last known configuration
-            config_data = CONFIG_GLOBAL
-    else:
-        # If accessed recently, use the cached config
-        config_data = CONFIG_GLOBAL
+            pass
+
+        return CONFIG_GLOBAL
+
 
-    # Update the last access time
-    LAST_ACCESS_CONFIG = time.time()
+def util_copy_parameters() -> dict:
+    """Return a modifiable copy of the parameters of the application, for instance to change them and write them back
 
-    return config_data
+    :return: The parameters of the application
+    :rtype: dict
+    """
+    return copy.deepcopy(util_read_parameters())
+
+
+def util_get_parameters_version() -> int:
+    """Return a number that changes each time the parameters are loaded or written, to invalidate what is computed from them
+
+    :return: The version of the parameters
+    :rtype: int
+    """
+    util_read_parameters()
+    return _CONFIG_VERSION
 
 
-def util_write_parameters(data: dict):
-    """Write the parameters of the application
+def util_write_parameters(data: dict, flush: bool = False):
+    """Write the parameters of the application. The new parameters are used immediately, but the file is written
+    CONFIG_WRITE_DELAY later, so that a burst of writes only gives one file write.
 
     :param data: The new parameters to write
     :type data: dict
+    :param flush: Write the file before returning, for instance before a restart, defaults to False
+    :type flush: bool, optional
     """
-    global CONFIG_GLOBAL
-    global LAST_ACCESS_CONFIG
-    
+    global CONFIG_GLOBAL, _CONFIG_VERSION, _CONFIG_PENDING, _CONFIG_TIMER
+
+    with _CONFIG_LOCK:
+        # Mettre à jour le cache global pour éviter les lectures périmées
+        CONFIG_GLOBAL = util_freeze(data)
+        _CONFIG_VERSION += 1
+        _CONFIG_PENDING = CONFIG_GLOBAL
+
+        if not flush:
+            _start_flush_timer(CONFIG_WRITE_DELAY)
+
+    if flush:
+        util_flush_parameters()
+
+
+def _start_flush_timer(delay: float):
+    """Start the timer of the delayed write, if it is not already started. Must be called with _CONFIG_LOCK
+
+    :param delay: The delay before the write, in seconds
+    :type delay: float
+    """
+    global _CONFIG_TIMER
+
+    if _CONFIG_TIMER is None:
+        _CONFIG_TIMER = threading.Timer(delay, _flush_parameters_delayed)
+        _CONFIG_TIMER.daemon = True
+        _CONFIG_TIMER.start()
+
+
+def _flush_parameters_delayed():
+    """Delayed write of the parameters. A failure is already logged, and the write is tried again"""
+    try:
+        util_flush_parameters()
+    except Exception:
+        pass
+
+
+def _write_parameters_file(data, config_file_path: str):
+    """Write the parameters to the file. The file is replaced atomically: a temporary file is written and synced in
+    the same folder, then renamed over the configuration file.
+
+    :param data: The parameters to write
+    :type data: dict
+    :param config_file_path: The path of the configuration file
+    :type config_file_path: str
+    """
+    folder = os.path.dirname(os.path.abspath(config_file_path))
+    lock_file = None
+    try:
+        if fcntl:
+            # Also serialize with the other processes (authentication server)
+            lock_file = open(os.path.join(folder, ".config.lock"), "w")
+            fcntl.flock(lock_file, fcntl.LOCK_EX)
+
+        fd, tmp_path = tempfile.mkstemp(dir=folder, prefix=".config.", suffix=".tmp")
+        try:
+            with os.fdopen(fd, "w", encoding="utf-8") as f:
+                json.dump(data, f, indent=4)
+                f.flush()
+                os.fsync(f.fileno())
+            if os.path.exists(config_file_path):
+                shutil.copymode(config_file_path, tmp_path)
+            os.replace(tmp_path, config_file_path)
+        except Exception:
+            os.unlink(tmp_path)
+            raise
+
+        if hasattr(os, "O_DIRECTORY"):
+            # Make the rename itself durable
+            dir_fd = os.open(folder, os.O_RDONLY | os.O_DIRECTORY)
+            try:
+                os.fsync(dir_fd)
+            finally:
+                os.close(dir_fd)
+    finally:
+        if lock_file:
+            lock_file.close()
+
+
+def util_flush_parameters():
+    """Write the pending parameters to the file, if any (see _write_parameters_file).
+
+    If the write fails, the parameters stay pending (unless newer ones are already waiting) and the write is tried
+    again CONFIG_RETRY_DELAY later.
+
+    :raises Exception: The error of the write, after it is logged
+    """
+    global _CONFIG_STAT, _CONFIG_PENDING, _CONFIG_TIMER
+
     config_file_path = _get_config_file_path()
-    f = open(config_file_path, "w", encoding="utf-8")
-    json.dump(data, f, indent=4)
-    f.close()
-    
-    # Mettre à jour le cache global pour éviter les lectures périmées
-    CONFIG_GLOBAL = data
-    LAST_ACCESS_CONFIG = time.time()
+    with _CONFIG_WRITE_LOCK:
+        with _CONFIG_LOCK:
+            data = _CONFIG_PENDING
+            _CONFIG_PENDING = None
+            if _CONFIG_TIMER is not None:
+                _CONFIG_TIMER.cancel()
+                _CONFIG_TIMER = None
+        if data is None:
+            return
+
+        try:
+            _write_parameters_file(data, config_file_path)
+        except Exception as e:
+            logging.getLogger("website").error(
+                f"Configuration write failed, tried again in {CONFIG_RETRY_DELAY}s: {e}"
+            )
+            with _CONFIG_LOCK:
+                if _CONFIG_PENDING is None:
+                    _CONFIG_PENDING = data
+                _start_flush_timer(CONFIG_RETRY_DELAY)
+            raise
+
+        with _CONFIG_LOCK:
+            # Our own write must not trigger a reload
+            if _CONFIG_PENDING is None:
+                _CONFIG_STAT = _config_file_stat(config_file_path)
+
+
+atexit.register(util_flush_parameters)
+
+
+def util_get_jinja_loader() -> ChoiceLoader:
+    """Return the process-wide template loader: the website templates override the framework ones.
+    The same loader is used by the Flask application and by the reload helpers.
+
+    :return: The template loader
+    :rtype: ChoiceLoader
+    """
+    global _JINJA_LOADER
+    with _JINJA_LOCK:
+        if _JINJA_LOADER is None:
+            framework_path = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+            _JINJA_LOADER = ChoiceLoader([
+                FileSystemLoader(os.path.join(os.path.dirname(os.path.dirname(framework_path)), "website", "templates")),
+                FileSystemLoader(os.path.join(framework_path, "templates"))
+            ])
+        return _JINJA_LOADER
+
+
+def util_get_jinja_bytecode_cache() -> FileSystemBytecodeCache:
+    """Return the process-wide bytecode cache of the compiled templates, stored in a writable folder
+
+    :return: The bytecode cache, or None if the folder can't be created
+    :rtype: FileSystemBytecodeCache
+    """
+    global _JINJA_BYTECODE_CACHE
+    with _JINJA_LOCK:
+        if _JINJA_BYTECODE_CACHE is None:
+            try:
+                cache_folder = os.path.dirname(get_writable_path(os.path.join("ressources", "jinja_cache", "")))
+                _JINJA_BYTECODE_CACHE = FileSystemBytecodeCache(cache_folder)
+            except OSError:
+                return None
+        return _JINJA_BYTECODE_CACHE
+
+
+def util_get_jinja_environment() -> Environment:
+    """Return the process-wide jinja environment used to render templates outside of a request (reload helpers).
+    The compiled templates are kept in memory and in the bytecode cache, so they are only parsed once.
+
+    :return: The shared environment
+    :rtype: Environment
+    """
+    global _JINJA_ENV
+    if _JINJA_ENV is not None:
+        return _JINJA_ENV
+
+    loader = util_get_jinja_loader()
+    bytecode_cache = util_get_jinja_bytecode_cache()
+    with _JINJA_LOCK:
+        if _JINJA_ENV is None:
+            env = Environment(loader=loader, bytecode_cache=bytecode_cache, auto_reload=False)
+            # Provide a default 't' (translation) passthrough so templates that call
+            # t() still render when we are outside the Flask request context.
+            env.globals.setdefault("t", lambda key, **kwargs: key)
+            _JINJA_ENV = env
+        return _JINJA_ENV
+
+
+def util_precompile_templates(templates: list = None) -> int:
+    """Compile the templates used by the reload helpers, so that the first progress update doesn't pay for it
+
+    :param templates: The names of the templates to compile, defaults to None (RELOAD_TEMPLATES)
+    :type templates: list, optional
+    :return: The number of templates compiled
+    :rtype: int
+    """
+    env = util_get_jinja_environment()
+    compiled = 0
+    for name in templates or RELOAD_TEMPLATES:
+        try:
+            env.get_template(name)
+            compiled += 1
+        except Exception:
+            # Missing template in this application: it will fail at use, as before
+            pass
+    return compiled
 
 
 def util_view_reload_displayer(id: str, disp: displayer) -> dict:
@@ -467,11 +798,7 @@ def util_view_reload_displayer(id: str, disp: displayer) -> dict:
     :rtype: dict
     """
     # And update display
-    env = Environment(loader=FileSystemLoader("submodules/framework/templates/"))
-    # Provide a default 't' (translation) passthrough so templates that call
-    # t() still render when we are outside the Flask request context.
-    env.globals.setdefault("t", lambda key, **kwargs: key)
-    template = env.get_template("base_content_reloader.j2")
+    template = util_get_jinja_environment().get_template("base_content_reloader.j2")
     reloader = template.render(content=disp.display(True))  # Bypass authentification here
 
     to_render = [{"id": id, "content": reloader}]
@@ -524,7 +851,7 @@ def util_view_reload_multi_input(index: str, inputs: dict) -> dict:
     :rtype: dict
     """
 
-    env = Environment(loader=FileSystemLoader("submodules/framework/templates/"))
+    env = util_get_jinja_environment()
     to_render = []
     for processing in inputs:
         if processing["type"] == "select":
@@ -664,8 +991,7 @@ def util_view_reload_input_file_manager(
     :rtype: dict
 
     """
-    env = Environment(loader=FileSystemLoader("submodules/framework/templates/"))
-    template = env.get_template("reload/files.j2")
+    template = util_get_jinja_environment().get_template("reload/files.j2")
     to_render = []
     for i, file in enumerate(files):
         to_render.append(
@@ -740,7 +1066,7 @@ def util_find_files(root: str, inclusion: list = None) -> list:
 
 
 def util_dir_structure(
-    root: str, inclusion: list = None, modifier=None, clean=True
+    root: str, inclusion: list = None, modifier=None, clean=True, exclusion: list = None
 ) -> dict:
     """Create the directory structure (all the directories and subfiles) recursively from a root folder
 
@@ -752,6 +1078,8 @@ def util_dir_structure(
     :type modifier: _type_, optional
     :param clean: Clean all empty folder from the results, defaults to True
     :type clean: bool, optional
+    :param exclusion: A list of exclusion, that is part of the file name that must not be present in the files listed, defaults to None
+    :type exclusion: list, optional
     :return: A dictionnary with the file structure in the form:
 
     code-block::
@@ -772,6 +1100,8 @@ def util_dir_structure(
 
     for item in items:
         if os.path.isfile(os.path.join(root, item)):
+            if exclusion and any(exclu in item for exclu in exclusion):
+                continue
             if inclusion:
                 for inclu in inclusion:
                     if inclu in item:
@@ -781,7 +1111,7 @@ def util_dir_structure(
                             current_dir[item] = os.path.join(root, item)
         else:
             directory = util_dir_structure(
-                os.path.join(root, item), inclusion=inclusion, modifier=modifier
+                os.path.join(root, item), inclusion=inclusion, modifier=modifier, exclusion=exclusion
             )
             if clean:
                 if len(directory) > 0:
@@ -940,10 +1270,12 @@ def utils_format_unit(cpnt: dict) -> dict:
 
 
 def utils_calculate_crc32(filepath):
-    """Calcule le CRC32 d'un fichier donné."""
+    """Calcule le CRC32 d'un fichier donné, par blocs pour ne pas le charger entièrement en mémoire."""
+    crc = 0
     with open(filepath, 'rb') as file:
-        content = file.read()
-        return zlib.crc32(content)
+        for block in iter(lambda: file.read(1024 * 1024), b''):
+            crc = zlib.crc32(block, crc)
+    return crc
 
 
 def utils_get_directory_crc32(directory_path):
@@ -433,7 +433,7 @@ $(document).ready(function() {
     
     // Émettre user_connected immédiatement et régulièrement
     function test_connect(){
-        socket.emit("user_connected");
+        socket.emit("user_connected", {endpoint: window.pageEndpoint || ""});
     }
     
     // Connexion initiale - immédiate dans iframe, avec délai sinon
@@ -531,8 +531,15 @@ $(document).ready(function() {
         }
     };
 
+    // Handlers of the scheduler events, by event name, so that they can also be called from a batch event
+    let socketHandlers = {}
+    function onSocket(eventName, handler) {
+        socketHandlers[eventName] = handler
+        socket.on(eventName, handler)
+    }
+
     // Update top bar
-    socket.on( 'content', function( msg ) {
+    onSocket( 'content', function( msg ) {
         for(let id of Object.keys(msg))
         {
             let div = document.getElementById(id + "_content")
@@ -543,9 +550,13 @@ $(document).ready(function() {
 
     // Store previous threads data to avoid unnecessary DOM updates
     let previousThreadsKey = ""
+    // Current threads list, updated by the threads_delta events
+    let threadsState = []
     
-    socket.on('threads', function(msg) 
+    onSocket('threads', function(msg) 
     {
+        threadsState = msg.slice()
+
         // Create a key from the data to detect real changes
         let currentKey = JSON.stringify(msg)
         if(currentKey === previousThreadsKey) return
@@ -575,10 +586,11 @@ $(document).ready(function() {
                 let baseName = name.replace(/[_\s]?#\d+$/, '')
                 if(!grouped[baseName])
                 {
-                    grouped[baseName] = { count: 0, states: [] }
+                    grouped[baseName] = { count: 0, states: [], queued: [] }
                 }
                 grouped[baseName].count++
                 grouped[baseName].states.push(msg[i]["state"])
+                grouped[baseName].queued.push(msg[i]["queued"])
             }
             
             // Build content from grouped data - each process on its own line
@@ -595,7 +607,12 @@ $(document).ready(function() {
                 for(let idx = 0; idx < info.states.length; idx++)
                 {
                     let state = info.states[idx]
-                    if(state == -1)
+                    if(info.queued[idx])
+                    {
+                        // Waiting for a free worker
+                        progressParts.push('<i class="mdi mdi-timer-sand text-light"></i>')
+                    }
+                    else if(state == -1)
                     {
                         progressParts.push('<div class="spinner-border spinner-border-sm text-light" role="status"></div>')
                     }
@@ -624,7 +641,7 @@ $(document).ready(function() {
             div.innerHTML = content
         }
     })
-    socket.on( 'reload', function( msg ) {
+    onSocket( 'reload', function( msg ) {
         let div = document.getElementById(msg["id"])
         if(div)
             div.innerHTML = msg["content"]
@@ -642,19 +659,19 @@ $(document).ready(function() {
         });
     })
 
-    socket.on( 'result', function( msg ) {
+    onSocket( 'result', function( msg ) {
         let div = document.getElementById("progress_result")
         if(div)
             div.innerHTML = '<div class="alert alert-' + msg["category"] + '">' + msg["text"] + '</div>'
     })
 
-    socket.on( 'modal', function( msg ) {
+    onSocket( 'modal', function( msg ) {
         let div = document.getElementById(msg["id"] + "_content")
         if(div)
             div.innerHTML = msg["text"]
     })
 
-    socket.on( 'popup', function( msg ) {
+    onSocket( 'popup', function( msg ) {
         // Ne pas afficher les popups dans le parent quand le système d'onglets est actif
         // (le popup sera affiché dans l'iframe via postMessage)
         if (!isInIframe && document.getElementById('tab-bar')) {
@@ -681,7 +698,7 @@ $(document).ready(function() {
         }
     })
 
-    socket.on( 'button', function( msg ) {
+    onSocket( 'button', function( msg ) {
         for(let id of Object.keys(msg))
         {
             let div = document.getElementById(id)
@@ -694,7 +711,7 @@ $(document).ready(function() {
         }
     })
 
-    socket.on( 'enable_button', function( msg ) {
+    onSocket( 'enable_button', function( msg ) {
         for(var i = 0; i < msg.length; i++)
         {
             let button = document.getElementById(msg[i])
@@ -704,7 +721,7 @@ $(document).ready(function() {
         }
     })
 
-    socket.on( 'disable_button', function( msg ) {
+    onSocket( 'disable_button', function( msg ) {
         for(var i = 0; i < msg.length; i++)
         {
             console.log(msg[i])
@@ -713,7 +730,7 @@ $(document).ready(function() {
         }
     })
 
-    socket.on( 'action_status', function( msg ) {
+    onSocket( 'action_status', function( msg ) {
         // Translate emit_status message text using i18n dictionary
         function tr(text) {
             if (window.i18n && window.i18n.msg) {
@@ -805,6 +822,32 @@ $(document).ready(function() {
         
     })
 
+    // Only the threads that changed since the last cycle
+    onSocket('threads_delta', function(msg) {
+        let state = threadsState.filter(t => !msg["removed"].includes(t["name"]))
+        for (let entry of msg["changed"])
+        {
+            let idx = state.findIndex(t => t["name"] == entry["name"])
+            if (idx >= 0)
+                state[idx] = entry
+            else
+                state.push(entry)
+        }
+        socketHandlers['threads'](state)
+    })
+
+    // All the events of a scheduler cycle, in the form {event: [msg, ...]}
+    socket.on('batch', function(batch) {
+        for (let eventName of Object.keys(batch))
+        {
+            let handler = socketHandlers[eventName]
+            if (!handler)
+                continue
+            for (let msg of batch[eventName])
+                handler(msg)
+        }
+    })
+
     // Delay the focus slightly to ensure rendering is complete
     const focusables = [...document.querySelectorAll('.focusable')];
     setTimeout(() => {